@@ -1,12 +1,41 @@
+import atexit
 import json
 import mimetypes
 import os
+import signal
+import socket
+import sys
+import threading
 import time
 import urllib.error
 import urllib.request
 import urllib.parse
-from typing import Dict, List, Optional, Set
-from datetime import datetime, timezone
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterator, List, Optional, Set, TypeVar, Union
+from datetime import date, datetime, timedelta, timezone
+
+from planner import build_slots, plan_tasks
+from scheduler import FeedScheduler
+from sessions import open_store, transition
+from routing import DEFAULT_DURATION_MINUTES, category_durations, leg_distances, schedule, sequence_points
+import codec
+from changefeed import ChangeFeed
+from dedupe import NearDuplicateIndex
+from digest import DigestCoalescer
+from leases import AdvisoryLease, LeaderElector, PostgrestLease
+from limiter import LimiterBusy, PriorityLimiter
+from metrics import LAG_BUCKETS, Registry, serve as serve_metrics
+from messages import TELEGRAM_CAPTION_LIMIT, render_message, to_plain_text, validate
+from profiler import SamplingProfiler
+from queries import Query
+from replay import ReplayWorker
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, Upstream, UpstreamRegistry
+from rollups import DailyRollups, complaint_zone, day_bounds, local_day
+from sketches import SketchWindow, percentiles
+from tracing import JsonlExporter, OtlpExporter, Tracer, span, traced
+from writes import WriteBatcher
 
 
 def load_env_file(path: str) -> None:
@@ -28,6 +57,7 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 load_env_file(os.path.join(BASE_DIR, '.env.local'))
 
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '').strip()
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').strip().rstrip('/')
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '').strip()
 SUPABASE_ANON_KEY = os.environ.get('SUPABASE_ANON_KEY', '').strip()
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get('SUPABASE_SERVICE_ROLE_KEY', '').strip()
@@ -40,45 +70,262 @@ WXO_AGENT_ID = os.environ.get('WXO_AGENT_ID', 'addd6d7a-97ab-44db-8774-30fb15f7a
 POLL_TIMEOUT = int(os.environ.get('TELEGRAM_POLL_TIMEOUT', '50'))
 MAX_HISTORY = int(os.environ.get('WXO_MAX_HISTORY', '12'))
 DISPATCH_POLL_INTERVAL = int(os.environ.get('DISPATCH_POLL_INTERVAL', '15'))
+FEED_MIN_INTERVAL = float(os.environ.get('FEED_MIN_INTERVAL', '2'))
+FEED_MAX_INTERVAL = float(os.environ.get('FEED_MAX_INTERVAL', '120'))
+FEED_JITTER = float(os.environ.get('FEED_JITTER', '0.1'))
 DISPATCH_TELEGRAM_USER_ID = os.environ.get('DISPATCH_TELEGRAM_USER_ID', '297484629').strip()
 DISPATCH_MEDIA_TELEGRAM_USER_ID = os.environ.get('DISPATCH_MEDIA_TELEGRAM_USER_ID', '836447627').strip()
 DISPATCH_LOOKBACK_SECONDS = int(os.environ.get('DISPATCH_LOOKBACK_SECONDS', '3600'))
 TELEGRAM_MINIAPP_URL = os.environ.get('TELEGRAM_MINIAPP_URL', '').strip()
+DIGEST_MAX_HOLD_SECONDS = float(os.environ.get('DIGEST_MAX_HOLD_SECONDS', '0'))
+TELEGRAM_FILE_ID_CACHE_SIZE = int(os.environ.get('TELEGRAM_FILE_ID_CACHE_SIZE', '2000'))
+ROLLUP_UTC_OFFSET_HOURS = int(os.environ.get('ROLLUP_UTC_OFFSET_HOURS', '8'))
+ROLLUP_REFRESH_SECONDS = int(os.environ.get('ROLLUP_REFRESH_SECONDS', '3600'))
+SLA_DEFAULT_DAYS = int(os.environ.get('SLA_DEFAULT_DAYS', '7'))
+GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', '').strip()
+ROUTE_SPEED_KMH = float(os.environ.get('ROUTE_SPEED_KMH', '20'))
+ROUTE_TIME_BUDGET_MS = int(os.environ.get('ROUTE_TIME_BUDGET_MS', '200'))
+ROUTE_WINDOW_STARTS = {
+    'AM': os.environ.get('ROUTE_AM_START', '08:00').strip(),
+    'PM': os.environ.get('ROUTE_PM_START', '13:00').strip(),
+}
+ROUTE_DURATION_TTL = int(os.environ.get('ROUTE_DURATION_TTL', '21600'))
+HTTP_FAILURE_THRESHOLD = int(os.environ.get('HTTP_FAILURE_THRESHOLD', '5'))
+HTTP_BREAKER_RESET_SECONDS = float(os.environ.get('HTTP_BREAKER_RESET_SECONDS', '30'))
+HTTP_RETRY_ATTEMPTS = int(os.environ.get('HTTP_RETRY_ATTEMPTS', '3'))
+TELEGRAM_SEND_TIMEOUT = float(os.environ.get('TELEGRAM_SEND_TIMEOUT', '15'))
+TELEGRAM_FILE_TIMEOUT = float(os.environ.get('TELEGRAM_FILE_TIMEOUT', '60'))
+SUPABASE_REST_TIMEOUT = float(os.environ.get('SUPABASE_REST_TIMEOUT', '15'))
+SUPABASE_STORAGE_TIMEOUT = float(os.environ.get('SUPABASE_STORAGE_TIMEOUT', '60'))
+SUPABASE_FUNCTION_TIMEOUT = float(os.environ.get('SUPABASE_FUNCTION_TIMEOUT', '20'))
+WXO_AGENT_TIMEOUT = float(os.environ.get('WXO_AGENT_TIMEOUT', '60'))
+REPLAY_BATCH_SIZE = int(os.environ.get('REPLAY_BATCH_SIZE', '10'))
+REPLAY_CONCURRENCY = int(os.environ.get('REPLAY_CONCURRENCY', '2'))
+REPLAY_LEASE_SECONDS = int(os.environ.get('REPLAY_LEASE_SECONDS', '600'))
+REPLAY_MAX_ATTEMPTS = int(os.environ.get('REPLAY_MAX_ATTEMPTS', '5'))
+REPLAY_RETRY_BASE_SECONDS = int(os.environ.get('REPLAY_RETRY_BASE_SECONDS', '60'))
+REPLAY_WORKER_ID = os.environ.get('REPLAY_WORKER_ID', f'{socket.gethostname()}-{os.getpid()}').strip()
+WXO_MAX_IN_FLIGHT = int(os.environ.get('WXO_MAX_IN_FLIGHT', '4'))
+WXO_QUEUE_LIMIT = int(os.environ.get('WXO_QUEUE_LIMIT', '20'))
+WXO_INTERACTIVE_WAIT_SECONDS = float(os.environ.get('WXO_INTERACTIVE_WAIT_SECONDS', '5'))
+WXO_REPLAY_WAIT_SECONDS = float(os.environ.get('WXO_REPLAY_WAIT_SECONDS', '30'))
+WXO_BATCH_WAIT_SECONDS = float(os.environ.get('WXO_BATCH_WAIT_SECONDS', '60'))
+DEDUPE_THRESHOLD = float(os.environ.get('DEDUPE_THRESHOLD', '0.5'))
+DEDUPE_WINDOW_HOURS = int(os.environ.get('DEDUPE_WINDOW_HOURS', '72'))
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9464'))
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1').strip()
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+TRACE_SLOW_MS = os.environ.get('TRACE_SLOW_MS', '').strip()
+TRACE_FILE = os.environ.get('TRACE_FILE', '').strip()
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', '').strip()
+PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', '').strip().lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles').strip()
+PROFILE_HZ = float(os.environ.get('PROFILE_HZ', '100'))
+PROFILE_SIGNAL_SECONDS = int(os.environ.get('PROFILE_SIGNAL_SECONDS', '30'))
+PROFILE_MAX_SECONDS = int(os.environ.get('PROFILE_MAX_SECONDS', '300'))
+LEADER_ELECTION = os.environ.get('LEADER_ELECTION', 'off').strip().lower()  # off | lease | advisory
+LEADER_LEASE_NAME = os.environ.get('LEADER_LEASE_NAME', 'notification-feeds').strip()
+LEADER_LEASE_SECONDS = float(os.environ.get('LEADER_LEASE_SECONDS', '30'))
+LEADER_DSN = os.environ.get('LEADER_DSN', '').strip()
+REPLICA_ID = os.environ.get('REPLICA_ID', REPLAY_WORKER_ID).strip()
+# memory:// (this process only), sqlite:////abs/path/sessions.db or redis://[:password@]host:port/db
+SESSION_STORE_URL = os.environ.get('SESSION_STORE_URL', 'memory://').strip()
+EVIDENCE_SESSION_SECONDS = int(os.environ.get('EVIDENCE_SESSION_SECONDS', '600'))
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', '86400'))
+# Row writes queued per table and sent as one request; a delay of 0 sends each write at once.
+WRITE_BATCH_ROWS = int(os.environ.get('WRITE_BATCH_ROWS', '50'))
+WRITE_BATCH_DELAY_MS = float(os.environ.get('WRITE_BATCH_DELAY_MS', '25'))
+# Rows per request when a read must see every matching row (Supabase caps responses at 1000 by default).
+QUERY_PAGE_SIZE = int(os.environ.get('QUERY_PAGE_SIZE', '1000'))
+# Direct Postgres DSN to LISTEN for row changes on; the notification polls then only reconcile.
+CHANGE_FEED_DSN = os.environ.get('CHANGE_FEED_DSN', '').strip()
+CHANGE_FEED_RECONCILE_SECONDS = float(os.environ.get('CHANGE_FEED_RECONCILE_SECONDS', '300'))
 
 TOKEN_ENDPOINT = f"{SUPABASE_URL}/functions/v1/watson-token" if SUPABASE_URL else ''
 
 cached_token: Optional[str] = None
 token_expiry: Optional[int] = None
 
-history_by_user: Dict[int, List[Dict[str, str]]] = {}
+# Evidence sessions (by user), complaint mode (by user) and agent history (by chat).
+sessions = open_store(SESSION_STORE_URL)
 last_dispatch_check: int = int(time.time()) - DISPATCH_LOOKBACK_SECONDS
-last_dispatch_poll: float = 0.0
 sent_dispatch_ids: Set[str] = set()
 last_evidence_check: int = int(time.time()) - DISPATCH_LOOKBACK_SECONDS
 sent_evidence_ids: Set[str] = set()
 last_resolution_check: int = int(time.time()) - DISPATCH_LOOKBACK_SECONDS
 sent_resolution_ids: Set[str] = set()
-evidence_sessions: Dict[int, dict] = {}
-complaint_active: Set[int] = set()  # user_ids currently in complaint mode
+# Most recently notified ids per feed, handed to the next leader with the watermarks.
+recent_sent: Dict[str, deque] = {feed: deque(maxlen=200) for feed in ('dispatch', 'evidence', 'resolution')}
+# Held while a feed's rows are handled, by its poll or by the change feed, so a row is sent once.
+feed_locks: Dict[str, threading.Lock] = {feed: threading.Lock() for feed in ('dispatch', 'evidence', 'resolution')}
+geocode_cache: Dict[str, Optional[tuple]] = {}
+# Storage URL -> Telegram file_id of the same photo, so each photo is fetched from storage once.
+telegram_file_ids: 'OrderedDict[str, str]' = OrderedDict()
+category_duration_cache: Dict[str, float] = {}
+category_duration_fetched: float = 0.0
+last_rollup_check: int = int(time.time()) - DISPATCH_LOOKBACK_SECONDS
+last_rollup_refresh: float = 0.0
+last_dedupe_check: int = int(time.time()) - DEDUPE_WINDOW_HOURS * 3600
+last_dedupe_resolved_check: int = int(time.time()) - DISPATCH_LOOKBACK_SECONDS
+
+T = TypeVar('T')
 
 
 def log(msg: str) -> None:
     print(msg, flush=True)
 
 
-def http_request(url: str, method: str = 'GET', headers: Optional[dict] = None, body: Optional[dict] = None) -> dict:
+def mark_sent(feed: str, sent_ids: Set[str], key: str) -> None:
+    sent_ids.add(key)
+    recent_sent[feed].append(key)
+
+
+metrics = Registry()
+http_requests_total = metrics.counter('bot_http_requests_total', 'Outbound HTTP calls by upstream, operation and outcome.')
+http_request_seconds = metrics.histogram('bot_http_request_seconds', 'Outbound HTTP call latency, retries included.')
+updates_total = metrics.counter('bot_updates_total', 'Telegram updates handled by command and outcome.')
+update_seconds = metrics.histogram('bot_update_seconds', 'Time to handle one Telegram update.')
+feed_polls_total = metrics.counter('bot_feed_polls_total', 'Notification feed polls by feed and outcome.')
+feed_poll_seconds = metrics.histogram('bot_feed_poll_seconds', 'Time spent in one feed poll.')
+feed_events_total = metrics.counter('bot_feed_events_total', 'Rows handled by each notification feed.')
+feed_lag_seconds = metrics.histogram('bot_feed_lag_seconds', 'Delay between a row changing and the bot handling it.', LAG_BUCKETS)
+change_events_total = metrics.counter('bot_change_events_total', 'Row changes pushed by the change feed, by table.')
+agent_calls_total = metrics.counter('bot_agent_calls_total', 'Review agent calls by priority and outcome.')
+agent_call_seconds = metrics.histogram('bot_agent_call_seconds', 'Review agent call latency, excluding queue wait.')
+evidence_uploads_total = metrics.counter('bot_evidence_uploads_total', 'Evidence photo uploads by outcome.')
+evidence_upload_bytes_total = metrics.counter('bot_evidence_upload_bytes_total', 'Evidence photo bytes uploaded.')
+evidence_upload_seconds = metrics.histogram('bot_evidence_upload_seconds', 'Evidence photo upload latency.')
+
+
+trace_exporters: List[object] = []
+if TRACE_FILE:
+    trace_exporters.append(JsonlExporter(TRACE_FILE))
+if TRACE_OTLP_ENDPOINT:
+    trace_exporters.append(OtlpExporter(TRACE_OTLP_ENDPOINT))
+tracer = Tracer(
+    trace_exporters,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_threshold=float(TRACE_SLOW_MS) / 1000 if TRACE_SLOW_MS else None,
+)
+
+
+def _upstream(name: str, budgets: Dict[str, float]) -> Upstream:
+    breaker = CircuitBreaker(
+        name,
+        failure_threshold=HTTP_FAILURE_THRESHOLD,
+        reset_timeout=HTTP_BREAKER_RESET_SECONDS,
+        on_change=lambda upstream, old, new: log(f'Circuit {upstream}: {old} -> {new}'),
+    )
+    return Upstream(name, budgets, breaker, RetryPolicy(attempts=HTTP_RETRY_ATTEMPTS))
+
+
+upstreams = UpstreamRegistry(_upstream('other', {'default': 15.0}))
+upstreams.add(TELEGRAM_API_URL, _upstream('telegram', {
+    'default': TELEGRAM_SEND_TIMEOUT,
+    'poll': POLL_TIMEOUT + 10.0,
+    'file': TELEGRAM_FILE_TIMEOUT,
+}))
+upstreams.add(SUPABASE_URL, _upstream('supabase', {
+    'default': SUPABASE_REST_TIMEOUT,
+    'storage': SUPABASE_STORAGE_TIMEOUT,
+    'function': SUPABASE_FUNCTION_TIMEOUT,
+}))
+upstreams.add(WXO_HOST_URL, _upstream('wxo', {'default': WXO_AGENT_TIMEOUT}))
+
+
+def request_kind(url: str) -> str:
+    """Call type used to pick the latency budget within an upstream."""
+    path = urllib.parse.urlparse(url).path
+    if path.endswith('/getUpdates'):
+        return 'poll'
+    if path.startswith('/file/'):
+        return 'file'
+    if path.startswith('/storage/'):
+        return 'storage'
+    if path.startswith('/functions/'):
+        return 'function'
+    return 'default'
+
+
+def request_operation(url: str) -> str:
+    """Metrics label for a call: the Telegram method, PostgREST table, function name, etc."""
+    parts = [part for part in urllib.parse.urlparse(url).path.split('/') if part]
+    if not parts:
+        return 'root'
+    if parts[0] == 'file':
+        return 'file'
+    if parts[0].startswith('bot'):
+        return parts[-1]
+    if parts[0] in ('rest', 'functions') and len(parts) >= 3:
+        return parts[2]
+    if parts[0] == 'storage':
+        return 'storage'
+    return '/'.join(parts[-2:])
+
+
+def _send_request(req: urllib.request.Request, read: Callable[[object], T]) -> T:
+    kind = request_kind(req.full_url)
+    upstream = upstreams.for_url(req.full_url)
+    labels = {'upstream': upstream.name, 'operation': request_operation(req.full_url)}
+
+    def attempt(timeout: float) -> T:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return read(resp)
+
+    # Long polls are not retried here; the main loop simply polls again.
+    idempotent = req.get_method() == 'GET' and kind != 'poll'
+    started = time.perf_counter()
+    outcome = 'ok'
+    with span('http', method=req.get_method(), **labels) as current:
+        try:
+            return upstream.call(kind, attempt, idempotent=idempotent)
+        except CircuitOpenError:
+            outcome = 'circuit_open'
+            raise
+        except urllib.error.HTTPError as exc:
+            outcome = str(exc.code)
+            raise
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            http_requests_total.inc(outcome=outcome, **labels)
+            if outcome != 'circuit_open':
+                http_request_seconds.observe(time.perf_counter() - started, **labels)
+            if current:
+                current.set(outcome=outcome)
+
+
+def _json_request(url: str, method: str, headers: Optional[dict], body: Optional[Union[dict, list]]) -> urllib.request.Request:
     data = None
     if body is not None:
-        data = json.dumps(body).encode('utf-8')
+        data = codec.dumps(body)
     req = urllib.request.Request(url=url, data=data, method=method)
+    # JSON compresses well; photos and other raw transfers go through http_request_raw uncompressed.
+    req.add_header('Accept-Encoding', codec.ACCEPT_ENCODING)
     if headers:
         for key, value in headers.items():
             req.add_header(key, value)
-    with urllib.request.urlopen(req, timeout=60) as resp:
-        payload = resp.read().decode('utf-8')
+    return req
+
+
+def http_request(url: str, method: str = 'GET', headers: Optional[dict] = None, body: Optional[Union[dict, list]] = None) -> dict:
+    def read(resp) -> dict:
+        payload = codec.decompress(resp.read(), resp.headers.get('Content-Encoding'))
         if not payload:
             return {}
-        return json.loads(payload)
+        return codec.loads(payload)
+
+    return _send_request(_json_request(url, method, headers, body), read)
+
+
+def http_scan(url: str, consume: Callable[[Iterator[object]], T], headers: Optional[dict] = None) -> T:
+    """GET a JSON array and hand ``consume`` an iterator over its elements, parsed as
+    they arrive; ``consume`` may stop early. It is called afresh if the request is retried."""
+    return _send_request(
+        _json_request(url, 'GET', headers, None),
+        lambda resp: consume(codec.iter_array(codec.open_stream(resp))),
+    )
 
 
 def http_request_raw(
@@ -92,16 +339,16 @@ def http_request_raw(
         for key, value in headers.items():
             req.add_header(key, value)
     try:
-        with urllib.request.urlopen(req, timeout=120) as resp:
-            return resp.read()
+        return _send_request(req, lambda resp: resp.read())
     except urllib.error.HTTPError as exc:
         body = exc.read().decode('utf-8', errors='replace')
         log(f'HTTP {exc.code} from {method} {url}: {body}')
         raise
 
 
+@traced('telegram_download')
 def download_telegram_file(file_id: str) -> tuple:
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile"
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getFile"
     result = http_request(
         url,
         method='POST',
@@ -112,11 +359,12 @@ def download_telegram_file(file_id: str) -> tuple:
     if not file_path:
         raise RuntimeError(f'Could not get file_path for file_id {file_id}')
 
-    download_url = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}"
+    download_url = f"{TELEGRAM_API_URL}/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}"
     file_bytes = http_request_raw(download_url, method='GET')
     return file_bytes, file_path
 
 
+@traced('evidence_upload')
 def upload_to_supabase_storage(task_id: str, field_name: str, file_bytes: bytes, filename: str) -> str:
     timestamp = int(time.time() * 1000)
     safe_filename = filename.replace('/', '_').replace('\\', '_')
@@ -130,17 +378,25 @@ def upload_to_supabase_storage(task_id: str, field_name: str, file_bytes: bytes,
         content_type = 'image/jpeg'
 
     auth_key = SUPABASE_SERVICE_ROLE_KEY or SUPABASE_API_KEY
-    http_request_raw(
-        upload_url,
-        method='POST',
-        headers={
-            'apikey': auth_key,
-            'Authorization': f'Bearer {auth_key}',
-            'Content-Type': content_type,
-            'x-upsert': 'true',
-        },
-        body_bytes=file_bytes,
-    )
+    started = time.perf_counter()
+    try:
+        http_request_raw(
+            upload_url,
+            method='POST',
+            headers={
+                'apikey': auth_key,
+                'Authorization': f'Bearer {auth_key}',
+                'Content-Type': content_type,
+                'x-upsert': 'true',
+            },
+            body_bytes=file_bytes,
+        )
+    except Exception:
+        evidence_uploads_total.inc(field=field_name, outcome='error')
+        raise
+    evidence_upload_seconds.observe(time.perf_counter() - started, field=field_name)
+    evidence_uploads_total.inc(field=field_name, outcome='ok')
+    evidence_upload_bytes_total.inc(len(file_bytes), field=field_name)
 
     public_url = f"{SUPABASE_URL}/storage/v1/object/public/evidence-photos/{encoded_path}"
     return public_url
@@ -176,7 +432,37 @@ def get_valid_token() -> str:
     return cached_token
 
 
-def call_review_agent(messages: List[Dict[str, str]]) -> str:
+# Agent calls share one WXO instance: interactive complaint turns go first, then
+# failed-message replays, then batch jobs. Waiters past their class deadline are shed.
+agent_limiter = PriorityLimiter(WXO_MAX_IN_FLIGHT, [
+    ('interactive', WXO_QUEUE_LIMIT, WXO_INTERACTIVE_WAIT_SECONDS),
+    ('replay', WXO_QUEUE_LIMIT, WXO_REPLAY_WAIT_SECONDS),
+    ('batch', WXO_QUEUE_LIMIT, WXO_BATCH_WAIT_SECONDS),
+])
+
+
+def call_review_agent(messages: List[Dict[str, str]], priority: str = 'interactive') -> str:
+    """Run the review agent; raises LimiterBusy when no slot frees up in time for ``priority``."""
+    try:
+        with span('agent', priority=priority) as current, agent_limiter.slot(priority) as waited:
+            if current:
+                current.set(queue_wait_ms=round(waited * 1000, 1))
+            started = time.perf_counter()
+            try:
+                reply = _call_review_agent(messages)
+            finally:
+                agent_call_seconds.observe(time.perf_counter() - started, priority=priority)
+    except LimiterBusy:
+        agent_calls_total.inc(priority=priority, outcome='shed')
+        raise
+    except Exception:
+        agent_calls_total.inc(priority=priority, outcome='error')
+        raise
+    agent_calls_total.inc(priority=priority, outcome='ok')
+    return reply
+
+
+def _call_review_agent(messages: List[Dict[str, str]]) -> str:
     token = get_valid_token()
     url = f"{WXO_HOST_URL}/instances/{WXO_INSTANCE_ID}/v1/orchestrate/{WXO_AGENT_ID}/chat/completions"
 
@@ -216,52 +502,161 @@ def call_review_agent(messages: List[Dict[str, str]]) -> str:
     return 'No response text received from agent.'
 
 
+def is_asking_questions(reply: str) -> bool:
+    """Whether the agent is still collecting details rather than confirming a complaint."""
+    reply_lower = reply.lower()
+    return any(phrase in reply_lower for phrase in [
+        'need', 'tell me', 'where', 'when', 'what', 'how', 'please provide',
+        'can you', 'could you', 'more details', 'few more', 'i need'
+    ])
+
+
 def build_history(user_id: int, user_text: str) -> List[Dict[str, str]]:
-    history = history_by_user.get(user_id, [])
+    history = sessions.get('history', user_id) or []
     history.append({'role': 'user', 'text': user_text})
     history = history[-MAX_HISTORY:]
-    history_by_user[user_id] = history
+    sessions.put('history', user_id, history, SESSION_TTL_SECONDS)
     return history
 
 
 def store_assistant_reply(user_id: int, reply_text: str) -> None:
-    history = history_by_user.get(user_id, [])
+    history = sessions.get('history', user_id) or []
     history.append({'role': 'assistant', 'text': reply_text})
-    history_by_user[user_id] = history[-MAX_HISTORY:]
+    sessions.put('history', user_id, history[-MAX_HISTORY:], SESSION_TTL_SECONDS)
+
+
+def start_complaint(user_id: int, chat_id: int, correlation_id: Optional[str] = None) -> None:
+    sessions.put('complaint', user_id, {
+        'started_at': int(time.time()),
+        'correlation_id': correlation_id or uuid.uuid4().hex,
+    }, SESSION_TTL_SECONDS)
+    sessions.pop('history', chat_id)
+
+
+def tag_conversation(history: List[Dict[str, str]], correlation_id: Optional[str]) -> List[Dict[str, str]]:
+    """Messages for the agent with the complaint session's correlation id on the first user turn.
+    The agent passes it to submit_complaint, so the new complaint row can be found by it."""
+    if not correlation_id:
+        return history
+    tagged = list(history)
+    for index, turn in enumerate(tagged):
+        if turn.get('role') == 'user':
+            tagged[index] = {**turn, 'text': f"{turn.get('text', '')}\n\n[complaint ref: {correlation_id}]"}
+            break
+    return tagged
+
+
+def end_complaint(user_id: int, chat_id: int) -> Optional[List[Dict[str, str]]]:
+    """Leave complaint mode; returns the conversation so far."""
+    sessions.pop('complaint', user_id)
+    return sessions.pop('history', chat_id)
+
+
+def _formatted(text: str, parse_mode: Optional[str], limit: int, field: str = 'text') -> dict:
+    """Validate formatted text locally; invalid markup is sent as plain text instead of
+    letting Telegram reject it, so every message goes out in a single request."""
+    errors = validate(text, parse_mode, limit) if parse_mode else []
+    if not errors:
+        return {field: text, 'parse_mode': parse_mode} if parse_mode else {field: text}
+    log(f'Message failed {parse_mode} validation ({"; ".join(errors[:3])}); sending as plain text.')
+    return {field: to_plain_text(text, parse_mode)[:limit]}
+
+
+def send_telegram_message(chat_id: int, text: str, parse_mode: Optional[str] = 'HTML') -> None:
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    http_request(
+        url,
+        method='POST',
+        headers={'Content-Type': 'application/json'},
+        body={'chat_id': chat_id, **_formatted(text, parse_mode, 4096)},
+    )
 
 
-def send_telegram_message(chat_id: int, text: str, parse_mode: str = 'Markdown') -> None:
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+def _cached_file_id(photo_url: str) -> Optional[str]:
+    file_id = telegram_file_ids.get(photo_url)
+    if file_id:
+        telegram_file_ids.move_to_end(photo_url)
+    return file_id
+
+
+def _remember_file_id(photo_url: str, message: dict) -> None:
+    sizes = message.get('photo') if isinstance(message, dict) else None
+    if not photo_url or not sizes:
+        return
+    # Largest size last; reusing its file_id re-sends the original photo.
+    telegram_file_ids[photo_url] = sizes[-1].get('file_id')
+    telegram_file_ids.move_to_end(photo_url)
+    while len(telegram_file_ids) > TELEGRAM_FILE_ID_CACHE_SIZE:
+        telegram_file_ids.popitem(last=False)
+
+
+def send_telegram_photo(chat_id: int, photo_url: str, caption: Optional[str] = None) -> None:
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
+    cached = _cached_file_id(photo_url)
+    body = {'chat_id': chat_id, 'photo': cached or photo_url}
+    if caption:
+        body.update(_formatted(caption, 'HTML', TELEGRAM_CAPTION_LIMIT, field='caption'))
     try:
-        http_request(
+        data = http_request(
             url,
             method='POST',
             headers={'Content-Type': 'application/json'},
-            body={'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode},
+            body=body,
         )
-    except Exception as exc:
-        # Telegram often throws 400 if Markdown can't parse entities; retry without formatting.
-        log(f'Telegram sendMessage failed ({parse_mode}): {exc}. Retrying without parse_mode.')
-        http_request(
+    except urllib.error.HTTPError:
+        if not cached:
+            raise
+        # Stale file_id: forget it and let Telegram fetch the URL again.
+        telegram_file_ids.pop(photo_url, None)
+        data = http_request(
             url,
             method='POST',
             headers={'Content-Type': 'application/json'},
-            body={'chat_id': chat_id, 'text': text},
+            body={**body, 'photo': photo_url},
         )
+    _remember_file_id(photo_url, data.get('result') or {})
 
 
-def send_telegram_photo(chat_id: int, photo_url: str, caption: Optional[str] = None) -> None:
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
-    body = {'chat_id': chat_id, 'photo': photo_url}
-    if caption:
-        body['caption'] = caption
-        body['parse_mode'] = 'Markdown'
-    http_request(
-        url,
-        method='POST',
-        headers={'Content-Type': 'application/json'},
-        body=body,
-    )
+def send_telegram_media_group(chat_id: int, photo_urls: List[str], caption: Optional[str] = None) -> None:
+    """Send photos as one album (caption on the first item), reusing cached file_ids."""
+    if len(photo_urls) == 1:
+        send_telegram_photo(chat_id, photo_urls[0], caption)
+        return
+
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMediaGroup"
+    cached = [_cached_file_id(photo_url) for photo_url in photo_urls]
+
+    def media_items(use_cache: bool) -> List[dict]:
+        items = []
+        for index, photo_url in enumerate(photo_urls):
+            item = {'type': 'photo', 'media': (cached[index] if use_cache else None) or photo_url}
+            if index == 0 and caption:
+                item.update(_formatted(caption, 'HTML', TELEGRAM_CAPTION_LIMIT, field='caption'))
+            items.append(item)
+        return items
+
+    try:
+        data = http_request(
+            url,
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body={'chat_id': chat_id, 'media': media_items(True)},
+        )
+    except urllib.error.HTTPError:
+        if not any(cached):
+            raise
+        for photo_url in photo_urls:
+            telegram_file_ids.pop(photo_url, None)
+        data = http_request(
+            url,
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body={'chat_id': chat_id, 'media': media_items(False)},
+        )
+
+    messages = data.get('result') or []
+    for photo_url, message in zip(photo_urls, messages):
+        _remember_file_id(photo_url, message)
 
 
 def _safe_parse_summary(value: Optional[dict]) -> dict:
@@ -287,19 +682,36 @@ def build_dispatch_message(payload: dict, run_sheet_id: str) -> str:
     task_summary = payload.get('task') or payload.get('task_summary') or 'N/A'
     notes = payload.get('notes') or 'N/A'
     capacity_text = f"{capacity}%" if capacity is not None else 'N/A'
-
-    return (
-        "🚨 *Dispatch Update*\n\n"
-        f"Team: *{team}*\n"
-        f"Run Sheet: `{run_sheet_id[:8]}`\n"
-        f"Date: {date}\n"
-        f"Window: {time_window}\n"
-        f"Tasks: {tasks}\n"
-        f"Zones: {zones}\n"
-        f"Issue: {task_summary}\n"
-        f"Notes: {notes}\n"
-        f"Capacity used: {capacity_text}\n\n"
-        "Please acknowledge and proceed."
+    stops = payload.get('stops') or []
+
+    route = ''
+    if stops:
+        stop_lines = [
+            render_message(
+                'dispatch_stop',
+                index=i,
+                eta=stop.get('eta') or '--:--',
+                category=stop.get('category') or 'issue',
+                label=stop.get('label') or 'Unspecified',
+                task_type=stop.get('task_type') or 'task',
+                duration=stop.get('duration'),
+            )
+            for i, stop in enumerate(stops, 1)
+        ]
+        route = render_message('dispatch_route', stops='\n'.join(stop_lines))
+
+    return render_message(
+        'dispatch',
+        team=team,
+        run_sheet=run_sheet_id[:8],
+        date=date,
+        time_window=time_window,
+        tasks=tasks,
+        zones=zones,
+        task_summary=task_summary,
+        notes=notes,
+        capacity=capacity_text,
+        route=route,
     )
 
 
@@ -314,63 +726,211 @@ def _fetch_json(url: str) -> list:
     )
 
 
-def fetch_run_sheet_task_summary(run_sheet_id: str) -> str:
-    if not SUPABASE_URL or not SUPABASE_API_KEY:
-        return ''
+def _query(query: Query) -> list:
+    rows = _fetch_json(query.url(SUPABASE_URL))
+    return rows if isinstance(rows, list) else []
+
+
+def _query_all(query: Query, page_size: int = QUERY_PAGE_SIZE) -> list:
+    """Every row matching ``query``, fetched a page at a time so PostgREST's ``max-rows``
+    cannot truncate the result. ``query`` must have a total order (e.g. by id). A short
+    page does not end the scan, since the server may cap pages below ``page_size``."""
+    rows: list = []
+    while True:
+        page = _query(query.limit(page_size).offset(len(rows)))
+        if not page:
+            return rows
+        rows.extend(page)
+
+
+def _scan(query: Query, consume: Callable[[Iterator[object]], T]) -> T:
+    """Like ``_query``, but rows are parsed and consumed one at a time."""
+    return http_scan(
+        query.url(SUPABASE_URL),
+        consume,
+        headers={'apikey': SUPABASE_API_KEY, 'Authorization': f'Bearer {SUPABASE_API_KEY}'},
+    )
+
 
-    tasks_url = (
-        f"{SUPABASE_URL}/rest/v1/run_sheet_tasks?"
-        f"select=task_id&run_sheet_id=eq.{run_sheet_id}"
+def _upsert_rows(table: str, rows: List[dict], on_conflict: str) -> None:
+    http_request(
+        f"{SUPABASE_URL}/rest/v1/{table}?on_conflict={on_conflict}",
+        method='POST',
+        headers={
+            'apikey': SUPABASE_API_KEY,
+            'Authorization': f'Bearer {SUPABASE_API_KEY}',
+            'Content-Type': 'application/json',
+            'Prefer': 'resolution=merge-duplicates,return=minimal',
+        },
+        body=rows,
     )
+
+
+writes = WriteBatcher(
+    SUPABASE_URL, SUPABASE_API_KEY, request=http_request, max_rows=WRITE_BATCH_ROWS, max_delay=WRITE_BATCH_DELAY_MS / 1000,
+)
+# Queued writes are sent before the process exits.
+atexit.register(writes.flush)
+
+
+def log_write_error(action: str) -> Callable[[Future], None]:
+    """Done-callback for writes nobody waits on."""
+    def done(future: Future) -> None:
+        if future.exception() is not None:
+            log(f'Error {action}: {future.exception()}')
+    return done
+
+
+def geocode_location(label: str) -> Optional[tuple]:
+    if not label or not GOOGLE_MAPS_API_KEY:
+        return None
+    key = label.strip().lower()
+    if key in geocode_cache:
+        return geocode_cache[key]
+    point = None
     try:
-        task_links = _fetch_json(tasks_url)
+        data = http_request(
+            'https://maps.googleapis.com/maps/api/geocode/json?'
+            + urllib.parse.urlencode({'address': f'{label}, Singapore', 'key': GOOGLE_MAPS_API_KEY})
+        )
+        results = data.get('results') or []
+        if data.get('status') == 'OK' and results:
+            location = results[0].get('geometry', {}).get('location', {})
+            point = (float(location['lat']), float(location['lng']))
     except Exception as exc:
-        log(f'Error fetching run_sheet_tasks: {exc}')
-        return ''
+        log(f'Error geocoding {label!r}: {exc}')
+    geocode_cache[key] = point
+    return point
 
-    if not isinstance(task_links, list) or not task_links:
-        return ''
 
-    task_ids = [row.get('task_id') for row in task_links if row.get('task_id')]
-    if not task_ids:
-        return ''
+def cluster_point(cluster: Optional[dict]) -> Optional[tuple]:
+    if not isinstance(cluster, dict):
+        return None
+    lat, lng = cluster.get('centroid_lat'), cluster.get('centroid_lng')
+    if lat is not None and lng is not None:
+        try:
+            return float(lat), float(lng)
+        except (TypeError, ValueError):
+            pass
+    return geocode_location(cluster.get('location_label') or cluster.get('zone_id') or '')
+
+
+def get_category_durations() -> Dict[str, float]:
+    """Historical on-site minutes per category, refreshed every ROUTE_DURATION_TTL seconds."""
+    global category_duration_cache, category_duration_fetched
+    if time.time() - category_duration_fetched < ROUTE_DURATION_TTL:
+        return category_duration_cache
+    category_duration_fetched = time.time()
+    try:
+        rows = _query(Query('evidence', 'evidence.history').order('submitted_at', desc=True).limit(2000))
+    except Exception as exc:
+        log(f'Error fetching evidence history for durations: {exc}')
+        return category_duration_cache
+
+    flat = []
+    for row in rows:
+        task = row.get('task') or {}
+        category = (task.get('cluster') or {}).get('category')
+        for link in task.get('run_sheet_tasks') or []:
+            flat.append({
+                'run_sheet_id': link.get('run_sheet_id'),
+                'category': category,
+                'submitted_at': row.get('submitted_at'),
+            })
+    category_duration_cache = category_durations(flat)
+    return category_duration_cache
+
+
+def window_start(date_text: Optional[str], time_window: Optional[str]) -> datetime:
+    local_tz = timezone(timedelta(hours=ROLLUP_UTC_OFFSET_HOURS))
+    try:
+        day = datetime.fromisoformat(str(date_text)[:10]).date()
+    except ValueError:
+        day = local_today()
+    start_text = ROUTE_WINDOW_STARTS.get((time_window or 'AM').upper(), ROUTE_WINDOW_STARTS['AM'])
+    hour, _, minute = start_text.partition(':')
+    return datetime(day.year, day.month, day.day, int(hour), int(minute or 0), tzinfo=local_tz)
 
-    task_ids_csv = ','.join(task_ids)
-    task_ids_filter = urllib.parse.quote(task_ids_csv, safe=',')
-    task_details_url = (
-        f"{SUPABASE_URL}/rest/v1/tasks?"
-        f"select=id,cluster_id,task_type&id=in.({task_ids_filter})"
+
+def sequence_stops(stops: List[dict], date_text: Optional[str], time_window: Optional[str]) -> List[dict]:
+    """Order stops (dicts with a 'cluster') on a short path and attach duration and ETA."""
+    if not stops:
+        return []
+    durations_by_category = get_category_durations()
+    points = [cluster_point(stop.get('cluster')) for stop in stops]
+    durations = [
+        round(durations_by_category.get((stop.get('cluster') or {}).get('category'), DEFAULT_DURATION_MINUTES))
+        for stop in stops
+    ]
+    order = sequence_points(points, ROUTE_TIME_BUDGET_MS / 1000)
+    legs = leg_distances(points, order)
+    etas = schedule(order, legs, durations, window_start(date_text, time_window), ROUTE_SPEED_KMH)
+
+    ordered = []
+    for position, index in enumerate(order):
+        stop = dict(stops[index])
+        stop['sequence'] = position + 1
+        stop['duration'] = durations[index]
+        stop['eta'] = etas[position].strftime('%H:%M')
+        stop['leg_km'] = round(legs[position], 2)
+        ordered.append(stop)
+    return ordered
+
+
+def fetch_run_sheet_stops(run_sheet_id: str) -> List[dict]:
+    rows = _query(
+        Query('run_sheet_tasks', 'run_sheet_task.route').eq('run_sheet_id', run_sheet_id).order('sequence')
     )
+    stops = []
+    for row in rows:
+        task = row.get('task') or {}
+        cluster = task.get('cluster') or {}
+        stops.append({
+            'link_id': row.get('id'),
+            'task_id': row.get('task_id'),
+            'task_type': task.get('task_type'),
+            'cluster': cluster,
+            'category': cluster.get('category'),
+            'label': cluster.get('location_label') or cluster.get('description') or cluster.get('zone_id'),
+        })
+    return stops
+
+
+def persist_stop_sequence(run_sheet_id: str, stops: List[dict]) -> None:
+    rows = [
+        {
+            'id': stop['link_id'],
+            'run_sheet_id': run_sheet_id,
+            'task_id': stop['task_id'],
+            'sequence': stop['sequence'],
+            'estimated_duration': stop['duration'],
+        }
+        for stop in stops
+        if stop.get('link_id')
+    ]
+    for row in rows:
+        writes.insert('run_sheet_tasks', row, on_conflict='id').add_done_callback(log_write_error('saving stop sequence'))
+
+
+def describe_task(task: dict) -> str:
+    cluster = task.get('cluster') or {}
+    desc = cluster.get('description') or cluster.get('location_label') or cluster.get('zone_id') or 'Unspecified issue'
+    category = cluster.get('category') or 'issue'
+    task_type = task.get('task_type') or 'task'
+    return f"{category}: {desc} ({task_type})"
+
+
+def fetch_run_sheet_task_summary(run_sheet_id: str) -> str:
+    if not SUPABASE_URL or not SUPABASE_API_KEY:
+        return ''
 
     try:
-        tasks = _fetch_json(task_details_url)
+        task_links = _query(Query('run_sheet_tasks', 'run_sheet_task.summary').eq('run_sheet_id', run_sheet_id))
     except Exception as exc:
-        log(f'Error fetching tasks: {exc}')
+        log(f'Error fetching run_sheet_tasks: {exc}')
         return ''
 
-    cluster_ids = list({row.get('cluster_id') for row in tasks if row.get('cluster_id')})
-    cluster_map: dict = {}
-    if cluster_ids:
-        cluster_ids_csv = ','.join(cluster_ids)
-        cluster_ids_filter = urllib.parse.quote(cluster_ids_csv, safe=',')
-        cluster_url = (
-            f"{SUPABASE_URL}/rest/v1/clusters?"
-            f"select=id,description,location_label,zone_id,category&id=in.({cluster_ids_filter})"
-        )
-        try:
-            clusters = _fetch_json(cluster_url)
-            if isinstance(clusters, list):
-                cluster_map = {row.get('id'): row for row in clusters if row.get('id')}
-        except Exception as exc:
-            log(f'Error fetching clusters: {exc}')
-
-    lines: list[str] = []
-    for task in tasks:
-        cluster = cluster_map.get(task.get('cluster_id'), {})
-        desc = cluster.get('description') or cluster.get('location_label') or cluster.get('zone_id') or 'Unspecified issue'
-        category = cluster.get('category') or 'issue'
-        task_type = task.get('task_type') or 'task'
-        lines.append(f"{category}: {desc} ({task_type})")
+    lines = [describe_task(row['task']) for row in task_links if isinstance(row.get('task'), dict)]
 
     # Deduplicate while preserving order
     seen = set()
@@ -388,76 +948,21 @@ def fetch_run_sheet_evidence(run_sheet_id: str) -> List[dict]:
     if not SUPABASE_URL or not SUPABASE_API_KEY:
         return []
 
-    tasks_url = (
-        f"{SUPABASE_URL}/rest/v1/run_sheet_tasks?"
-        f"select=task_id&run_sheet_id=eq.{run_sheet_id}"
-    )
-    try:
-        task_links = _fetch_json(tasks_url)
-    except Exception as exc:
-        log(f'Error fetching run_sheet_tasks for evidence: {exc}')
-        return []
-
-    if not isinstance(task_links, list) or not task_links:
-        return []
-
-    task_ids = [row.get('task_id') for row in task_links if row.get('task_id')]
-    if not task_ids:
-        return []
-
-    task_ids_csv = ','.join(task_ids)
-    task_ids_filter = urllib.parse.quote(task_ids_csv, safe=',')
-    evidence_url = (
-        f"{SUPABASE_URL}/rest/v1/evidence?"
-        f"select=id,task_id,before_image_url,after_image_url,submitted_at"
-        f"&task_id=in.({task_ids_filter})"
-        f"&order=submitted_at.desc"
-        f"&limit=10"
+    query = (
+        Query('evidence', 'evidence.by_run_sheet')
+        .eq('task.run_sheet_tasks.run_sheet_id', run_sheet_id)
+        .order('submitted_at', desc=True)
+        .limit(10)
     )
-
     try:
-        evidence_rows = _fetch_json(evidence_url)
+        evidence_rows = _query(query)
     except Exception as exc:
         log(f'Error fetching evidence: {exc}')
         return []
 
-    return evidence_rows if isinstance(evidence_rows, list) else []
-
-
-def fetch_task_cluster_map(task_ids: List[str]) -> dict:
-    if not task_ids or not SUPABASE_URL or not SUPABASE_API_KEY:
-        return {}
-
-    task_ids_csv = ','.join(task_ids)
-    task_ids_filter = urllib.parse.quote(task_ids_csv, safe=',')
-    task_url = (
-        f"{SUPABASE_URL}/rest/v1/tasks?"
-        f"select=id,cluster_id,task_type&id=in.({task_ids_filter})"
-    )
-    try:
-        tasks = _fetch_json(task_url)
-    except Exception as exc:
-        log(f'Error fetching tasks for evidence: {exc}')
-        return {}
-
-    cluster_ids = list({row.get('cluster_id') for row in tasks if row.get('cluster_id')})
-    cluster_map: dict = {}
-    if cluster_ids:
-        cluster_ids_csv = ','.join(cluster_ids)
-        cluster_ids_filter = urllib.parse.quote(cluster_ids_csv, safe=',')
-        cluster_url = (
-            f"{SUPABASE_URL}/rest/v1/clusters?"
-            f"select=id,description,location_label,zone_id,category&id=in.({cluster_ids_filter})"
-        )
-        try:
-            clusters = _fetch_json(cluster_url)
-            if isinstance(clusters, list):
-                cluster_map = {row.get('id'): row for row in clusters if row.get('id')}
-        except Exception as exc:
-            log(f'Error fetching clusters for evidence: {exc}')
-
-    task_map = {row.get('id'): row for row in tasks if row.get('id')}
-    return {'tasks': task_map, 'clusters': cluster_map}
+    for row in evidence_rows:
+        row.pop('task', None)
+    return evidence_rows
 
 
 def fetch_complainers_for_cluster(cluster_id: str) -> List[str]:
@@ -489,114 +994,75 @@ def fetch_complainers_for_cluster(cluster_id: str) -> List[str]:
 
 
 def lookup_task_by_prefix(prefix: str) -> Optional[dict]:
+    """Resolve a task or dispatched run sheet id prefix to a SCHEDULED task, with its cluster embedded."""
     prefix_lower = prefix.lower()
 
+    def first_two(rows: Iterator[object]) -> List[dict]:
+        # Two matches already make the prefix ambiguous: stop reading there.
+        found: List[dict] = []
+        for row in rows:
+            if isinstance(row, dict) and str(row.get('id') or '').lower().startswith(prefix_lower):
+                found.append(row)
+                if len(found) == 2:
+                    break
+        return found
+
     # 1. Try direct match on SCHEDULED tasks
     try:
-        rows = _fetch_json(
-            f"{SUPABASE_URL}/rest/v1/tasks?"
-            f"select=id,cluster_id,task_type,status"
-            f"&status=eq.SCHEDULED"
-        )
+        matches = _scan(Query('tasks', 'task.ref').eq('status', 'SCHEDULED'), first_two)
     except Exception as exc:
         log(f'Error looking up tasks: {exc}')
         return None
 
-    if isinstance(rows, list):
-        matches = [r for r in rows if r.get('id', '').lower().startswith(prefix_lower)]
-        if len(matches) == 1:
-            return matches[0]
-        if len(matches) > 1:
-            return None  # ambiguous
+    if len(matches) == 1:
+        return matches[0]
+    if len(matches) > 1:
+        return None  # ambiguous
 
     # 2. Fallback: try matching prefix as a run_sheet ID
     try:
-        rs_rows = _fetch_json(
-            f"{SUPABASE_URL}/rest/v1/run_sheets?"
-            f"select=id&status=eq.dispatched"
-        )
+        rs_matches = _scan(Query('run_sheets', 'run_sheet.tasks').eq('status', 'dispatched'), first_two)
     except Exception:
         return None
 
-    if not isinstance(rs_rows, list):
-        return None
-
-    rs_matches = [r for r in rs_rows if r.get('id', '').lower().startswith(prefix_lower)]
     if len(rs_matches) != 1:
         return None
 
-    rs_id = rs_matches[0]['id']
-    try:
-        task_links = _fetch_json(
-            f"{SUPABASE_URL}/rest/v1/run_sheet_tasks?"
-            f"select=task_id&run_sheet_id=eq.{rs_id}"
-        )
-    except Exception:
-        return None
-
-    if not isinstance(task_links, list) or not task_links:
-        return None
-
     # Get the first task from this run sheet that is SCHEDULED
-    task_ids = [r.get('task_id') for r in task_links if r.get('task_id')]
-    if not task_ids:
-        return None
-
-    task_ids_csv = ','.join(task_ids)
-    task_ids_filter = urllib.parse.quote(task_ids_csv, safe=',')
-    try:
-        tasks = _fetch_json(
-            f"{SUPABASE_URL}/rest/v1/tasks?"
-            f"select=id,cluster_id,task_type,status"
-            f"&id=in.({task_ids_filter})"
-            f"&status=eq.SCHEDULED"
-            f"&limit=1"
-        )
-    except Exception:
-        return None
-
-    if isinstance(tasks, list) and tasks:
-        return tasks[0]
+    links = sorted(rs_matches[0].get('run_sheet_tasks') or [], key=lambda link: link.get('sequence') or 0)
+    for link in links:
+        task = link.get('task')
+        if isinstance(task, dict) and task.get('status') == 'SCHEDULED':
+            return task
 
     return None
 
 
 def create_evidence_record(task_id: str, before_url: str, after_url: str, submitted_by: str) -> bool:
-    headers = {
-        'apikey': SUPABASE_API_KEY,
-        'Authorization': f'Bearer {SUPABASE_API_KEY}',
-        'Content-Type': 'application/json',
-    }
-
-    http_request(
-        f"{SUPABASE_URL}/rest/v1/evidence",
-        method='POST',
-        headers={**headers, 'Prefer': 'return=minimal'},
-        body={
-            'task_id': task_id,
-            'before_image_url': before_url,
-            'after_image_url': after_url,
-            'submitted_by': submitted_by,
-            'notes': 'Pending supervisor verification',
-        },
-    )
+    writes.insert('evidence', {
+        'task_id': task_id,
+        'before_image_url': before_url,
+        'after_image_url': after_url,
+        'submitted_by': submitted_by,
+        'notes': 'Pending supervisor verification',
+    }).result()
 
     return True
 
 
-def poll_evidence_notifications() -> None:
+def poll_evidence_notifications() -> List[float]:
+    """Returns the submitted_at timestamps of the evidence rows handled."""
     global last_evidence_check
     if not SUPABASE_URL or not SUPABASE_API_KEY:
-        return
+        return []
 
     since_iso = datetime.fromtimestamp(last_evidence_check, tz=timezone.utc).isoformat()
-    encoded_since = urllib.parse.quote(since_iso, safe='')
     url = (
-        f"{SUPABASE_URL}/rest/v1/evidence?"
-        f"select=id,task_id,before_image_url,after_image_url,submitted_at,notes,submitted_by"
-        f"&submitted_at=gt.{encoded_since}"
-        f"&order=submitted_at.asc"
-        f"&limit=10"
+        Query('evidence', 'evidence.notification')
+        .where('submitted_at', 'gt', since_iso)
+        .order('submitted_at')
+        .limit(10)
+        .url(SUPABASE_URL)
     )
 
     try:
@@ -611,24 +1077,33 @@ def poll_evidence_notifications() -> None:
     except Exception as exc:
         log(f'Error polling evidence notifications: {exc}')
         log(f'Evidence polling URL: {url}')
-        return
+        return []
 
     if not isinstance(response, list) or not response:
-        return
+        return []
+
+    with feed_locks['evidence']:
+        handled = notify_evidence(response)
+        # Rows pushed by the change feed were sent already; the watermark still passes them.
+        for row in response:
+            submitted = _parse_ts(row.get('submitted_at'))
+            if row.get('id') in sent_evidence_ids and submitted is not None:
+                last_evidence_check = max(last_evidence_check, int(submitted))
+    return handled
 
-    task_ids = [row.get('task_id') for row in response if row.get('task_id')]
-    maps = fetch_task_cluster_map(task_ids)
-    task_map = maps.get('tasks', {})
-    cluster_map = maps.get('clusters', {})
 
-    for row in response:
+def notify_evidence(rows: List[dict]) -> List[float]:
+    """Send the verified evidence rows not notified yet; returns their submitted_at
+    timestamps. Callers hold ``feed_locks['evidence']``."""
+    handled: List[float] = []
+    for row in rows:
         evidence_id = row.get('id')
         if not evidence_id or evidence_id in sent_evidence_ids:
             continue
 
         task_id = row.get('task_id') or ''
-        task_info = task_map.get(task_id, {})
-        cluster_info = cluster_map.get(task_info.get('cluster_id'), {})
+        task_info = row.get('task') or {}
+        cluster_info = task_info.get('cluster') or {}
         desc = cluster_info.get('description') or cluster_info.get('location_label') or cluster_info.get('zone_id') or 'Task evidence'
         category = cluster_info.get('category') or 'issue'
         notes = row.get('notes') or ''
@@ -639,7 +1114,7 @@ def poll_evidence_notifications() -> None:
             continue
 
         # Build recipient list: original complainers + supervisor
-        cluster_id = task_info.get('cluster_id')
+        cluster_id = cluster_info.get('id')
         recipient_ids: Set[str] = set()
         if cluster_id:
             for uid in fetch_complainers_for_cluster(cluster_id):
@@ -648,7 +1123,24 @@ def poll_evidence_notifications() -> None:
 
         before_url = row.get('before_image_url')
         after_url = row.get('after_image_url')
+        photo_urls = [photo_url for photo_url in (before_url, after_url) if photo_url]
+
+        header = render_message(
+            'evidence_resolved',
+            category=category,
+            desc=desc,
+            notes=notes or 'Verified',
+            task_ref=str(task_id)[:8],
+        )
+        if before_url and after_url:
+            legend = render_message('photo_pair', task_ref=str(task_id)[:8])
+        elif before_url:
+            legend = render_message('photo_before', task_ref=str(task_id)[:8])
+        else:
+            legend = render_message('photo_after', task_ref=str(task_id)[:8])
 
+        # One request per recipient: the header rides on the album caption. After the
+        # first recipient, photos are re-sent by file_id instead of re-fetched from storage.
         for uid_str in recipient_ids:
             try:
                 chat_id = int(uid_str)
@@ -658,50 +1150,35 @@ def poll_evidence_notifications() -> None:
                 continue
 
             try:
-                header = (
-                    f"✅ *Your reported issue has been resolved!*\n\n"
-                    f"Issue: {category} — {desc}\n"
-                    f"Resolution notes: {notes or 'Verified'}\n"
-                    f"Task reference: `{str(task_id)[:8]}`\n\n"
-                    f"Thank you for reporting this!"
-                )
-                send_telegram_message(chat_id, header)
-
-                if before_url:
-                    caption = f"📸 *Before* (task {str(task_id)[:8]})"
-                    send_telegram_photo(chat_id, before_url, caption)
-                if after_url:
-                    caption = f"✅ *After* (task {str(task_id)[:8]})"
-                    send_telegram_photo(chat_id, after_url, caption)
+                if photo_urls:
+                    send_telegram_media_group(chat_id, photo_urls, f"{header}\n\n{legend}")
+                else:
+                    send_telegram_message(chat_id, header)
             except Exception as exc:
                 log(f'Failed to notify recipient {uid_str}: {exc}')
 
-        sent_evidence_ids.add(evidence_id)
-        ts = row.get('submitted_at')
-        if ts:
-            try:
-                last_evidence_check = max(
-                    last_evidence_check,
-                    int(datetime.fromisoformat(ts.replace('Z', '+00:00')).timestamp()),
-                )
-            except Exception:
-                last_evidence_check = int(time.time())
+        mark_sent('evidence', sent_evidence_ids, evidence_id)
+        submitted = _parse_ts(row.get('submitted_at'))
+        if submitted is not None:
+            handled.append(submitted)
 
+    return handled
 
-def poll_dispatch_notifications() -> None:
+
+def poll_dispatch_notifications() -> List[float]:
+    """Returns the dispatched_at timestamps of the run sheets handled."""
     global last_dispatch_check
     if not SUPABASE_URL or not SUPABASE_API_KEY:
-        return
+        return []
 
     since_iso = datetime.fromtimestamp(last_dispatch_check, tz=timezone.utc).isoformat()
-    encoded_since = urllib.parse.quote(since_iso, safe='')
     url = (
-        f"{SUPABASE_URL}/rest/v1/run_sheets?"
-        f"select=id,date,time_window,zones_covered,capacity_used_percent,dispatched_at,task,notes,teams(name)"
-        f"&status=eq.dispatched"
-        f"&dispatched_at=gt.{encoded_since}"
-        f"&order=dispatched_at.asc"
-        f"&limit=10"
+        Query('run_sheets', 'run_sheet.dispatch')
+        .eq('status', 'dispatched')
+        .where('dispatched_at', 'gt', since_iso)
+        .order('dispatched_at')
+        .limit(10)
+        .url(SUPABASE_URL)
     )
 
     try:
@@ -716,12 +1193,25 @@ def poll_dispatch_notifications() -> None:
     except Exception as exc:
         log(f'Error polling dispatch notifications: {exc}')
         log(f'Polling URL: {url}')
-        return
+        return []
 
     if not isinstance(response, list) or not response:
-        return
+        return []
+
+    with feed_locks['dispatch']:
+        handled = notify_dispatch(response)
+        for entry in response:
+            dispatched = _parse_ts(entry.get('dispatched_at'))
+            if f"runsheet-{entry.get('id')}" in sent_dispatch_ids and dispatched is not None:
+                last_dispatch_check = max(last_dispatch_check, int(dispatched))
+    return handled
+
 
-    for entry in response:
+def notify_dispatch(entries: List[dict]) -> List[float]:
+    """Queue digests for the dispatched run sheets not notified yet; returns their
+    dispatched_at timestamps. Callers hold ``feed_locks['dispatch']``."""
+    handled: List[float] = []
+    for entry in entries:
         run_sheet_id = entry.get('id')
         if not run_sheet_id:
             continue
@@ -740,25 +1230,23 @@ def poll_dispatch_notifications() -> None:
         if not task_summary:
             task_summary = fetch_run_sheet_task_summary(str(run_sheet_id))
             if task_summary:
-                try:
-                    http_request(
-                        f"{SUPABASE_URL}/rest/v1/run_sheets?id=eq.{run_sheet_id}",
-                        method='PATCH',
-                        headers={
-                            'apikey': SUPABASE_API_KEY,
-                            'Authorization': f'Bearer {SUPABASE_API_KEY}',
-                            'Content-Type': 'application/json',
-                        },
-                        body={'task': task_summary},
-                    )
-                except Exception as exc:
-                    log(f'Error updating run_sheets.task: {exc}')
+                writes.update('run_sheets', run_sheet_id, {'task': task_summary}).add_done_callback(
+                    log_write_error('updating run_sheets.task'),
+                )
+
+        stops: List[dict] = []
+        try:
+            stops = sequence_stops(fetch_run_sheet_stops(str(run_sheet_id)), entry.get('date'), entry.get('time_window'))
+            persist_stop_sequence(str(run_sheet_id), stops)
+        except Exception as exc:
+            log(f'Error sequencing run sheet {run_sheet_id}: {exc}')
 
         payload = {
             'team_name': team_name or 'Field Team',
             'date': entry.get('date'),
             'time_window': entry.get('time_window'),
-            'tasks': 'N/A',
+            'tasks': len(stops) if stops else 'N/A',
+            'stops': stops,
             'zones': zones_text,
             'capacity_used_percent': entry.get('capacity_used_percent'),
             'task': task_summary or 'N/A',
@@ -771,40 +1259,43 @@ def poll_dispatch_notifications() -> None:
             chat_id = 0
 
         if chat_id:
-            message = build_dispatch_message(payload, str(run_sheet_id))
-            send_telegram_message(chat_id, message)
+            dispatch_digest.add(chat_id, build_dispatch_message(payload, str(run_sheet_id)))
 
-        sent_dispatch_ids.add(dispatch_id)
-        ts = entry.get('dispatched_at')
-        if ts:
-            try:
-                last_dispatch_check = max(
-                    last_dispatch_check,
-                    int(datetime.fromisoformat(ts.replace('Z', '+00:00')).timestamp()),
-                )
-            except Exception:
-                last_dispatch_check = int(time.time())
+        mark_sent('dispatch', sent_dispatch_ids, dispatch_id)
+        dispatched = _parse_ts(entry.get('dispatched_at'))
+        if dispatched is not None:
+            handled.append(dispatched)
 
+    return handled
 
-def poll_resolution_notifications() -> None:
+
+dispatch_digest = DigestCoalescer(
+    send=lambda chat_id, text: send_telegram_message(chat_id, text),
+    max_hold=DIGEST_MAX_HOLD_SECONDS,
+    header=lambda count: render_message('dispatch_digest_header', count=count),
+    on_error=lambda chat_id, exc: log(f'Failed to send dispatch digest to {chat_id}: {exc}'),
+)
+
+
+def poll_resolution_notifications() -> List[float]:
     """Notify users via Telegram when their complaint is resolved (VERIFIED/CLOSED).
-    Sends a message directing them to the mini app for details and photos."""
+    Sends a message directing them to the mini app for details and photos.
+    Returns the resolved_at timestamps of the complaints handled."""
     global last_resolution_check
     if not SUPABASE_URL or not SUPABASE_API_KEY:
-        return
+        return []
 
     since_iso = datetime.fromtimestamp(last_resolution_check, tz=timezone.utc).isoformat()
-    encoded_since = urllib.parse.quote(since_iso, safe='')
 
-    # Find recently resolved complaints that have a telegram_user_id
+    # Find recently resolved complaints; all of them feed the SLA sketches,
+    # only those with a telegram_user_id get a notification.
     url = (
-        f"{SUPABASE_URL}/rest/v1/complaints?"
-        f"select=id,text,category_pred,location_label,status,telegram_user_id"
-        f"&status=in.(VERIFIED,CLOSED)"
-        f"&telegram_user_id=not.is.null"
-        f"&created_at=gt.{encoded_since}"
-        f"&order=created_at.asc"
-        f"&limit=20"
+        Query('complaints', 'complaint.resolution')
+        .in_('status', ['VERIFIED', 'CLOSED'])
+        .where('resolved_at', 'gt', since_iso)
+        .order('resolved_at')
+        .limit(50)
+        .url(SUPABASE_URL)
     )
 
     try:
@@ -818,23 +1309,47 @@ def poll_resolution_notifications() -> None:
         )
     except Exception as exc:
         log(f'Error polling resolution notifications: {exc}')
-        return
+        return []
 
     if not isinstance(response, list) or not response:
-        return
+        return []
 
-    for row in response:
+    with feed_locks['resolution']:
+        handled = notify_resolutions(response)
+        # Every row counts towards the watermark: those not sent were skipped on purpose.
+        for row in response:
+            resolved = _parse_ts(row.get('resolved_at'))
+            if resolved is not None:
+                last_resolution_check = max(last_resolution_check, int(resolved))
+    return handled
+
+
+def notify_resolutions(rows: List[dict]) -> List[float]:
+    """Record the resolved complaints not handled yet in the rollups and SLA sketches and
+    notify their reporters; returns their resolved_at timestamps. Callers hold
+    ``feed_locks['resolution']``."""
+    handled: List[float] = []
+    for row in rows:
         complaint_id = row.get('id')
         if not complaint_id or complaint_id in sent_resolution_ids:
             continue
 
+        daily_rollups.mark_row(row)
+        record_resolution_time(row)
+        complaint_index.remove(complaint_id)
+        resolved = _parse_ts(row.get('resolved_at'))
+        if resolved is not None:
+            handled.append(resolved)
+
         uid_str = row.get('telegram_user_id')
         if not uid_str or uid_str == 'anonymous':
+            mark_sent('resolution', sent_resolution_ids, complaint_id)
             continue
 
         try:
             chat_id = int(uid_str)
         except (ValueError, TypeError):
+            mark_sent('resolution', sent_resolution_ids, complaint_id)
             continue
 
         category = row.get('category_pred') or 'issue'
@@ -842,15 +1357,14 @@ def poll_resolution_notifications() -> None:
 
         miniapp_link = ''
         if TELEGRAM_MINIAPP_URL:
-            miniapp_link = f"\n\n📱 View details & resolution photos:\n{TELEGRAM_MINIAPP_URL}/complaints/{complaint_id}"
-
-        message = (
-            f"✅ *Your complaint has been resolved!*\n\n"
-            f"📂 Category: {category}\n"
-            f"📍 Location: {location}\n"
-            f"🆔 ID: `{str(complaint_id)[:8]}`"
-            f"{miniapp_link}\n\n"
-            f"Thank you for reporting this! 🌟"
+            miniapp_link = render_message('miniapp_link', url=f"{TELEGRAM_MINIAPP_URL}/complaints/{complaint_id}")
+
+        message = render_message(
+            'complaint_resolved',
+            category=category,
+            location=location,
+            complaint_ref=str(complaint_id)[:8],
+            miniapp=miniapp_link,
         )
 
         try:
@@ -859,34 +1373,485 @@ def poll_resolution_notifications() -> None:
         except Exception as exc:
             log(f'Failed to send resolution notification to {uid_str}: {exc}')
 
-        sent_resolution_ids.add(complaint_id)
+        mark_sent('resolution', sent_resolution_ids, complaint_id)
 
-    # Update watermark
-    last_resolution_check = int(time.time())
+    try:
+        resolution_sketches.flush()
+    except Exception as exc:
+        log(f'Error saving resolution sketches: {exc}')
 
+    return handled
 
-def link_telegram_to_complaint(telegram_user_id: int, telegram_username: Optional[str]) -> Optional[str]:
-    """Find the complaint the Watson agent just created and link the Telegram user to it."""
-    if not SUPABASE_URL or not SUPABASE_API_KEY:
-        log('Cannot link complaint: Missing Supabase configuration')
-        return None
 
-    try:
-        # Find the most recent complaint without a telegram_user_id (created by the Watson agent)
-        # that was created in the last 60 seconds
-        since_iso = datetime.fromtimestamp(time.time() - 60, tz=timezone.utc).isoformat()
-        encoded_since = urllib.parse.quote(since_iso, safe='')
-        url = (
-            f"{SUPABASE_URL}/rest/v1/complaints?"
-            f"select=id,status"
-            f"&telegram_user_id=is.null"
-            f"&created_at=gt.{encoded_since}"
-            f"&order=created_at.desc"
-            f"&limit=1"
-        )
-        response = _fetch_json(url)
+def fetch_rollup_source_day(day: str) -> List[dict]:
+    start_iso, end_iso = day_bounds(day, ROLLUP_UTC_OFFSET_HOURS)
+    return _query_all(
+        Query('complaints', 'complaint.rollup')
+        .where('created_at', 'gte', start_iso)
+        .where('created_at', 'lt', end_iso)
+        .order('id')
+    )
 
-        if not isinstance(response, list) or not response:
+
+def fetch_rollup_keys(day: str) -> Set[tuple]:
+    rows = _fetch_json(
+        f"{SUPABASE_URL}/rest/v1/complaint_daily_rollups?"
+        f"select=day,zone_id,category&day=eq.{day}"
+    )
+    if not isinstance(rows, list):
+        return set()
+    return {(row.get('day'), row.get('zone_id'), row.get('category')) for row in rows}
+
+
+daily_rollups = DailyRollups(
+    fetch_day=fetch_rollup_source_day,
+    fetch_existing=fetch_rollup_keys,
+    upsert=lambda rows: _upsert_rows('complaint_daily_rollups', rows, 'day,zone_id,category'),
+    utc_offset_hours=ROLLUP_UTC_OFFSET_HOURS,
+)
+
+
+def poll_rollup_updates() -> List[float]:
+    """Mark days touched by new complaints dirty and rebuild their rollup rows.
+    Today and yesterday are also rebuilt every ROLLUP_REFRESH_SECONDS to pick up status changes.
+    Returns the created_at timestamps of the new complaints seen."""
+    global last_rollup_check, last_rollup_refresh
+    if not SUPABASE_URL or not SUPABASE_API_KEY:
+        return []
+
+    since_iso = datetime.fromtimestamp(last_rollup_check, tz=timezone.utc).isoformat()
+    encoded_since = urllib.parse.quote(since_iso, safe='')
+    url = (
+        f"{SUPABASE_URL}/rest/v1/complaints?"
+        f"select=created_at"
+        f"&created_at=gt.{encoded_since}"
+        f"&order=created_at.asc"
+        f"&limit=500"
+    )
+
+    try:
+        response = _fetch_json(url)
+    except Exception as exc:
+        log(f'Error polling complaints for rollups: {exc}')
+        return []
+
+    handled: List[float] = []
+    if isinstance(response, list):
+        for row in response:
+            daily_rollups.mark_row(row)
+            ts = row.get('created_at')
+            if ts:
+                try:
+                    created = datetime.fromisoformat(ts.replace('Z', '+00:00')).timestamp()
+                    last_rollup_check = max(last_rollup_check, int(created))
+                    handled.append(created)
+                except Exception:
+                    last_rollup_check = int(time.time())
+
+    now = time.time()
+    if now - last_rollup_refresh > ROLLUP_REFRESH_SECONDS:
+        today = local_today()
+        daily_rollups.mark_day(today.isoformat())
+        daily_rollups.mark_day((today - timedelta(days=1)).isoformat())
+        last_rollup_refresh = now
+
+    try:
+        written = daily_rollups.flush()
+        if written:
+            log(f'Rollups updated: {written} rows')
+    except Exception as exc:
+        log(f'Error updating complaint rollups: {exc}')
+
+    return handled
+
+
+def backfill_rollups(start_day: str, end_day: str) -> None:
+    if not SUPABASE_URL or not SUPABASE_API_KEY:
+        raise RuntimeError('Missing SUPABASE_URL or SUPABASE_API_KEY in environment.')
+    log(f'Backfilling complaint rollups {start_day} .. {end_day}')
+    total = daily_rollups.backfill(
+        start_day,
+        end_day,
+        on_day=lambda day, count: log(f'  {day}: {count} rows'),
+    )
+    log(f'Backfill complete: {total} rows')
+
+
+def fetch_resolution_samples(day: str) -> List[tuple]:
+    """Every complaint resolved on a local day as ``({dimension: key}, seconds to resolve)``."""
+    start_iso, end_iso = day_bounds(day, ROLLUP_UTC_OFFSET_HOURS)
+    rows = _query_all(
+        Query('complaints', 'complaint.resolution')
+        .in_('status', ['VERIFIED', 'CLOSED'])
+        .where('resolved_at', 'gte', start_iso)
+        .where('resolved_at', 'lt', end_iso)
+        .order('id')
+    )
+    samples = []
+    for row in rows:
+        created = _parse_ts(row.get('created_at'))
+        resolved = _parse_ts(row.get('resolved_at'))
+        if created is None or resolved is None:
+            continue
+        cluster = row.get('cluster') or {}
+        tasks = cluster.get('tasks') if isinstance(cluster, dict) else None
+        team = ''
+        if isinstance(tasks, list):
+            team = next((str(t['assigned_team']) for t in tasks if t.get('assigned_team')), '')
+        dimensions = {
+            'zone': complaint_zone(row),
+            'category': row.get('category_pred') or 'uncategorised',
+            'team': team,
+        }
+        samples.append((dimensions, max(0.0, resolved - created)))
+    return samples
+
+
+def fetch_resolution_sketch_keys(day: str) -> Set[tuple]:
+    rows = _fetch_json(f"{SUPABASE_URL}/rest/v1/resolution_sketches?select=day,dimension,key&day=eq.{day}")
+    if not isinstance(rows, list):
+        return set()
+    return {(row.get('day'), row.get('dimension'), row.get('key')) for row in rows}
+
+
+resolution_sketches = SketchWindow(
+    fetch_day=fetch_resolution_samples,
+    fetch_existing=fetch_resolution_sketch_keys,
+    save=lambda rows: _upsert_rows('resolution_sketches', rows, 'day,dimension,key'),
+)
+
+
+def local_today():
+    return (datetime.now(timezone.utc) + timedelta(hours=ROLLUP_UTC_OFFSET_HOURS)).date()
+
+
+def _parse_ts(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def record_resolution_time(row: dict) -> None:
+    """Mark the day a complaint was resolved for a rebuild of its resolution-time sketches."""
+    day = local_day(row.get('resolved_at') or '', ROLLUP_UTC_OFFSET_HOURS)
+    if day:
+        resolution_sketches.mark_day(day)
+
+
+def fetch_sla_percentiles(dimension: str, days: int) -> dict:
+    today = local_today()
+    start = today - timedelta(days=max(days, 1) - 1)
+    rows = _fetch_json(
+        f"{SUPABASE_URL}/rest/v1/resolution_sketches?"
+        f"select=key,sketch&dimension=eq.{dimension}"
+        f"&day=gte.{start.isoformat()}&day=lte.{today.isoformat()}"
+    )
+    return percentiles(rows if isinstance(rows, list) else [])
+
+
+def _format_hours(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '-'
+    return f"{seconds / 3600:.1f}h"
+
+
+def build_sla_message(days: int, dimension: str = 'zone') -> str:
+    try:
+        stats = fetch_sla_percentiles(dimension, days)
+    except Exception as exc:
+        log(f'Error fetching SLA percentiles: {exc}')
+        return render_message('error', error=exc)
+
+    if not stats:
+        return render_message('sla_empty', days=days)
+
+    lines = [render_message('sla_header', dimension=dimension, days=days)]
+    ranked = sorted(stats.items(), key=lambda item: item[1].get('p90') or 0, reverse=True)
+    for key, entry in ranked[:20]:
+        lines.append(render_message(
+            'sla_row',
+            key=key,
+            p50=_format_hours(entry.get('p50')),
+            p90=_format_hours(entry.get('p90')),
+            p99=_format_hours(entry.get('p99')),
+            count=entry.get('count'),
+        ))
+    return '\n'.join(lines)
+
+
+def fetch_planning_inputs(plan_date: str) -> tuple:
+    tasks = _query(
+        Query('tasks', 'task.planning')
+        .in_('status', ['PLANNED', 'APPROVED'])
+        .where('assigned_team', 'is', 'null')
+        .order('created_at')
+    )
+    teams = _query(Query('teams', 'team.planning').eq('is_active', 'true'))
+    sheets = _query(Query('run_sheets', 'run_sheet.planning').eq('date', plan_date))
+    return tasks, teams, sheets
+
+
+def write_run_sheet_plan(plan_date: str, sheets: List[dict], tasks: Dict[str, dict]) -> List[str]:
+    """Persist planned sheets: one bulk insert each for run_sheets and run_sheet_tasks,
+    then one tasks PATCH per sheet. If a step fails, the earlier ones are undone, as
+    the create-run-sheet function does, and the error is raised. ``tasks`` holds the
+    planned tasks as fetched, to restore them. Returns the run sheet ids touched."""
+    headers = {
+        'apikey': SUPABASE_API_KEY,
+        'Authorization': f'Bearer {SUPABASE_API_KEY}',
+        'Content-Type': 'application/json',
+    }
+
+    created_sheet_ids: List[str] = []
+    linked_sheets: List[dict] = []
+    scheduled_task_ids: List[str] = []
+    try:
+        new_sheets = [sheet for sheet in sheets if not sheet.get('run_sheet_id')]
+        if new_sheets:
+            created = http_request(
+                f"{SUPABASE_URL}/rest/v1/run_sheets?select=id,team_id,time_window",
+                method='POST',
+                headers={**headers, 'Prefer': 'return=representation'},
+                body=[
+                    {
+                        'team_id': sheet['team_id'],
+                        'date': plan_date,
+                        'time_window': sheet['time_window'],
+                        'status': 'draft',
+                        'zones_covered': sheet['zones_covered'],
+                        'capacity_used_percent': sheet['capacity_used_percent'],
+                        'notes': 'Auto-planned',
+                    }
+                    for sheet in new_sheets
+                ],
+            )
+            created_ids = {
+                (row.get('team_id'), row.get('time_window')): row.get('id')
+                for row in (created if isinstance(created, list) else [])
+            }
+            created_sheet_ids = [sheet_id for sheet_id in created_ids.values() if sheet_id]
+            for sheet in new_sheets:
+                sheet['run_sheet_id'] = created_ids.get((sheet['team_id'], sheet['time_window']))
+
+        link_rows = []
+        for sheet in sheets:
+            if not sheet.get('run_sheet_id'):
+                log(f"Planner: no run sheet id for team {sheet['team_id']} {sheet['time_window']}, skipping")
+                continue
+            durations = sheet.get('durations') or {}
+            for index, task_id in enumerate(sheet['task_ids'], start=sheet.get('existing_tasks', 0) + 1):
+                link_rows.append({
+                    'run_sheet_id': sheet['run_sheet_id'],
+                    'task_id': task_id,
+                    'sequence': index,
+                    'estimated_duration': durations.get(task_id, round(DEFAULT_DURATION_MINUTES)),
+                })
+        if link_rows:
+            http_request(
+                f"{SUPABASE_URL}/rest/v1/run_sheet_tasks",
+                method='POST',
+                headers={**headers, 'Prefer': 'return=minimal'},
+                body=link_rows,
+            )
+            linked_sheets = [sheet for sheet in sheets if sheet.get('run_sheet_id')]
+
+        for sheet in sheets:
+            if not sheet.get('run_sheet_id'):
+                continue
+            ids_filter = urllib.parse.quote(','.join(sheet['task_ids']), safe=',')
+            http_request(
+                f"{SUPABASE_URL}/rest/v1/tasks?id=in.({ids_filter})",
+                method='PATCH',
+                headers={**headers, 'Prefer': 'return=minimal'},
+                body={
+                    'status': 'SCHEDULED',
+                    'assigned_team': sheet['team_id'],
+                    'planned_date': plan_date,
+                    'time_window': sheet['time_window'],
+                },
+            )
+            scheduled_task_ids.extend(sheet['task_ids'])
+    except Exception:
+        rollback_run_sheet_plan(created_sheet_ids, linked_sheets, scheduled_task_ids, tasks)
+        raise
+
+    for sheet in sheets:
+        if sheet.get('run_sheet_id') and sheet.get('existing_tasks'):
+            http_request(
+                f"{SUPABASE_URL}/rest/v1/run_sheets?id=eq.{sheet['run_sheet_id']}",
+                method='PATCH',
+                headers={**headers, 'Prefer': 'return=minimal'},
+                body={'capacity_used_percent': sheet['capacity_used_percent']},
+            )
+
+    return [sheet['run_sheet_id'] for sheet in sheets if sheet.get('run_sheet_id')]
+
+
+def rollback_run_sheet_plan(
+    created_sheet_ids: List[str], linked_sheets: List[dict], scheduled_task_ids: List[str], tasks: Dict[str, dict],
+) -> None:
+    """Undo a partly written plan: restore scheduled tasks, unlink tasks and delete the new sheets."""
+    headers = {
+        'apikey': SUPABASE_API_KEY,
+        'Authorization': f'Bearer {SUPABASE_API_KEY}',
+        'Content-Type': 'application/json',
+        'Prefer': 'return=minimal',
+    }
+    previous: Dict[tuple, List[str]] = {}
+    for task_id in scheduled_task_ids:
+        task = tasks.get(task_id) or {}
+        previous.setdefault((task.get('status'), task.get('planned_date'), task.get('time_window')), []).append(task_id)
+    steps = [
+        (
+            f"{SUPABASE_URL}/rest/v1/tasks?id=in.({urllib.parse.quote(','.join(task_ids), safe=',')})",
+            'PATCH',
+            {'status': status, 'assigned_team': None, 'planned_date': planned_date, 'time_window': time_window},
+        )
+        for (status, planned_date, time_window), task_ids in previous.items()
+    ]
+    for sheet in linked_sheets:
+        ids_filter = urllib.parse.quote(','.join(sheet['task_ids']), safe=',')
+        steps.append((
+            f"{SUPABASE_URL}/rest/v1/run_sheet_tasks?run_sheet_id=eq.{sheet['run_sheet_id']}&task_id=in.({ids_filter})",
+            'DELETE',
+            None,
+        ))
+    if created_sheet_ids:
+        ids_filter = urllib.parse.quote(','.join(created_sheet_ids), safe=',')
+        steps.append((f"{SUPABASE_URL}/rest/v1/run_sheets?id=in.({ids_filter})", 'DELETE', None))
+
+    for url, method, body in steps:
+        try:
+            http_request(url, method=method, headers=headers, body=body)
+        except Exception as exc:
+            log(f'Planner: rollback step {method} {url} failed: {exc}')
+    log(
+        f'Planner: rolled back {len(scheduled_task_ids)} scheduled tasks, {len(linked_sheets)} sheet links '
+        f'and {len(created_sheet_ids)} new sheets'
+    )
+
+
+def auto_plan_day(plan_date: str, dry_run: bool = False) -> dict:
+    started = time.time()
+    tasks, teams, existing = fetch_planning_inputs(plan_date)
+    plan = plan_tasks(tasks, build_slots(teams, existing))
+    task_by_id = {task.get('id'): task for task in tasks}
+    for sheet in plan['sheets']:
+        stops = sequence_stops(
+            [{'task_id': task_id, 'cluster': task_by_id[task_id].get('cluster')} for task_id in sheet['task_ids']],
+            plan_date,
+            sheet['time_window'],
+        )
+        sheet['task_ids'] = [stop['task_id'] for stop in stops]
+        sheet['durations'] = {stop['task_id']: stop['duration'] for stop in stops}
+    planned_at = time.time()
+    if not dry_run and plan['sheets']:
+        write_run_sheet_plan(plan_date, plan['sheets'], task_by_id)
+    log(
+        f"Planner {plan_date}: {sum(len(s['task_ids']) for s in plan['sheets'])} tasks into "
+        f"{len(plan['sheets'])} sheets, {len(plan['unassigned'])} unassigned "
+        f"(plan {1000 * (planned_at - started):.0f}ms, total {1000 * (time.time() - started):.0f}ms)"
+    )
+    return plan
+
+
+def build_plan_message(plan_date: str, plan: dict, dry_run: bool = False) -> str:
+    lines = [render_message('plan_header', date=plan_date, suffix=' (dry run)' if dry_run else '')]
+    for sheet in plan['sheets']:
+        lines.append(render_message(
+            'plan_row',
+            team=sheet.get('team_name') or 'Team',
+            window=sheet['time_window'],
+            count=len(sheet['task_ids']),
+            percent=sheet['capacity_used_percent'],
+            zones=', '.join(sheet['zones_covered']) or 'N/A',
+        ))
+    if not plan['sheets']:
+        lines.append(render_message('plan_empty'))
+    if plan['unassigned']:
+        lines.append(render_message('plan_unassigned', count=len(plan['unassigned'])))
+    return '\n'.join(lines)
+
+
+def fetch_complaint_by_correlation(correlation_id: str) -> Optional[dict]:
+    """The complaint the agent filed for a conversation, if it has filed one."""
+    rows = _fetch_json(
+        f"{SUPABASE_URL}/rest/v1/complaints?select=id,telegram_user_id"
+        f"&correlation_id=eq.{urllib.parse.quote(correlation_id)}&limit=1"
+    )
+    return rows[0] if isinstance(rows, list) and rows else None
+
+
+def claim_unlinked_complaint(filters: str, link: dict) -> Optional[str]:
+    """Set the Telegram user on a complaint matching ``filters`` that has none; the id if one was updated."""
+    rows = http_request(
+        f"{SUPABASE_URL}/rest/v1/complaints?select=id&{filters}&telegram_user_id=is.null",
+        method='PATCH',
+        headers={
+            'apikey': SUPABASE_API_KEY,
+            'Authorization': f'Bearer {SUPABASE_API_KEY}',
+            'Content-Type': 'application/json',
+            'Prefer': 'return=representation',
+        },
+        body=link,
+    )
+    if isinstance(rows, list) and rows:
+        return rows[0].get('id')
+    return None
+
+
+@traced('link_complaint')
+def link_telegram_to_complaint(
+    telegram_user_id: int, telegram_username: Optional[str], correlation_id: Optional[str] = None,
+) -> Optional[str]:
+    """Find the complaint the Watson agent just created and link the Telegram user to it."""
+    if not SUPABASE_URL or not SUPABASE_API_KEY:
+        log('Cannot link complaint: Missing Supabase configuration')
+        return None
+
+    link = {
+        'telegram_user_id': str(telegram_user_id),
+        'telegram_username': telegram_username or 'anonymous',
+    }
+    if correlation_id:
+        # The complaint carries the session's correlation id: claim it in one conditional update.
+        try:
+            complaint_id = claim_unlinked_complaint(f"correlation_id=eq.{urllib.parse.quote(correlation_id)}", link)
+            if complaint_id:
+                log(f'Linked telegram user {telegram_user_id} to complaint {complaint_id}')
+                return complaint_id
+            existing = fetch_complaint_by_correlation(correlation_id)
+            if existing:
+                # Already linked (by an earlier attempt or a replay); never claim a second complaint.
+                if existing.get('telegram_user_id') == str(telegram_user_id):
+                    return existing.get('id')
+                log(f"Complaint {existing.get('id')} with correlation id {correlation_id} is already linked")
+                return None
+            log(f'No complaint with correlation id {correlation_id}; falling back to the most recent one')
+        except Exception as exc:
+            log(f'Error linking complaint by correlation id: {exc}')
+
+    try:
+        # Find the most recent complaint without a telegram_user_id (created by the Watson agent)
+        # that was created in the last 60 seconds. Complaints carrying a correlation id belong
+        # to another conversation and are claimed by it.
+        since_iso = datetime.fromtimestamp(time.time() - 60, tz=timezone.utc).isoformat()
+        encoded_since = urllib.parse.quote(since_iso, safe='')
+        url = (
+            f"{SUPABASE_URL}/rest/v1/complaints?"
+            f"select=id,status"
+            f"&telegram_user_id=is.null"
+            f"&correlation_id=is.null"
+            f"&created_at=gt.{encoded_since}"
+            f"&order=created_at.desc"
+            f"&limit=1"
+        )
+        response = _fetch_json(url)
+
+        if not isinstance(response, list) or not response:
             log('No recent agent-created complaint found to link')
             return None
 
@@ -894,20 +1859,10 @@ def link_telegram_to_complaint(telegram_user_id: int, telegram_username: Optiona
         if not complaint_id:
             return None
 
-        # Patch it with the Telegram user info
-        http_request(
-            f"{SUPABASE_URL}/rest/v1/complaints?id=eq.{complaint_id}",
-            method='PATCH',
-            headers={
-                'apikey': SUPABASE_API_KEY,
-                'Authorization': f'Bearer {SUPABASE_API_KEY}',
-                'Content-Type': 'application/json',
-            },
-            body={
-                'telegram_user_id': str(telegram_user_id),
-                'telegram_username': telegram_username or 'anonymous',
-            },
-        )
+        # Patch it with the Telegram user info, unless a concurrent conversation got there first
+        if not claim_unlinked_complaint(f"id=eq.{urllib.parse.quote(str(complaint_id))}", link):
+            log(f'Complaint {complaint_id} was linked by another conversation')
+            return None
 
         log(f'Linked telegram user {telegram_user_id} to complaint {complaint_id}')
         return complaint_id
@@ -916,6 +1871,7 @@ def link_telegram_to_complaint(telegram_user_id: int, telegram_username: Optiona
         return None
 
 
+@traced('cluster_complaint')
 def cluster_complaint(complaint_id: str) -> None:
     """Trigger clustering for a newly created complaint."""
     if not SUPABASE_URL or not SUPABASE_API_KEY:
@@ -939,10 +1895,135 @@ def cluster_complaint(complaint_id: str) -> None:
         log(f'Error triggering cluster-complaints: {exc}')
 
 
+# Recent open complaints, fingerprinted so repeat reports can skip the agent.
+complaint_index = NearDuplicateIndex(DEDUPE_THRESHOLD)
+
+
+def poll_complaint_index() -> List[float]:
+    """Add new open complaints to the near-duplicate index and drop those resolved since the
+    last poll or past the window. Returns the created_at timestamps of the complaints added."""
+    global last_dedupe_check, last_dedupe_resolved_check
+    if not SUPABASE_URL or not SUPABASE_API_KEY:
+        return []
+
+    since_iso = datetime.fromtimestamp(last_dedupe_check, tz=timezone.utc).isoformat()
+    rows = _query(
+        Query('complaints', 'complaint.dedupe')
+        .where('created_at', 'gt', since_iso)
+        .where('status', 'not.in', '(VERIFIED,CLOSED)')
+        .order('created_at')
+        .limit(500)
+    )
+
+    added: List[float] = []
+    for row in rows:
+        created = _parse_ts(row.get('created_at'))
+        if created is None:
+            continue
+        complaint_index.add(row)
+        last_dedupe_check = max(last_dedupe_check, int(created))
+        added.append(created)
+
+    # Every process prunes resolved complaints itself: notify_resolutions only runs on the leader.
+    resolved_iso = datetime.fromtimestamp(last_dedupe_resolved_check, tz=timezone.utc).isoformat()
+    resolved = _query(
+        Query('complaints', 'complaint.resolved_ref')
+        .in_('status', ['VERIFIED', 'CLOSED'])
+        .where('resolved_at', 'gt', resolved_iso)
+        .order('resolved_at')
+        .limit(500)
+    )
+    for row in resolved:
+        if row.get('id'):
+            complaint_index.remove(row['id'])
+        resolved_at = _parse_ts(row.get('resolved_at'))
+        if resolved_at is not None:
+            last_dedupe_resolved_check = max(last_dedupe_resolved_check, int(resolved_at))
+
+    cutoff = time.time() - DEDUPE_WINDOW_HOURS * 3600
+    complaint_index.prune(lambda row: (_parse_ts(row.get('created_at')) or 0) >= cutoff)
+    return added
+
+
+def link_duplicate_complaint(original: dict, telegram_user_id: int, telegram_username: Optional[str], text: str) -> str:
+    """File the resident's report against an open complaint it duplicates and return the
+    complaint id to show them. A repeat report by the same resident files nothing new."""
+    if str(original.get('telegram_user_id') or '') == str(telegram_user_id):
+        return original['id']
+
+    cluster_id = original.get('cluster_id')
+    created = http_request(
+        f"{SUPABASE_URL}/rest/v1/complaints",
+        method='POST',
+        headers={
+            'apikey': SUPABASE_API_KEY,
+            'Authorization': f'Bearer {SUPABASE_API_KEY}',
+            'Content-Type': 'application/json',
+            'Prefer': 'return=representation',
+        },
+        body={
+            'text': text,
+            'location_label': original.get('location_label'),
+            'category_pred': original.get('category_pred'),
+            'severity_pred': original.get('severity_pred'),
+            'urgency_pred': original.get('urgency_pred'),
+            'cluster_id': cluster_id,
+            'status': 'LINKED' if cluster_id else 'RECEIVED',
+            'telegram_user_id': str(telegram_user_id),
+            'telegram_username': telegram_username or 'anonymous',
+        },
+    )
+    row = created[0] if isinstance(created, list) and created else created
+    complaint_id = row.get('id') if isinstance(row, dict) else None
+    if not complaint_id:
+        raise RuntimeError(f'No complaint id in response: {created}')
+    if not cluster_id:
+        # Same place and category as an unclustered complaint: clustering pairs them up.
+        cluster_complaint(complaint_id)
+    log(f"Linked duplicate report from {telegram_user_id} to complaint {original['id'][:8]} as {complaint_id[:8]}")
+    return complaint_id
+
+
+@traced('dedupe')
+def handle_duplicate_complaint(chat_id: int, user_id: int, username: Optional[str], text: str) -> bool:
+    """Fast path for reports that match an open complaint in the same area.
+    Returns True when the report was handled without the agent."""
+    turns = [turn['text'] for turn in (sessions.get('history', chat_id) or []) if turn.get('role') == 'user']
+    conversation = ' '.join(turns + [text])
+    found = complaint_index.match(conversation)
+    if not found:
+        return False
+    original, score = found
+
+    try:
+        complaint_id = link_duplicate_complaint(original, user_id, username, conversation)
+    except Exception as exc:
+        log(f'Error linking duplicate complaint: {exc}')
+        return False
+
+    if complaint_id == original['id']:
+        message = render_message(
+            'duplicate_own',
+            complaint_ref=complaint_id[:8],
+            status=original.get('status') or 'RECEIVED',
+        )
+    else:
+        message = render_message(
+            'duplicate_linked',
+            category=original.get('category_pred') or 'issue',
+            location=original.get('location_label') or 'your area',
+            complaint_ref=complaint_id[:8],
+        )
+    log(f"Duplicate report from {user_id} matched complaint {original['id'][:8]} (similarity {score:.2f})")
+    send_telegram_message(chat_id, message)
+    return True
+
+
+@traced('status_lookup')
 def check_complaint_status(complaint_id: str, telegram_user_id: Optional[str] = None) -> str:
     """Check the status of a complaint by partial ID prefix."""
     if not SUPABASE_URL or not SUPABASE_API_KEY:
-        return '❌ Database not configured.'
+        return render_message('db_not_configured')
 
     try:
         prefix_lower = complaint_id.lower()
@@ -965,12 +2046,12 @@ def check_complaint_status(complaint_id: str, telegram_user_id: Optional[str] =
         response = _fetch_json(url)
 
         if not isinstance(response, list) or not response:
-            return '❌ Complaint not found.'
+            return render_message('complaint_not_found')
 
         # Match by prefix
         matches = [r for r in response if r.get('id', '').lower().startswith(prefix_lower)]
         if not matches:
-            return '❌ Complaint not found.'
+            return render_message('complaint_not_found')
 
         data = matches[0]
         created = data.get('created_at', '')
@@ -978,23 +2059,24 @@ def check_complaint_status(complaint_id: str, telegram_user_id: Optional[str] =
             dt = datetime.fromisoformat(created.replace('Z', '+00:00'))
             created = dt.strftime('%Y-%m-%d')
 
-        return (
-            f"📋 *Complaint Status*\n\n"
-            f"🆔 `{data.get('id', 'N/A')}`\n"
-            f"📊 Status: *{data.get('status', 'N/A')}*\n"
-            f"📂 Category: {data.get('category_pred') or 'Processing...'}\n"
-            f"⚡ Severity: {data.get('severity_pred') or '?'}/5\n"
-            f"📅 Submitted: {created}"
+        return render_message(
+            'complaint_status',
+            complaint_id=data.get('id', 'N/A'),
+            status=data.get('status', 'N/A'),
+            category=data.get('category_pred') or 'Processing...',
+            severity=data.get('severity_pred') or '?',
+            submitted=created,
         )
     except Exception as exc:
         log(f'Error checking complaint status: {exc}')
-        return f'❌ Error: {exc}'
+        return render_message('error', error=exc)
 
 
+@traced('complaints_lookup')
 def get_user_complaints(telegram_user_id: str) -> str:
     """Get the recent complaints for a user."""
     if not SUPABASE_URL or not SUPABASE_API_KEY:
-        return '❌ Database not configured.'
+        return render_message('db_not_configured')
 
     try:
         url = f"{SUPABASE_URL}/rest/v1/complaints?telegram_user_id=eq.{telegram_user_id}&select=id,text,status,created_at&order=created_at.desc&limit=5"
@@ -1008,59 +2090,197 @@ def get_user_complaints(telegram_user_id: str) -> str:
         )
 
         if isinstance(response, list) and len(response) > 0:
-            message = '📋 *Your Recent Complaints*\n\n'
+            message = render_message('my_complaints_header')
             for i, complaint in enumerate(response, 1):
-                text_preview = complaint.get('text', '')[:50]
-                complaint_id = complaint.get('id', 'N/A')[:8]
-                status = complaint.get('status', 'N/A')
-                message += f"{i}. {text_preview}...\n"
-                message += f"   🆔 `{complaint_id}` | {status}\n\n"
+                message += render_message(
+                    'my_complaints_row',
+                    index=i,
+                    preview=(complaint.get('text') or '')[:50],
+                    complaint_ref=complaint.get('id', 'N/A')[:8],
+                    status=complaint.get('status', 'N/A'),
+                )
             return message
-        return 'You have no complaints on record.'
+        return render_message('no_complaints')
     except Exception as exc:
         log(f'Error getting user complaints: {exc}')
-        return f'❌ Error: {exc}'
-
-
-def queue_failed_message(telegram_user_id: str, chat_id: str, message_text: str, error_message: str) -> None:
-    """Queue a failed message for later retry."""
+        return render_message('error', error=exc)
+
+
+@traced('queue_failed_message')
+def queue_failed_message(
+    telegram_user_id: str,
+    chat_id: str,
+    message_text: str,
+    error_message: str,
+    telegram_username: Optional[str] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+    correlation_id: Optional[str] = None,
+) -> None:
+    """Queue a failed message for later retry by the replay worker."""
     if not SUPABASE_URL or not SUPABASE_API_KEY:
         log('Cannot queue failed message: Missing Supabase configuration')
         return
 
-    try:
-        url = f"{SUPABASE_URL}/rest/v1/failed_messages"
-        failed_data = {
-            'telegram_user_id': telegram_user_id,
-            'telegram_chat_id': chat_id,
-            'message_text': message_text,
-            'error_message': error_message,
-            'status': 'pending',
-        }
+    failed_data = {
+        'telegram_user_id': telegram_user_id,
+        'telegram_chat_id': chat_id,
+        'message_text': message_text,
+        'error_message': error_message,
+        'status': 'pending',
+        'telegram_username': telegram_username,
+        'history': history or [{'role': 'user', 'text': message_text}],
+        'correlation_id': correlation_id,
+    }
+    writes.insert('failed_messages', failed_data).add_done_callback(log_write_error('queuing failed message'))
+    log(f'Failed message queued for user {telegram_user_id}')
 
-        http_request(
-            url,
-            method='POST',
-            headers={
-                'apikey': SUPABASE_API_KEY,
-                'Authorization': f'Bearer {SUPABASE_API_KEY}',
-                'Content-Type': 'application/json',
-            },
-            body=failed_data,
-        )
-        log(f'Failed message queued for user {telegram_user_id}')
-    except Exception as exc:
-        log(f'Error queuing failed message: {exc}')
+
+def _utc_iso(ts: float) -> str:
+    # Second precision with a Z suffix needs no escaping inside PostgREST or=() filters.
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def claim_failed_messages(limit: int) -> List[dict]:
+    """Lease up to ``limit`` pending failed_messages to this worker.
+
+    The PATCH repeats the claimability filter, so a row another replica leased
+    between the read and the write is not returned (and not processed) here."""
+    if not SUPABASE_URL or not SUPABASE_API_KEY:
+        return []
+    now = time.time()
+    lease_free = ('lease_expires_at.is.null', f'lease_expires_at.lt.{_utc_iso(now)}')
+    candidates = _query(
+        Query('failed_messages', 'failed_message.ref')
+        .eq('status', 'pending')
+        .where('attempts', 'lt', REPLAY_MAX_ATTEMPTS)
+        .or_(*lease_free)
+        .order('created_at')
+        .limit(limit)
+    )
+    ids = [row['id'] for row in candidates if row.get('id')]
+    if not ids:
+        return []
+    claimed = http_request(
+        Query('failed_messages', 'failed_message.replay')
+        .in_('id', ids)
+        .eq('status', 'pending')
+        .or_(*lease_free)
+        .url(SUPABASE_URL),
+        method='PATCH',
+        headers={
+            'apikey': SUPABASE_API_KEY,
+            'Authorization': f'Bearer {SUPABASE_API_KEY}',
+            'Content-Type': 'application/json',
+            'Prefer': 'return=representation',
+        },
+        body={'lease_owner': REPLAY_WORKER_ID, 'lease_expires_at': _utc_iso(now + REPLAY_LEASE_SECONDS)},
+    )
+    rows = claimed if isinstance(claimed, list) else []
+    return sorted(rows, key=lambda row: row.get('created_at') or '')
 
 
-def handle_evidence_photo(chat_id: int, user_id: int, photos: list, message: dict) -> None:
-    session = evidence_sessions.get(user_id)
-    if not session:
+def replay_failed_message(row: dict) -> None:
+    """Re-run a queued complaint conversation through the agent and reply in its chat."""
+    chat_id = int(row.get('telegram_chat_id') or 0)
+    try:
+        user_id = int(row.get('telegram_user_id') or 0)
+    except ValueError:
+        user_id = 0
+    history = row.get('history') if isinstance(row.get('history'), list) else None
+    history = history or [{'role': 'user', 'text': row.get('message_text') or ''}]
+
+    correlation_id = row.get('correlation_id')
+    existing = fetch_complaint_by_correlation(correlation_id) if correlation_id else None
+    if existing:
+        # Filed before the original failure: link it instead of asking the agent to file it again.
+        complaint_id = existing.get('id') or ''
+        if user_id and not existing.get('telegram_user_id'):
+            if link_telegram_to_complaint(user_id, row.get('telegram_username'), correlation_id):
+                cluster_complaint(complaint_id)
+        if chat_id:
+            send_telegram_message(chat_id, render_message(
+                'replay_already_submitted',
+                id_line=render_message('complaint_id_line', complaint_ref=complaint_id[:8]),
+            ))
         return
 
-    if time.time() - session.get('started_at', 0) > 600:
-        del evidence_sessions[user_id]
-        send_telegram_message(chat_id, '⏰ Evidence session timed out. Use `/evidence <task_id>` to start again.')
+    reply = call_review_agent(tag_conversation(history[-MAX_HISTORY:], correlation_id), priority='replay')
+    if not chat_id:
+        return
+
+    if is_asking_questions(reply):
+        # Resume the conversation where it failed, unless the resident has moved on.
+        resumed = (history + [{'role': 'assistant', 'text': reply}])[-MAX_HISTORY:]
+        if user_id and sessions.replace('history', chat_id, None, resumed, SESSION_TTL_SECONDS):
+            sessions.put('complaint', user_id, {
+                'started_at': int(time.time()),
+                'correlation_id': correlation_id or uuid.uuid4().hex,
+            }, SESSION_TTL_SECONDS)
+        send_telegram_message(chat_id, render_message('replay_reply', reply=reply))
+        return
+
+    complaint_id = link_telegram_to_complaint(user_id, row.get('telegram_username'), correlation_id) if user_id else None
+    id_line = ''
+    if complaint_id:
+        id_line = render_message('complaint_id_line', complaint_ref=complaint_id[:8])
+        cluster_complaint(complaint_id)
+    send_telegram_message(chat_id, render_message('replay_submitted', reply=reply, id_line=id_line))
+
+
+def complete_failed_message(row: dict, error: Optional[Exception]) -> None:
+    """Record a replay outcome and release the lease. Failed rows become claimable
+    again after an exponential retry delay, until REPLAY_MAX_ATTEMPTS is reached."""
+    now = time.time()
+    attempts = int(row.get('attempts') or 0) + 1
+    if error is None:
+        body = {'status': 'replayed', 'processed_at': _utc_iso(now), 'lease_expires_at': None}
+    elif attempts >= REPLAY_MAX_ATTEMPTS:
+        body = {'status': 'failed', 'processed_at': _utc_iso(now), 'lease_expires_at': None, 'error_message': str(error)}
+    else:
+        retry_at = now + min(REPLAY_RETRY_BASE_SECONDS * 2 ** (attempts - 1), 6 * 3600)
+        body = {'lease_expires_at': _utc_iso(retry_at), 'error_message': str(error)}
+    body.update({'attempts': attempts, 'lease_owner': None})
+
+    http_request(
+        f"{SUPABASE_URL}/rest/v1/failed_messages?id=eq.{row['id']}&lease_owner=eq.{urllib.parse.quote(REPLAY_WORKER_ID)}",
+        method='PATCH',
+        headers={
+            'apikey': SUPABASE_API_KEY,
+            'Authorization': f'Bearer {SUPABASE_API_KEY}',
+            'Content-Type': 'application/json',
+        },
+        body=body,
+    )
+
+    if body.get('status') == 'failed' and row.get('telegram_chat_id'):
+        try:
+            send_telegram_message(int(row['telegram_chat_id']), render_message('replay_failed'))
+        except Exception as exc:
+            log(f"Failed to notify chat {row['telegram_chat_id']} of dropped message: {exc}")
+
+
+replay_worker = ReplayWorker(
+    claim=claim_failed_messages,
+    process=replay_failed_message,
+    complete=complete_failed_message,
+    batch_size=REPLAY_BATCH_SIZE,
+    concurrency=REPLAY_CONCURRENCY,
+    breaker=upstreams.for_url(WXO_HOST_URL).breaker,
+    on_error=lambda row, exc: log(f"Replay of failed message {row.get('id')} failed: {exc}"),
+)
+
+
+def poll_failed_messages() -> List[float]:
+    """Replay one batch of failed messages; returns their original created_at timestamps."""
+    rows = replay_worker.run_once()
+    return [ts for ts in (_parse_ts(row.get('created_at')) for row in rows) if ts is not None]
+
+
+@traced('evidence_photo')
+def handle_evidence_photo(chat_id: int, user_id: int, photos: list, message: dict, session: dict) -> None:
+    if time.time() - session.get('started_at', 0) > EVIDENCE_SESSION_SECONDS:
+        sessions.pop('evidence', user_id)
+        send_telegram_message(chat_id, render_message('evidence_timeout'))
         return
 
     state = session.get('state', '')
@@ -1069,62 +2289,103 @@ def handle_evidence_photo(chat_id: int, user_id: int, photos: list, message: dic
     largest_photo = photos[-1]
     file_id = largest_photo.get('file_id', '')
     if not file_id:
-        send_telegram_message(chat_id, '⚠️ Could not read the photo. Please try again.')
-        return
-
-    try:
-        send_telegram_message(chat_id, '⏳ Downloading photo...')
-        file_bytes, file_path = download_telegram_file(file_id)
-    except Exception as exc:
-        log(f'Error downloading telegram file: {exc}')
-        send_telegram_message(chat_id, f'⚠️ Failed to download photo: {exc}')
+        send_telegram_message(chat_id, render_message('photo_unreadable'))
         return
 
-    filename = file_path.split('/')[-1] if '/' in file_path else file_path
-
     if state == 'waiting_before_photo':
-        session['before_photo_bytes'] = file_bytes
-        session['before_filename'] = filename
-        session['state'] = 'waiting_after_photo'
-        evidence_sessions[user_id] = session
-
-        send_telegram_message(chat_id, '✅ Before photo received.\n\nNow please send the *AFTER* photo.')
+        # Only the file_id is kept; both photos are downloaded once the after photo arrives.
+        if transition(sessions, 'evidence', user_id, state, {
+            'state': 'waiting_after_photo', 'before_file_id': file_id,
+        }, EVIDENCE_SESSION_SECONDS * 2):
+            send_telegram_message(chat_id, render_message('before_received'))
 
     elif state == 'waiting_after_photo':
-        send_telegram_message(chat_id, '⏳ Uploading evidence...')
+        # Claim the submission so a duplicate after photo cannot upload twice.
+        if not transition(sessions, 'evidence', user_id, state, {'state': 'submitting'}, EVIDENCE_SESSION_SECONDS * 2):
+            return
+
+        try:
+            send_telegram_message(chat_id, render_message('photo_downloading'))
+            before_bytes, before_path = download_telegram_file(session.get('before_file_id', ''))
+            file_bytes, file_path = download_telegram_file(file_id)
+        except Exception as exc:
+            log(f'Error downloading telegram file: {exc}')
+            # Hand the session back so the worker can resend the after photo.
+            sessions.put('evidence', user_id, session, EVIDENCE_SESSION_SECONDS * 2)
+            send_telegram_message(chat_id, render_message('photo_download_failed', error=exc))
+            return
+
+        before_filename = before_path.split('/')[-1] if '/' in before_path else before_path
+        filename = file_path.split('/')[-1] if '/' in file_path else file_path
 
-        before_bytes = session.get('before_photo_bytes')
-        before_filename = session.get('before_filename', 'before.jpg')
+        send_telegram_message(chat_id, render_message('evidence_uploading'))
 
         try:
-            before_url = upload_to_supabase_storage(task_id, 'before', before_bytes, before_filename)
+            before_url = upload_to_supabase_storage(task_id, 'before', before_bytes, before_filename or 'before.jpg')
             after_url = upload_to_supabase_storage(task_id, 'after', file_bytes, filename)
 
             username = message.get('from', {}).get('username', 'field_worker')
             create_evidence_record(task_id, before_url, after_url, f'telegram:{username}')
 
-            del evidence_sessions[user_id]
-
-            task_type = session.get('task_info', {}).get('task_type', 'task')
-            desc = session.get('cluster_info', {}).get('description') or 'task'
+            sessions.pop('evidence', user_id)
 
             send_telegram_message(
                 chat_id,
-                f"✅ *Evidence submitted successfully!*\n\n"
-                f"Task: `{task_id[:8]}` ({task_type})\n"
-                f"Issue: {desc}\n"
-                f"Status: PENDING REVIEW\n\n"
-                "A supervisor will verify and close the task.",
+                render_message(
+                    'evidence_submitted', task_ref=task_id[:8], task_type=session.get('task_type') or 'task',
+                    desc=session.get('desc') or 'task',
+                ),
             )
 
         except Exception as exc:
             log(f'Error uploading evidence: {exc}')
-            send_telegram_message(chat_id, f'⚠️ Failed to upload evidence: {exc}\n\nPlease try again with `/evidence <task_id>`.')
-            if user_id in evidence_sessions:
-                del evidence_sessions[user_id]
+            send_telegram_message(chat_id, render_message('evidence_upload_failed', error=exc))
+            sessions.pop('evidence', user_id)
+
+
+BOT_COMMANDS = {
+    '/start', '/help', '/register', '/sla', '/autoplan', '/health', '/feeds', '/status', '/mycomplaints',
+    '/evidence', '/cancel', '/complaint', '/profile',
+}
+
+
+def update_command(update: dict) -> str:
+    """Bounded label for an update: the command, or photo/text for plain messages."""
+    message = update.get('message') or update.get('edited_message') or {}
+    if message.get('photo'):
+        return 'photo'
+    text = (message.get('text') or '').strip()
+    if not text.startswith('/'):
+        return 'text' if text else 'other'
+    command = text.split()[0].split('@')[0].lower()
+    return command if command in BOT_COMMANDS else 'unknown'
 
 
 def handle_update(update: dict) -> None:
+    command = update_command(update)
+    message = update.get('message') or update.get('edited_message') or {}
+    attributes = {
+        'update_id': update.get('update_id'),
+        'chat_id': (message.get('chat') or {}).get('id'),
+        'command': command,
+    }
+    if message.get('date'):
+        # Time the update spent waiting in Telegram / the getUpdates batch before handling.
+        attributes['telegram_delay_s'] = round(time.time() - message['date'], 3)
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        with tracer.root('update', **attributes):
+            _handle_update(update)
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        updates_total.inc(command=command, outcome=outcome)
+        update_seconds.observe(time.perf_counter() - started, command=command)
+
+
+def _handle_update(update: dict) -> None:
     message = update.get('message') or update.get('edited_message')
     if not message:
         return
@@ -1144,11 +2405,12 @@ def handle_update(update: dict) -> None:
 
     # Handle photo messages for evidence upload flow
     if photos and user_id:
-        if user_id in evidence_sessions:
-            handle_evidence_photo(chat_id, user_id, photos, message)
+        session = sessions.get('evidence', user_id)
+        if session:
+            handle_evidence_photo(chat_id, user_id, photos, message, session)
             return
         else:
-            send_telegram_message(chat_id, 'To upload evidence photos, first start with:\n`/evidence <task_id>`')
+            send_telegram_message(chat_id, render_message('evidence_photo_hint'))
             return
 
     if not text:
@@ -1156,48 +2418,94 @@ def handle_update(update: dict) -> None:
 
     # Handle /start command
     if text.strip().lower() == '/start':
-        welcome_msg = (
-            "👋 *Welcome to Lulu Town Council Bot!*\n\n"
-            "📝 /complaint - Submit a complaint\n"
-            "🔍 /status <ID> - Check complaint\n"
-            "📋 /mycomplaints - Your history\n"
-            "📸 /evidence <task\\_id> - Upload evidence\n"
-            "❓ /help - Show help"
-        )
-        send_telegram_message(chat_id, welcome_msg)
+        send_telegram_message(chat_id, render_message('welcome'))
         return
 
     # Handle /help command
     if text.strip().lower() == '/help':
-        help_msg = (
-            "🆘 *Help & Commands*\n\n"
-            "*Submit:* /complaint\n"
-            "*Check:* /status <ID>\n"
-            "*History:* /mycomplaints\n"
-            "*Evidence:* /evidence <task\\_id>\n"
-            "*Cancel:* /cancel\n\n"
-            "✅ Include location\n"
-            "✅ Be specific\n\n"
-            "Urgent? Call 6123-4567"
-        )
-        send_telegram_message(chat_id, help_msg)
+        send_telegram_message(chat_id, render_message('help'))
         return
 
     # Handle /register command
     if text.strip().lower() == '/register':
-        register_msg = (
-            "✅ *Registration Complete*\n\n"
-            f"Your chat_id is: `{chat_id}`\n\n"
-            "Share this ID with the dispatcher if needed."
-        )
-        send_telegram_message(chat_id, register_msg)
+        send_telegram_message(chat_id, render_message('register', chat_id=chat_id))
+        return
+
+    # Handle /sla command (dispatcher only)
+    if text.strip().lower().startswith('/sla'):
+        if str(user_id) != DISPATCH_TELEGRAM_USER_ID:
+            send_telegram_message(chat_id, render_message('dispatcher_only'))
+            return
+        parts = text.split()
+        days = SLA_DEFAULT_DAYS
+        dimension = 'zone'
+        for part in parts[1:]:
+            if part.isdigit():
+                days = int(part)
+            elif part.lower() in ('zone', 'category', 'team'):
+                dimension = part.lower()
+        send_telegram_message(chat_id, build_sla_message(days, dimension))
+        return
+
+    # Handle /autoplan command (dispatcher only)
+    if text.strip().lower().startswith('/autoplan'):
+        if str(user_id) != DISPATCH_TELEGRAM_USER_ID:
+            send_telegram_message(chat_id, render_message('dispatcher_only'))
+            return
+        parts = text.split()
+        dry_run = 'dry' in [p.lower() for p in parts[1:]]
+        dates = [p for p in parts[1:] if p.lower() != 'dry']
+        try:
+            plan_date = date.fromisoformat(dates[0]).isoformat() if dates else local_today().isoformat()
+        except ValueError:
+            send_telegram_message(chat_id, render_message('autoplan_usage'))
+            return
+        try:
+            plan = auto_plan_day(plan_date, dry_run=dry_run)
+            send_telegram_message(chat_id, build_plan_message(plan_date, plan, dry_run))
+        except Exception as exc:
+            log(f'Error auto-planning {plan_date}: {exc}')
+            send_telegram_message(chat_id, render_message('autoplan_failed', error=exc))
+        return
+
+    # Handle /profile command (dispatcher only, requires PROFILE_ENABLED)
+    if text.strip().lower().startswith('/profile'):
+        if str(user_id) != DISPATCH_TELEGRAM_USER_ID:
+            send_telegram_message(chat_id, render_message('dispatcher_only'))
+            return
+        if not PROFILE_ENABLED:
+            send_telegram_message(chat_id, render_message('profile_disabled'))
+            return
+        parts = text.split()
+        seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else PROFILE_SIGNAL_SECONDS
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+        if start_profile(seconds, chat_id):
+            send_telegram_message(chat_id, render_message('profile_started', seconds=seconds, hz=int(PROFILE_HZ)))
+        else:
+            send_telegram_message(chat_id, render_message('profile_busy'))
+        return
+
+    # Handle /health command (dispatcher only)
+    if text.strip().lower() == '/health':
+        if str(user_id) != DISPATCH_TELEGRAM_USER_ID:
+            send_telegram_message(chat_id, render_message('dispatcher_only'))
+            return
+        send_telegram_message(chat_id, build_health_message())
+        return
+
+    # Handle /feeds command (dispatcher only)
+    if text.strip().lower() == '/feeds':
+        if str(user_id) != DISPATCH_TELEGRAM_USER_ID:
+            send_telegram_message(chat_id, render_message('dispatcher_only'))
+            return
+        send_telegram_message(chat_id, build_feeds_message())
         return
 
     # Handle /status command
     if text.strip().lower().startswith('/status'):
         parts = text.split()
         if len(parts) < 2:
-            send_telegram_message(chat_id, '⚠️ Usage: `/status <complaint_id>`')
+            send_telegram_message(chat_id, render_message('status_usage'))
         else:
             status_msg = check_complaint_status(parts[1], str(user_id) if user_id else None)
             send_telegram_message(chat_id, status_msg)
@@ -1209,181 +2517,502 @@ def handle_update(update: dict) -> None:
             complaints_msg = get_user_complaints(str(user_id))
             send_telegram_message(chat_id, complaints_msg)
         else:
-            send_telegram_message(chat_id, '❌ Unable to identify user.')
+            send_telegram_message(chat_id, render_message('unknown_user'))
         return
 
     # Handle /evidence command
     if text.strip().lower().startswith('/evidence'):
         parts = text.split()
         if len(parts) < 2:
-            send_telegram_message(chat_id, '⚠️ Usage: `/evidence <task_id_prefix>`\n\nEnter at least the first 8 characters of the task ID.')
+            send_telegram_message(chat_id, render_message('evidence_usage'))
             return
 
         prefix = parts[1].strip()
         if len(prefix) < 8:
-            send_telegram_message(chat_id, '⚠️ Please provide at least 8 characters of the task ID.')
+            send_telegram_message(chat_id, render_message('evidence_prefix_short'))
             return
 
         task = lookup_task_by_prefix(prefix)
         if task is None:
-            send_telegram_message(chat_id, f"❌ No scheduled task found matching `{prefix}`.\n\nYou can use a task ID or run sheet ID prefix.")
+            send_telegram_message(chat_id, render_message('task_not_found', prefix=prefix))
             return
 
         task_id = task.get('id', '')
         task_type = task.get('task_type', 'task')
 
-        cluster_info = {}
-        cluster_id = task.get('cluster_id')
-        if cluster_id:
-            try:
-                clusters = _fetch_json(
-                    f"{SUPABASE_URL}/rest/v1/clusters?"
-                    f"id=eq.{cluster_id}&select=id,description,location_label,category"
-                )
-                if isinstance(clusters, list) and clusters:
-                    cluster_info = clusters[0]
-            except Exception:
-                pass
+        cluster_info = task.get('cluster') or {}
 
         desc = cluster_info.get('description') or cluster_info.get('location_label') or 'N/A'
         category = cluster_info.get('category') or 'issue'
 
-        evidence_sessions[user_id] = {
+        # Expires well after the timeout so the worker is still told the session ran out.
+        sessions.put('evidence', user_id, {
             'state': 'waiting_before_photo',
             'task_id': task_id,
-            'task_info': task,
-            'cluster_info': cluster_info,
-            'before_photo_bytes': None,
-            'before_filename': '',
-            'started_at': time.time(),
-        }
+            'task_type': task_type,
+            'desc': cluster_info.get('description'),
+            'started_at': int(time.time()),
+        }, EVIDENCE_SESSION_SECONDS * 2)
 
         send_telegram_message(
             chat_id,
-            f"📋 *Evidence submission started*\n\n"
-            f"Task: `{task_id[:8]}`\n"
-            f"Type: {task_type}\n"
-            f"Issue: {category} — {desc}\n\n"
-            "📸 Please send the *BEFORE* photo now.\n"
-            "Type /cancel to abort.",
+            render_message('evidence_started', task_ref=task_id[:8], task_type=task_type, category=category, desc=desc),
         )
         return
 
     # Handle /cancel command
     if text.strip().lower() == '/cancel':
         cancelled = False
-        if user_id and user_id in evidence_sessions:
-            del evidence_sessions[user_id]
+        if user_id and sessions.pop('evidence', user_id) is not None:
             cancelled = True
-        if user_id and user_id in complaint_active:
-            complaint_active.discard(user_id)
-            history_by_user.pop(chat_id, None)
+        if user_id and sessions.get('complaint', user_id) is not None:
+            end_complaint(user_id, chat_id)
             cancelled = True
         if cancelled:
-            send_telegram_message(chat_id, '🚫 Cancelled.')
+            send_telegram_message(chat_id, render_message('cancelled'))
         else:
-            send_telegram_message(chat_id, 'No active session to cancel.')
+            send_telegram_message(chat_id, render_message('nothing_to_cancel'))
         return
 
     # If user is in evidence session but sends text, remind them to send a photo
-    if user_id and user_id in evidence_sessions:
-        session = evidence_sessions[user_id]
-        if time.time() - session.get('started_at', 0) > 600:
-            del evidence_sessions[user_id]
-            send_telegram_message(chat_id, '⏰ Evidence session timed out. Use `/evidence <task_id>` to start again.')
+    session = sessions.get('evidence', user_id) if user_id else None
+    if session:
+        if time.time() - session.get('started_at', 0) > EVIDENCE_SESSION_SECONDS:
+            sessions.pop('evidence', user_id)
+            send_telegram_message(chat_id, render_message('evidence_timeout'))
         else:
             state = session.get('state', '')
             if state == 'waiting_before_photo':
-                send_telegram_message(chat_id, '📸 Please send a *BEFORE* photo, or type /cancel to abort.')
+                send_telegram_message(chat_id, render_message('send_before'))
             elif state == 'waiting_after_photo':
-                send_telegram_message(chat_id, '📸 Please send an *AFTER* photo, or type /cancel to abort.')
+                send_telegram_message(chat_id, render_message('send_after'))
         return
 
     # Handle /complaint command
     if text.strip().lower() == '/complaint':
         if user_id:
-            complaint_active.add(user_id)
-            history_by_user.pop(chat_id, None)
-        send_telegram_message(
-            chat_id,
-            "📝 *Complaint mode started*\n\n"
-            "Please describe your issue, including the location.\n"
-            "Type /cancel to abort.",
-        )
+            start_complaint(user_id, chat_id)
+        send_telegram_message(chat_id, render_message('complaint_started'))
         return
 
     # Handle complaint conversation (only if user is in complaint mode)
-    if user_id and user_id in complaint_active:
+    complaint = sessions.get('complaint', user_id) if user_id else None
+    if complaint is not None:
+        correlation_id = complaint.get('correlation_id')
+        if handle_duplicate_complaint(chat_id, user_id, username, text):
+            end_complaint(user_id, chat_id)
+            return
+
+        submitted = False
         try:
-            send_telegram_message(chat_id, '⏳ Processing...')
+            send_telegram_message(chat_id, render_message('processing'))
 
             history = build_history(chat_id, text)
-            reply = call_review_agent(history)
+            reply = call_review_agent(tag_conversation(history, correlation_id))
             store_assistant_reply(chat_id, reply)
 
-            reply_lower = reply.lower()
-            is_asking_questions = any(phrase in reply_lower for phrase in [
-                'need', 'tell me', 'where', 'when', 'what', 'how', 'please provide',
-                'can you', 'could you', 'more details', 'few more', 'i need'
-            ])
-
-            if is_asking_questions:
-                send_telegram_message(chat_id, reply)
+            if is_asking_questions(reply):
+                send_telegram_message(chat_id, render_message('agent_reply', reply=reply))
             else:
-                complaint_id = link_telegram_to_complaint(user_id, username)
-
-                response_text = f"✅ *Complaint Submitted!*\n\n{reply}\n\n"
+                submitted = True
+                complaint_id = link_telegram_to_complaint(user_id, username, correlation_id)
 
+                id_line = ''
                 if complaint_id:
-                    response_text += f"🆔 Complaint ID: `{complaint_id[:8]}`\n\n"
+                    id_line = render_message('complaint_id_line', complaint_ref=complaint_id[:8])
                     cluster_complaint(complaint_id)
 
-                response_text += "📱 /status <id>\n📋 /mycomplaints\n\nThank you! 🌟"
-
-                send_telegram_message(chat_id, response_text)
+                send_telegram_message(chat_id, render_message('complaint_submitted', reply=reply, id_line=id_line))
 
                 # End complaint mode
-                complaint_active.discard(user_id)
-                history_by_user.pop(chat_id, None)
+                end_complaint(user_id, chat_id)
 
+        except LimiterBusy as exc:
+            log(f'Agent busy, queued message from {user_id}: {exc}')
+            # The replay worker picks the conversation up from here and resumes it.
+            queue_failed_message(
+                str(user_id), str(chat_id), text, str(exc), username, end_complaint(user_id, chat_id), correlation_id,
+            )
+            send_telegram_message(chat_id, render_message('agent_busy'))
         except Exception as exc:
             log(f'Error handling message: {exc}')
-
-            queue_failed_message(str(user_id), str(chat_id), text, str(exc))
-
-            error_msg = (
-                f"⚠️ *Error*\n\n{str(exc)}\n\n"
-                "Your complaint has been queued. Urgent? Call 6123-4567."
+            if submitted:
+                # The agent has filed the complaint; replaying the conversation would file it twice.
+                log(f'Not queuing message from {user_id}: complaint {correlation_id} was already submitted')
+                end_complaint(user_id, chat_id)
+                return
+
+            queue_failed_message(
+                str(user_id), str(chat_id), text, str(exc), username, sessions.get('history', chat_id), correlation_id,
             )
-            send_telegram_message(chat_id, error_msg)
+
+            send_telegram_message(chat_id, render_message('complaint_error', error=exc))
         return
 
     # Unrecognized text — show available commands
-    send_telegram_message(
-        chat_id,
-        "I didn't understand that. Use one of these commands:\n\n"
-        "📝 /complaint - Submit a complaint\n"
-        "🔍 /status <ID> - Check complaint status\n"
-        "📋 /mycomplaints - View your complaints\n"
-        "📸 /evidence <task\\_id> - Upload evidence\n"
-        "❓ /help - Show all commands",
+    send_telegram_message(chat_id, render_message('unknown_command'))
+
+
+def poll_dispatch_feed() -> List[float]:
+    handled = poll_dispatch_notifications()
+    dispatch_digest.flush()
+    return handled
+
+
+# Feeds that send notifications or write shared aggregates run on the leader only.
+LEADER_FEEDS = {'dispatch', 'evidence', 'resolution', 'rollups', 'digest'}
+
+
+def feed_state() -> dict:
+    """Watermarks and recently notified ids, saved in the leader lease."""
+    return {
+        'watermarks': {
+            'dispatch': last_dispatch_check,
+            'evidence': last_evidence_check,
+            'resolution': last_resolution_check,
+            'rollups': last_rollup_check,
+        },
+        'recent': {feed: list(ids) for feed, ids in recent_sent.items()},
+    }
+
+
+def restore_feed_state(state: dict) -> None:
+    global last_dispatch_check, last_evidence_check, last_resolution_check, last_rollup_check
+    marks = state.get('watermarks') or {}
+    last_dispatch_check = max(last_dispatch_check, int(marks.get('dispatch') or 0))
+    last_evidence_check = max(last_evidence_check, int(marks.get('evidence') or 0))
+    last_resolution_check = max(last_resolution_check, int(marks.get('resolution') or 0))
+    last_rollup_check = max(last_rollup_check, int(marks.get('rollups') or 0))
+    sent_sets = {'dispatch': sent_dispatch_ids, 'evidence': sent_evidence_ids, 'resolution': sent_resolution_ids}
+    for feed, ids in (state.get('recent') or {}).items():
+        if feed in sent_sets:
+            for key in ids:
+                mark_sent(feed, sent_sets[feed], key)
+    log(f'Replica {REPLICA_ID} is now the notification leader')
+    if change_feed:
+        # Changes pushed while this replica was standby were ignored.
+        change_feed.invalidate()
+
+
+def on_demoted() -> None:
+    log(f'Replica {REPLICA_ID} lost the notification lease; feeds paused')
+    # These were already counted as handled in the saved watermarks, so send them rather than drop them.
+    dispatch_digest.flush(force=True)
+
+
+def build_leader() -> Optional[LeaderElector]:
+    if LEADER_ELECTION in ('', 'off'):
+        return None
+    if LEADER_ELECTION == 'lease':
+        lease = PostgrestLease(LEADER_LEASE_NAME, SUPABASE_URL, SUPABASE_API_KEY, http_request)
+    elif LEADER_ELECTION == 'advisory':
+        if not LEADER_DSN:
+            raise RuntimeError('LEADER_ELECTION=advisory needs LEADER_DSN.')
+        lease = AdvisoryLease(LEADER_LEASE_NAME, LEADER_DSN)
+    else:
+        raise RuntimeError(f'Unknown LEADER_ELECTION mode: {LEADER_ELECTION}')
+    return LeaderElector(
+        lease,
+        REPLICA_ID,
+        LEADER_LEASE_SECONDS,
+        feed_state,
+        on_elected=restore_feed_state,
+        on_demoted=on_demoted,
+        on_error=lambda exc: log(f'Leader election error: {exc}'),
     )
 
 
-def main() -> None:
-    global last_dispatch_poll
+leader = build_leader()
+
+
+def is_leader() -> bool:
+    """Without leader election every replica is its own leader."""
+    return leader is None or leader.is_leader
+
+
+def record_feed_events(name: str, timestamps: List[float]) -> None:
+    feed_events_total.inc(len(timestamps), feed=name)
+    now = time.time()
+    for ts in timestamps:
+        feed_lag_seconds.observe(max(0.0, now - ts), feed=name)
+    if leader and name in LEADER_FEEDS:
+        # Persist the new watermarks and sent ids now rather than at the next renewal.
+        leader.save()
+
+
+def record_feed_poll(name: str, seconds: float, timestamps: Optional[List[float]], failed: bool) -> None:
+    feed_polls_total.inc(feed=name, outcome='error' if failed else 'ok')
+    feed_poll_seconds.observe(seconds, feed=name)
+    if timestamps:
+        record_feed_events(name, timestamps)
+
+
+# Table -> (feed, query for the pushed ids, handler). The filters repeat the polls', so a
+# row that changed again before it was fetched is only handled if it still qualifies.
+CHANGE_HANDLERS = {
+    'run_sheets': (
+        'dispatch',
+        lambda ids: Query('run_sheets', 'run_sheet.dispatch').in_('id', ids).eq('status', 'dispatched'),
+        notify_dispatch,
+    ),
+    'evidence': ('evidence', lambda ids: Query('evidence', 'evidence.notification').in_('id', ids), notify_evidence),
+    'complaints': (
+        'resolution',
+        lambda ids: Query('complaints', 'complaint.resolution').in_('id', ids).in_('status', ['VERIFIED', 'CLOSED']),
+        notify_resolutions,
+    ),
+}
+
+
+def apply_changes(changes: Dict[str, List[str]]) -> None:
+    """Handle rows pushed by the change feed with the polls' code. They are marked sent,
+    so the polls skip them, but the watermarks are left to the polls: a reconcile still
+    finds rows older than the pushed ones that the feed missed."""
+    if not is_leader():
+        return
+    for table, ids in changes.items():
+        if table not in CHANGE_HANDLERS:
+            continue
+        feed, query, notify = CHANGE_HANDLERS[table]
+        change_events_total.inc(len(ids), table=table)
+        rows = _query(query(ids))
+        with feed_locks[feed]:
+            handled = notify(rows)
+        if feed == 'dispatch':
+            dispatch_digest.flush()
+        if handled:
+            record_feed_events(feed, handled)
+
+
+def build_change_feed() -> Optional[ChangeFeed]:
+    if not CHANGE_FEED_DSN:
+        return None
+    return ChangeFeed(
+        CHANGE_FEED_DSN,
+        apply_changes,
+        reconcile_interval=CHANGE_FEED_RECONCILE_SECONDS,
+        on_gap=lambda: feed_scheduler.wake('dispatch', 'evidence', 'resolution'),
+        on_error=lambda exc: log(f'Change feed error: {exc}'),
+    )
+
+
+change_feed = build_change_feed()
+
+
+def add_notification_feed(name: str, poll: Callable[[], List[float]], position: Callable[[], int]) -> None:
+    """Schedule a leader-only notification poll. With a change feed it only reconciles:
+    it runs after each (re)connect until caught up, then every CHANGE_FEED_RECONCILE_SECONDS."""
+    if change_feed is None:
+        feed_scheduler.add(name, poll, FEED_MIN_INTERVAL, FEED_MAX_INTERVAL, DISPATCH_POLL_INTERVAL, when=is_leader)
+        return
+
+    def when() -> bool:
+        return is_leader() and change_feed.reconcile_due(name)
+
+    poll = change_feed.reconciler(name, poll, position)
+    feed_scheduler.add(name, poll, FEED_MIN_INTERVAL, FEED_MAX_INTERVAL, DISPATCH_POLL_INTERVAL, when=when)
+
+
+# Notification feeds run on their own thread, independent of getUpdates.
+feed_scheduler = FeedScheduler(
+    jitter=FEED_JITTER,
+    on_error=lambda name, exc: log(f'Error polling {name} feed: {exc}'),
+    on_run=record_feed_poll,
+)
+add_notification_feed('dispatch', poll_dispatch_feed, lambda: last_dispatch_check)
+add_notification_feed('evidence', poll_evidence_notifications, lambda: last_evidence_check)
+add_notification_feed('resolution', poll_resolution_notifications, lambda: last_resolution_check)
+feed_scheduler.add('rollups', poll_rollup_updates, DISPATCH_POLL_INTERVAL, FEED_MAX_INTERVAL, when=is_leader)
+feed_scheduler.add('dedupe', poll_complaint_index, FEED_MIN_INTERVAL, FEED_MAX_INTERVAL, DISPATCH_POLL_INTERVAL)
+# Replays call the agent and may take a while, so they get their own thread.
+replay_scheduler = FeedScheduler(
+    jitter=FEED_JITTER,
+    on_error=lambda name, exc: log(f'Error polling {name} feed: {exc}'),
+    on_run=record_feed_poll,
+)
+replay_scheduler.add('replay', poll_failed_messages, FEED_MIN_INTERVAL, FEED_MAX_INTERVAL, DISPATCH_POLL_INTERVAL)
+if DIGEST_MAX_HOLD_SECONDS > 0:
+    # Release held digests on time even while the dispatch feed is backed off.
+    feed_scheduler.add(
+        'digest', lambda: dispatch_digest.flush() and None, DIGEST_MAX_HOLD_SECONDS, DIGEST_MAX_HOLD_SECONDS, when=is_leader,
+    )
+
+
+CIRCUIT_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+metrics.gauge('bot_sessions', 'Unexpired conversation state in the session store by kind.', lambda: [
+    ({'kind': kind}, sessions.count(kind)) for kind in ('evidence', 'complaint', 'history')
+])
+metrics.gauge('bot_write_batcher', 'Row writes queued, accepted and the requests that carried them.', lambda: [
+    ({'kind': 'queued'}, writes.queued()),
+    ({'kind': 'writes'}, writes.writes),
+    ({'kind': 'requests'}, writes.requests),
+])
+metrics.gauge('bot_dedupe_entries', 'Entries in the notification dedupe sets and near-duplicate index.', lambda: [
+    ({'set': 'dispatch'}, len(sent_dispatch_ids)),
+    ({'set': 'evidence'}, len(sent_evidence_ids)),
+    ({'set': 'resolution'}, len(sent_resolution_ids)),
+    ({'set': 'complaint_index'}, len(complaint_index)),
+])
+metrics.gauge('bot_telegram_file_ids', 'Cached Telegram file_ids for storage photos.', lambda: [({}, len(telegram_file_ids))])
+metrics.gauge('bot_digest_pending', 'Dispatch notifications waiting in the digest.', lambda: [({}, dispatch_digest.pending_count())])
+metrics.gauge('bot_circuit_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open).', lambda: [
+    ({'upstream': status['name']}, CIRCUIT_STATE_VALUES.get(status['state'], 0)) for status in upstreams.status()
+])
+metrics.gauge('bot_circuit_opened', 'Times each circuit breaker has opened.', lambda: [
+    ({'upstream': status['name']}, status['opened']) for status in upstreams.status()
+])
+metrics.gauge('bot_feed_interval_seconds', 'Current polling interval of each feed.', lambda: [
+    ({'feed': status['name']}, status['interval']) for status in feed_scheduler.status() + replay_scheduler.status()
+])
+metrics.gauge('bot_change_feed_connected', 'Whether the change feed is listening (absent without CHANGE_FEED_DSN).', lambda: [
+    ({}, 1 if change_feed.status()['connected'] else 0),
+] if change_feed else [])
+metrics.gauge('bot_leader', 'Whether this replica runs the notification feeds.', lambda: [
+    ({'replica': REPLICA_ID}, 1 if is_leader() else 0),
+])
+metrics.gauge('bot_agent_in_flight', 'Review agent calls currently running.', lambda: [({}, agent_limiter.in_flight)])
+metrics.gauge('bot_agent_queued', 'Review agent calls waiting for a slot.', lambda: [
+    ({'priority': status['priority']}, status['queued']) for status in agent_limiter.status()
+])
+metrics.gauge('bot_agent_shed', 'Review agent calls shed by priority and reason.', lambda: [
+    ({'priority': status['priority'], 'reason': reason}, count)
+    for status in agent_limiter.status() for reason, count in status['shed_by_reason'].items()
+])
+metrics.collected_histogram('bot_agent_queue_wait_seconds', 'Time review agent calls waited for a slot.', lambda: [
+    ({'priority': cls.name}, cls.waits) for cls in agent_limiter.classes.values()
+])
+
+
+profiler = SamplingProfiler(PROFILE_DIR, PROFILE_HZ)
+
+
+def start_profile(seconds: int, chat_id: Optional[int] = None) -> bool:
+    """Sample all thread stacks for ``seconds``; the requesting chat (if any) gets the summary."""
+    def done(path: str, samples: int, hottest: List[tuple]) -> None:
+        log(f'Profile written to {path} ({samples} samples)')
+        if not chat_id:
+            return
+        rows = '\n'.join(render_message('profile_frame', frame=frame, count=count) for frame, count in hottest)
+        try:
+            send_telegram_message(chat_id, render_message('profile_done', path=path, samples=samples, frames=rows))
+        except Exception as exc:
+            log(f'Failed to send profile summary: {exc}')
+
+    started = profiler.start(seconds, done)
+    if started:
+        log(f'Profiling for {seconds}s at {PROFILE_HZ:g} Hz')
+    return started
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return '-' if value is None else f'{value:.1f}s'
+
+
+def build_health_message() -> str:
+    lines = [render_message('health_header')]
+    for status in upstreams.status():
+        lines.append(render_message(
+            'health_row',
+            upstream=status['name'],
+            state=status['state'].replace('_', '-'),
+            retry_in=_format_seconds(status['retry_in']) if status['state'] == 'open' else '-',
+            success=status['success'],
+            failure=status['failure'],
+            rejected=status['rejected'],
+            opened=status['opened'],
+        ))
+    lines.append(render_message('agent_queue_header'))
+    for status in agent_limiter.status():
+        lines.append(render_message(
+            'agent_queue_row',
+            priority=status['priority'],
+            queued=status['queued'],
+            admitted=status['admitted'],
+            shed=status['shed'],
+            p50=_format_seconds(status['wait_p50']),
+            p99=_format_seconds(status['wait_p99']),
+        ))
+    return '\n'.join(lines)
+
+
+def build_feeds_message() -> str:
+    lines = [render_message('feeds_header')]
+    for status in feed_scheduler.status() + replay_scheduler.status():
+        lines.append(render_message(
+            'feeds_row',
+            feed=status['name'],
+            interval=_format_seconds(status['interval']),
+            events=status['events'],
+            lag=_format_seconds(status['last_lag']),
+            avg_lag=_format_seconds(status['avg_lag']),
+            errors=status['errors'],
+        ))
+    if leader is None:
+        role = 'single replica'
+    else:
+        role = 'leader' if leader.is_leader else 'standby'
+    lines.append(render_message('feeds_role', role=role, replica=REPLICA_ID))
+    if change_feed:
+        status = change_feed.status()
+        lines.append(render_message(
+            'feeds_change_feed',
+            state='connected' if status['connected'] else 'reconnecting',
+            events=status['events'],
+            reconnects=status['reconnects'],
+        ))
+    return '\n'.join(lines)
+
+
+def check_config() -> None:
     if not TELEGRAM_BOT_TOKEN:
         raise RuntimeError('Missing TELEGRAM_BOT_TOKEN in .env.local or environment.')
 
     if not SUPABASE_URL or not SUPABASE_API_KEY:
         raise RuntimeError('Missing SUPABASE_URL or SUPABASE_API_KEY in environment.')
 
+
+def start_services() -> None:
+    """Background work that runs once per bot: leader election, feeds, replay, profiler and metrics."""
+    log(f'JSON codec: {codec.JSON_BACKEND}; accepting {codec.ACCEPT_ENCODING} responses')
+    if leader:
+        leader.start()
+        # Hand the lease over at once on shutdown instead of letting it lapse.
+        atexit.register(leader.stop)
+    feed_scheduler.start()
+    replay_scheduler.start()
+    if change_feed:
+        change_feed.start()
+        log(f'Change feed: listening for row changes, reconciling every {CHANGE_FEED_RECONCILE_SECONDS:.0f}s')
+    if PROFILE_ENABLED and hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, lambda signum, frame: start_profile(PROFILE_SIGNAL_SECONDS))
+        log(f'Profiler armed: kill -USR2 {os.getpid()} samples for {PROFILE_SIGNAL_SECONDS}s')
+    if METRICS_PORT:
+        serve_metrics(metrics, METRICS_PORT, METRICS_HOST)
+        log(f'Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics')
+
+
+def start_worker_services() -> None:
+    """Background work a runner worker needs to handle updates: keeping its own near-duplicate
+    index fresh. The first poll runs before returning, so the first update already sees it."""
+    worker_feeds = FeedScheduler(
+        jitter=FEED_JITTER,
+        on_error=lambda name, exc: log(f'Error polling {name} feed: {exc}'),
+        on_run=record_feed_poll,
+    )
+    worker_feeds.add('dedupe', poll_complaint_index, FEED_MIN_INTERVAL, FEED_MAX_INTERVAL, DISPATCH_POLL_INTERVAL)
+    worker_feeds.run_due()
+    worker_feeds.start()
+
+
+def poll_updates(on_update: Callable[[dict], None], running: Callable[[], bool] = lambda: True) -> None:
+    """Long-poll Telegram and pass each update to ``on_update`` until ``running()`` is false."""
     log('Starting Telegram bot long-polling...')
     offset = 0
-    while True:
+    while running():
         try:
             updates_url = (
-                f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
+                f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
                 f"?timeout={POLL_TIMEOUT}&offset={offset}"
             )
             data = http_request(updates_url, method='GET')
@@ -1391,21 +3020,38 @@ def main() -> None:
             for update in results:
                 update_id = update.get('update_id', 0)
                 offset = max(offset, update_id + 1)
-                handle_update(update)
-            now = time.time()
-            if now - last_dispatch_poll > DISPATCH_POLL_INTERVAL:
-                poll_dispatch_notifications()
-                poll_evidence_notifications()
-                poll_resolution_notifications()
-                last_dispatch_poll = now
-                # Clean up stale evidence sessions (older than 10 minutes)
-                stale = [uid for uid, s in evidence_sessions.items() if now - s.get('started_at', 0) > 600]
-                for uid in stale:
-                    del evidence_sessions[uid]
+                on_update(update)
+        except CircuitOpenError as exc:
+            log(f'Polling paused: {exc}')
+            time.sleep(min(max(exc.retry_in, 1.0), 10.0))
         except Exception as exc:
             log(f'Polling error: {exc}')
             time.sleep(2)
+    if offset:
+        # Confirm the handled updates so a restart does not receive them again.
+        try:
+            http_request(f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getUpdates?timeout=0&limit=1&offset={offset}", method='GET')
+        except Exception as exc:
+            log(f'Error confirming updates: {exc}')
+
+
+def main() -> None:
+    check_config()
+    if leader:
+        # Run atexit handlers (the lease handover) on SIGTERM too.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    start_services()
+    poll_updates(handle_update)
 
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill-rollups':
+        if len(sys.argv) < 3:
+            raise SystemExit('Usage: python app.py backfill-rollups <start YYYY-MM-DD> [end YYYY-MM-DD]')
+        backfill_rollups(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else sys.argv[2])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'plan-day':
+        args = [arg for arg in sys.argv[2:] if arg != '--dry-run']
+        target_date = args[0] if args else local_today().isoformat()
+        print(json.dumps(auto_plan_day(target_date, dry_run='--dry-run' in sys.argv), indent=2))
+    else:
+        main()
@@ -0,0 +1,228 @@
+"""Runs the bot as a subprocess against the stand-in upstreams.
+
+The bot is started unmodified (``python app.py``) with its upstream URLs
+pointed at the stubs, so benchmarks exercise the same code paths, HTTP stack,
+retries and feed scheduler as production. Peak RSS is read from
+``/proc/<pid>/status`` (VmHWM) while the bot runs, falling back to
+``getrusage(RUSAGE_CHILDREN)`` after it exits on platforms without procfs.
+"""
+
+import argparse
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from stubs import FakePostgrest, FakeTelegram, FakeWatson, Faults
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = '123456:bench'
+DISPATCHER_ID = 900000001
+MEDIA_ID = 900000002
+
+if BOT_DIR not in sys.path:
+    sys.path.insert(0, BOT_DIR)
+from messages import render_message  # noqa: E402
+
+# Progress notices the bot sends before the real answer to a step.
+INTERIM_REPLIES = {render_message(name) for name in ('processing', 'photo_downloading', 'evidence_uploading')}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile; None for an empty sample."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def latency_summary(values: List[float]) -> dict:
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        'count': len(values),
+        'p50_ms': ms(percentile(values, 0.50)),
+        'p90_ms': ms(percentile(values, 0.90)),
+        'p99_ms': ms(percentile(values, 0.99)),
+        'max_ms': ms(max(values) if values else None),
+        'mean_ms': ms(sum(values) / len(values) if values else None),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BOT_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def environment() -> dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'git_revision': git_revision(),
+    }
+
+
+class Harness:
+    """Stubs plus one bot process. Use as a context manager."""
+
+    def __init__(
+        self,
+        telegram_faults: Optional[Faults] = None,
+        supabase_faults: Optional[Faults] = None,
+        wxo_faults: Optional[Faults] = None,
+        agent_turns: int = 2,
+        file_size: int = 64 * 1024,
+        env: Optional[Dict[str, str]] = None,
+        log_path: Optional[str] = None,
+        entry: str = 'app.py',
+    ) -> None:
+        """``entry`` is the script started in the bot directory, so other execution
+        modes of the bot can be benchmarked against the same stubs."""
+        self.telegram = FakeTelegram(telegram_faults, file_size=file_size)
+        self.postgrest = FakePostgrest(supabase_faults)
+        self.watson = FakeWatson(self.postgrest, wxo_faults, turns=agent_turns)
+        self.env = env or {}
+        self.log_path = log_path
+        self.entry = entry
+        self.process: Optional[subprocess.Popen] = None
+        self.peak_rss_kb = 0
+        self.started_at = 0.0
+
+    def bot_env(self) -> Dict[str, str]:
+        env = {
+            key: value for key, value in os.environ.items()
+            if not key.startswith(('TELEGRAM_', 'SUPABASE_', 'WXO_'))
+        }
+        env.update({
+            'PYTHONUNBUFFERED': '1',
+            'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+            'TELEGRAM_API_URL': self.telegram.url,
+            'TELEGRAM_POLL_TIMEOUT': '1',
+            'SUPABASE_URL': self.postgrest.url,
+            'SUPABASE_SERVICE_ROLE_KEY': 'bench-service-role',
+            'WXO_HOST_URL': self.watson.url,
+            'DISPATCH_TELEGRAM_USER_ID': str(DISPATCHER_ID),
+            'DISPATCH_MEDIA_TELEGRAM_USER_ID': str(MEDIA_ID),
+            'DISPATCH_POLL_INTERVAL': '1',
+            'FEED_MIN_INTERVAL': '0.2',
+            'FEED_MAX_INTERVAL': '1',
+            'METRICS_PORT': '0',
+            'GOOGLE_MAPS_API_KEY': '',
+        })
+        env.update(self.env)
+        return env
+
+    def __enter__(self) -> 'Harness':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self, ready_timeout: float = 20.0) -> None:
+        for stub in (self.telegram, self.postgrest, self.watson):
+            stub.start()
+        output = open(self.log_path, 'w', encoding='utf-8') if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(BOT_DIR, self.entry)],
+            cwd=BOT_DIR,
+            env=self.bot_env(),
+            stdout=output,
+            stderr=subprocess.STDOUT,
+        )
+        deadline = time.time() + ready_timeout
+        # The bot is ready once its first long poll arrives.
+        while not self.telegram.stats()['requests'].get('getUpdates'):
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Bot exited during startup with code {self.process.returncode}')
+            if time.time() > deadline:
+                raise RuntimeError('Bot did not start polling in time')
+            time.sleep(0.05)
+        self.started_at = time.time()
+
+    def sample_rss(self) -> int:
+        """Current peak RSS of the bot in KiB (0 when unknown)."""
+        if not self.process:
+            return self.peak_rss_kb
+        try:
+            with open(f'/proc/{self.process.pid}/status', encoding='ascii') as handle:
+                for line in handle:
+                    if line.startswith('VmHWM:'):
+                        self.peak_rss_kb = max(self.peak_rss_kb, int(line.split()[1]))
+                        break
+        except OSError:
+            pass
+        return self.peak_rss_kb
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.sample_rss()
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if not self.peak_rss_kb:
+            # ru_maxrss is KiB on Linux and bytes on macOS.
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            self.peak_rss_kb = usage // 1024 if sys.platform == 'darwin' else usage
+        for stub in (self.telegram, self.postgrest, self.watson):
+            stub.stop()
+
+    def upstream_stats(self) -> dict:
+        return {stub.name: stub.stats() for stub in (self.telegram, self.postgrest, self.watson)}
+
+    def await_answer(self, user_id: int, since: float, timeout: float) -> Optional[float]:
+        """Seconds from ``since`` to the first reply to ``user_id`` that is not a
+        progress notice, or None if none arrived within ``timeout``."""
+        deadline = since + timeout
+        count = 1
+        while time.time() < deadline:
+            replies = self.telegram.wait_replies(user_id, count, since, max(0.0, deadline - time.time()))
+            answers = [reply for reply in replies if reply['text'] not in INTERIM_REPLIES]
+            if answers:
+                return answers[0]['at'] - since
+            count = len(replies) + 1
+        return None
+
+
+def add_upstream_arguments(parser: argparse.ArgumentParser) -> None:
+    """Fault injection and bot process options shared by the bench tools."""
+    for prefix, latency in (('telegram', 0.02), ('supabase', 0.01), ('wxo', 0.3)):
+        parser.add_argument(f'--{prefix}-latency', type=float, default=latency, help='seconds added per request')
+        parser.add_argument(f'--{prefix}-jitter', type=float, default=0.0)
+        parser.add_argument(f'--{prefix}-error-rate', type=float, default=0.0, help='fraction of requests failed with 503')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='bytes per downloaded Telegram photo')
+    parser.add_argument('--entry', default='app.py', help='bot script to run (execution mode)')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra bot environment')
+    parser.add_argument('--bot-log', default=None, help='write the bot output here')
+
+
+def harness_from_args(args: argparse.Namespace) -> Harness:
+    def faults(prefix: str) -> Faults:
+        return Faults(
+            latency=getattr(args, f'{prefix}_latency'),
+            jitter=getattr(args, f'{prefix}_jitter'),
+            error_rate=getattr(args, f'{prefix}_error_rate'),
+        )
+
+    return Harness(
+        telegram_faults=faults('telegram'),
+        supabase_faults=faults('supabase'),
+        wxo_faults=faults('wxo'),
+        file_size=args.file_size,
+        env=dict(item.split('=', 1) for item in args.env),
+        log_path=args.bot_log,
+        entry=args.entry,
+    )
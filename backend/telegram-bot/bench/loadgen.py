@@ -0,0 +1,489 @@
+"""Synthetic traffic and getUpdates replay against the stand-in upstreams.
+
+``load`` starts user sessions at a target rate with a chosen arrival process
+and runs each session's script against the bot, one step at a time, waiting
+for the answer and a think time between steps:
+
+- ``resident``: /complaint, a description, then a location (agent turns).
+- ``worker``: /evidence for a seeded SCHEDULED task, then before and after
+  photos; photo updates carry fake file_ids that the Telegram stub serves.
+- ``checker``: a short burst of /status and /mycomplaints.
+
+``sweep`` repeats ``load`` at increasing rates, each against a fresh bot, and
+reports the highest rate that still met the latency SLO without falling
+behind. ``replay`` pushes a recorded update log with its original spacing
+(scaled by ``--speed``); ``anonymise`` turns a raw log into one safe to share.
+
+    python bench/loadgen.py load --rate 2 --duration 60 --mix resident=5,worker=2,checker=3
+    python bench/loadgen.py sweep --rates 1,2,4,8 --slo-ms 5000 --entry app.py
+    python bench/loadgen.py anonymise raw-updates.jsonl anon-updates.jsonl
+    python bench/loadgen.py replay anon-updates.jsonl --speed 10
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (  # noqa: E402
+    Harness, add_upstream_arguments, environment, harness_from_args, latency_summary,
+)
+from stubs import utc_now_iso  # noqa: E402
+
+# (kind, payload, label): kind is 'text' or 'photo' (payload is then a file_id).
+Step = Tuple[str, str, str]
+
+SESSION_BASE = 600000000
+ISSUES = (
+    'Overflowing rubbish bin near the lift lobby',
+    'Dead rat at the void deck',
+    'Pigeon droppings all over the corridor',
+    'Broken glass bottles at the playground',
+    'Stagnant water in the drain by the carpark',
+    'Cigarette butts littered along the staircase',
+    'Bulky furniture dumped beside the bin centre',
+    'Cockroaches coming out of the chute',
+)
+STREETS = ('Ang Mo Kio Avenue', 'Bishan Street', 'Toa Payoh Lorong', 'Yishun Ring Road', 'Bedok North Street')
+# Phone numbers, NRIC-like ids and unit numbers are scrubbed from replayed text.
+SENSITIVE = re.compile(r'\b[STFGM]\d{7}[A-Z]\b|\+?\d[\d -]{6,}\d|#\d{1,3}-\d{1,5}', re.IGNORECASE)
+
+
+def arrival_offsets(distribution: str, rate: float, duration: float, rng: random.Random, burst_size: int = 10) -> List[float]:
+    """Session start times (seconds from now) for ``rate`` sessions/sec over ``duration``."""
+    offsets: List[float] = []
+    if rate <= 0:
+        return offsets
+    if distribution == 'poisson':
+        at = rng.expovariate(rate)
+        while at < duration:
+            offsets.append(at)
+            at += rng.expovariate(rate)
+    elif distribution == 'uniform':
+        offsets = [index / rate for index in range(int(duration * rate))]
+    elif distribution == 'burst':
+        # Same mean rate, delivered as bursts of ``burst_size`` simultaneous sessions.
+        gap = burst_size / rate
+        at = 0.0
+        while at < duration:
+            offsets.extend([at] * burst_size)
+            at += gap
+    else:
+        raise ValueError(f'Unknown arrival distribution: {distribution}')
+    return offsets
+
+
+def think_time(distribution: str, mean: float, rng: random.Random) -> float:
+    if mean <= 0:
+        return 0.0
+    if distribution == 'fixed':
+        return mean
+    if distribution == 'exponential':
+        return rng.expovariate(1.0 / mean)
+    if distribution == 'uniform':
+        return rng.uniform(0.0, 2 * mean)
+    raise ValueError(f'Unknown think time distribution: {distribution}')
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip():
+            mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(SCRIPTS)
+    if unknown:
+        raise SystemExit(f'Unknown persona(s) in mix: {", ".join(sorted(unknown))}')
+    return mix
+
+
+class Fixtures:
+    """Rows seeded into the PostgREST stub so scripted commands find real data."""
+
+    def __init__(self, harness: Harness, tasks: int, rng: random.Random) -> None:
+        self.harness = harness
+        self.rng = rng
+        self.task_ids: List[str] = []
+        for index in range(tasks):
+            cluster = {
+                'id': f'load-cluster-{index}',
+                'description': ISSUES[index % len(ISSUES)],
+                'location_label': f'Blk {100 + index}',
+                'zone_id': 'AMK',
+                'category': 'litter',
+            }
+            row = harness.postgrest.insert('tasks', {
+                'cluster_id': cluster['id'],
+                'task_type': 'CLEANUP',
+                'status': 'SCHEDULED',
+                'cluster': cluster,
+            })
+            self.task_ids.append(row['id'])
+
+    def complaints_for(self, user_id: int, count: int = 3) -> List[str]:
+        return [
+            self.harness.postgrest.insert('complaints', {
+                'text': ISSUES[self.rng.randrange(len(ISSUES))],
+                'status': self.rng.choice(('RECEIVED', 'CLUSTERED', 'VERIFIED')),
+                'category_pred': 'litter',
+                'severity_pred': 3,
+                'telegram_user_id': str(user_id),
+            })['id']
+            for _ in range(count)
+        ]
+
+
+def resident_script(user_id: int, fixtures: Fixtures, rng: random.Random) -> List[Step]:
+    issue = rng.choice(ISSUES)
+    return [
+        ('text', '/complaint', 'complaint_start'),
+        ('text', f'{issue}, it has been like this for {rng.randint(1, 6)} days', 'complaint_detail'),
+        ('text', f'Blk {rng.randint(100, 999)} {rng.choice(STREETS)} {rng.randint(1, 12)}', 'complaint_submit'),
+    ]
+
+
+def worker_script(user_id: int, fixtures: Fixtures, rng: random.Random) -> List[Step]:
+    task_id = rng.choice(fixtures.task_ids)
+    return [
+        ('text', f'/evidence {task_id[:8]}', 'evidence_start'),
+        ('photo', f'load-{user_id}-before', 'evidence_before'),
+        ('photo', f'load-{user_id}-after', 'evidence_after'),
+    ]
+
+
+def checker_script(user_id: int, fixtures: Fixtures, rng: random.Random) -> List[Step]:
+    owned = fixtures.complaints_for(user_id)
+    steps: List[Step] = []
+    for _ in range(rng.randint(2, 5)):
+        if rng.random() < 0.5:
+            steps.append(('text', f'/status {rng.choice(owned)[:8]}', 'status'))
+        else:
+            steps.append(('text', '/mycomplaints', 'mycomplaints'))
+    return steps
+
+
+SCRIPTS: Dict[str, Callable[[int, Fixtures, random.Random], List[Step]]] = {
+    'resident': resident_script,
+    'worker': worker_script,
+    'checker': checker_script,
+}
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.timeouts: Dict[str, int] = {}
+        self.sessions: Dict[str, int] = {}
+        self.updates = 0
+        self.last_answer = 0.0
+
+    def answered(self, label: str, latency: float) -> None:
+        with self.lock:
+            self.latencies.setdefault(label, []).append(latency)
+            self.updates += 1
+            self.last_answer = max(self.last_answer, time.time())
+
+    def timed_out(self, label: str) -> None:
+        with self.lock:
+            self.timeouts[label] = self.timeouts.get(label, 0) + 1
+            self.updates += 1
+
+    def finished(self, persona: str) -> None:
+        with self.lock:
+            self.sessions[persona] = self.sessions.get(persona, 0) + 1
+
+
+def run_session(harness: Harness, user_id: int, persona: str, steps: List[Step], args: argparse.Namespace, rng: random.Random, recorder: Recorder) -> None:
+    for index, (kind, payload, label) in enumerate(steps):
+        if index:
+            time.sleep(think_time(args.think, args.think_time, rng))
+        since = time.time()
+        if kind == 'photo':
+            harness.telegram.push_photo(user_id, payload)
+        else:
+            harness.telegram.push_text(user_id, payload)
+        latency = harness.await_answer(user_id, since, args.timeout)
+        if latency is None:
+            recorder.timed_out(label)
+            return
+        recorder.answered(label, latency)
+    recorder.finished(persona)
+
+
+def run_load(harness: Harness, args: argparse.Namespace, rate: float) -> dict:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    personas, weights = list(mix), list(mix.values())
+    fixtures = Fixtures(harness, args.tasks, rng)
+    offsets = arrival_offsets(args.arrivals, rate, args.duration, rng, args.burst_size)
+    recorder = Recorder()
+
+    threads: List[threading.Thread] = []
+    started = time.time()
+    for index, offset in enumerate(offsets):
+        delay = started + offset - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        persona = rng.choices(personas, weights)[0]
+        user_id = SESSION_BASE + index
+        steps = SCRIPTS[persona](user_id, fixtures, rng)
+        session_rng = random.Random(rng.random())
+        thread = threading.Thread(
+            target=run_session, args=(harness, user_id, persona, steps, args, session_rng, recorder), daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+        harness.sample_rss()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+            harness.sample_rss()
+
+    elapsed = max((recorder.last_answer or time.time()) - started, 1e-6)
+    every = [latency for values in recorder.latencies.values() for latency in values]
+    return {
+        'offered_sessions_per_s': rate,
+        'arrivals': args.arrivals,
+        'sessions_started': len(offsets),
+        'sessions_completed': dict(recorder.sessions),
+        'updates': recorder.updates,
+        'elapsed_s': round(elapsed, 3),
+        'achieved_sessions_per_s': round(sum(recorder.sessions.values()) / elapsed, 3),
+        'updates_per_s': round(recorder.updates / elapsed, 2),
+        'timeouts': dict(recorder.timeouts),
+        'latency': latency_summary(every),
+        'latency_by_step': {label: latency_summary(values) for label, values in sorted(recorder.latencies.items())},
+        'peak_rss_kb': harness.sample_rss(),
+    }
+
+
+def saturated(result: dict, slo_ms: float) -> bool:
+    completed = sum(result['sessions_completed'].values())
+    p99 = result['latency']['p99_ms']
+    return (
+        bool(result['timeouts'])
+        or completed < 0.9 * result['sessions_started']
+        or (p99 is not None and p99 > slo_ms)
+    )
+
+
+def run_sweep(args: argparse.Namespace) -> dict:
+    steps = []
+    best: Optional[float] = None
+    for rate in [float(value) for value in args.rates.split(',') if value]:
+        print(f'Sweep step: {rate} sessions/s for {args.duration}s...', flush=True)
+        with harness_from_args(args) as harness:
+            result = run_load(harness, args, rate)
+        result['saturated'] = saturated(result, args.slo_ms)
+        steps.append(result)
+        print(json.dumps({key: result[key] for key in ('offered_sessions_per_s', 'achieved_sessions_per_s', 'latency', 'timeouts', 'saturated')}), flush=True)
+        if result['saturated']:
+            break
+        best = rate
+    return {'entry': args.entry, 'slo_ms': args.slo_ms, 'saturation_rate': best, 'steps': steps}
+
+
+def load_updates(path: str) -> List[dict]:
+    """Updates from a log of update objects or getUpdates responses (JSON lines or one JSON document)."""
+    with open(path, encoding='utf-8') as handle:
+        text = handle.read().strip()
+    if not text:
+        return []
+    try:
+        documents = [json.loads(text)]
+    except json.JSONDecodeError:
+        documents = [json.loads(line) for line in text.splitlines() if line.strip()]
+    updates: List[dict] = []
+    for document in documents:
+        if isinstance(document, list):
+            updates.extend(document)
+        elif isinstance(document, dict) and 'result' in document:
+            updates.extend(document.get('result') or [])
+        elif isinstance(document, dict):
+            updates.append(document)
+    return sorted(updates, key=lambda update: update.get('update_id', 0))
+
+
+def _message(update: dict) -> dict:
+    return update.get('message') or update.get('edited_message') or {}
+
+
+def anonymise(updates: List[dict], salt: bytes) -> List[dict]:
+    """Keyed-hash user/chat ids and file_ids, drop names and contact fields, scrub
+    phone numbers and ids from text. The same input id always maps to the same output."""
+
+    def pseudo_id(value: object) -> int:
+        digest = hmac.new(salt, str(value).encode('utf-8'), hashlib.sha256).digest()
+        return 700000000 + int.from_bytes(digest[:4], 'big') % 100000000
+
+    def pseudo_file(value: str) -> str:
+        return 'anon-' + hmac.new(salt, value.encode('utf-8'), hashlib.sha256).hexdigest()[:24]
+
+    cleaned: List[dict] = []
+    for update in updates:
+        message = _message(update)
+        if not message:
+            continue
+        user = message.get('from') or {}
+        chat = message.get('chat') or {}
+        uid = pseudo_id(user.get('id') or chat.get('id'))
+        out: dict = {
+            'message_id': message.get('message_id'),
+            'date': message.get('date'),
+            'chat': {'id': pseudo_id(chat.get('id') or user.get('id')), 'type': chat.get('type', 'private')},
+            'from': {'id': uid, 'is_bot': False, 'username': f'user{uid}'},
+        }
+        if message.get('text'):
+            out['text'] = SENSITIVE.sub('[redacted]', message['text'])
+        if message.get('photo'):
+            out['photo'] = [
+                {key: (pseudo_file(value) if key in ('file_id', 'file_unique_id') else value) for key, value in size.items()}
+                for size in message['photo']
+            ]
+        if message.get('caption'):
+            out['caption'] = SENSITIVE.sub('[redacted]', message['caption'])
+        cleaned.append({'update_id': update.get('update_id'), 'message': out})
+    return cleaned
+
+
+def run_replay(harness: Harness, updates: List[dict], args: argparse.Namespace) -> dict:
+    """Push updates with their recorded spacing divided by ``speed`` (0 = back to back)."""
+    messages = [_message(update) for update in updates if _message(update)]
+    if not messages:
+        return {'updates': 0}
+    first_date = messages[0].get('date') or 0
+    pushed: List[Tuple[int, float]] = []
+    started = time.time()
+    for message in messages:
+        if args.speed > 0 and message.get('date'):
+            delay = started + (message['date'] - first_date) / args.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        chat_id = (message.get('chat') or {}).get('id')
+        replayed = {key: value for key, value in message.items() if key not in ('message_id', 'date')}
+        harness.telegram.push(replayed)
+        pushed.append((chat_id, time.time()))
+        harness.sample_rss()
+
+    # Latency of an update = time to the chat's first answer after it was pushed.
+    latencies: List[float] = []
+    unanswered = 0
+    deadline = time.time() + args.timeout
+    by_chat: Dict[int, List[float]] = {}
+    for chat_id, at in pushed:
+        by_chat.setdefault(chat_id, []).append(at)
+    for chat_id, times in by_chat.items():
+        for at in times:
+            latency = harness.await_answer(chat_id, at, max(0.0, deadline - at))
+            if latency is None:
+                unanswered += 1
+            else:
+                latencies.append(latency)
+    elapsed = max(time.time() - started, 1e-6)
+    return {
+        'updates': len(messages),
+        'chats': len(by_chat),
+        'speed': args.speed,
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_s': round(len(messages) / elapsed, 2),
+        'unanswered': unanswered,
+        'first_answer_latency': latency_summary(latencies),
+        'peak_rss_kb': harness.sample_rss(),
+    }
+
+
+def add_load_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--mix', default='resident=5,worker=2,checker=3', help='persona weights')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of arrivals')
+    parser.add_argument('--arrivals', choices=('poisson', 'uniform', 'burst'), default='poisson')
+    parser.add_argument('--burst-size', type=int, default=10)
+    parser.add_argument('--think', choices=('fixed', 'exponential', 'uniform'), default='exponential')
+    parser.add_argument('--think-time', type=float, default=2.0, help='mean seconds between steps of a session')
+    parser.add_argument('--tasks', type=int, default=50, help='SCHEDULED tasks seeded for /evidence')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help='scripted sessions at one rate')
+    load.add_argument('--rate', type=float, default=1.0, help='sessions started per second')
+    add_load_arguments(load)
+
+    sweep = commands.add_parser('sweep', help='find the saturation point')
+    sweep.add_argument('--rates', default='0.5,1,2,4,8,16', help='comma-separated sessions/sec, ascending')
+    sweep.add_argument('--slo-ms', type=float, default=5000.0, help='p99 answer latency allowed')
+    add_load_arguments(sweep)
+
+    replay = commands.add_parser('replay', help='push a recorded update log')
+    replay.add_argument('log')
+    replay.add_argument('--speed', type=float, default=1.0, help='time compression; 0 pushes back to back')
+    replay.add_argument('--anonymise', action='store_true', help='anonymise the log before replaying')
+
+    anon = commands.add_parser('anonymise', help='anonymise a recorded update log')
+    anon.add_argument('log')
+    anon.add_argument('out')
+    anon.add_argument('--salt', default=None, help='hash key (default: random, so ids cannot be reversed)')
+
+    for sub in (load, sweep, replay):
+        sub.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for each answer')
+        sub.add_argument('--output', default='loadgen-results.json')
+        add_upstream_arguments(sub)
+    return parser.parse_args(argv)
+
+
+def write_report(args: argparse.Namespace, results: dict) -> None:
+    report = {
+        'generated_at': utc_now_iso(),
+        'environment': environment(),
+        'command': args.command,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'command')},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2)
+    print(f'Results written to {args.output}')
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    if args.command == 'anonymise':
+        salt = args.salt.encode('utf-8') if args.salt else os.urandom(16)
+        updates = anonymise(load_updates(args.log), salt)
+        with open(args.out, 'w', encoding='utf-8') as handle:
+            for update in updates:
+                handle.write(json.dumps(update, ensure_ascii=False) + '\n')
+        print(f'Wrote {len(updates)} anonymised updates to {args.out}')
+        return 0
+
+    if args.command == 'sweep':
+        results = run_sweep(args)
+    elif args.command == 'load':
+        with harness_from_args(args) as harness:
+            results = run_load(harness, args, args.rate)
+            results['upstreams'] = harness.upstream_stats()
+    else:
+        updates = load_updates(args.log)
+        if args.anonymise:
+            updates = anonymise(updates, os.urandom(16))
+        with harness_from_args(args) as harness:
+            results = run_replay(harness, updates, args)
+            results['upstreams'] = harness.upstream_stats()
+    print(json.dumps({key: value for key, value in results.items() if key not in ('steps', 'upstreams')}, indent=2))
+    write_report(args, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,259 @@
+"""Offline benchmark for the Telegram bot.
+
+Starts the stand-in upstreams (see ``stubs.py``), runs the bot against them
+and drives one or more scenarios:
+
+- ``commands``: a burst of /help, /status and /mycomplaints updates from many
+  users; reports updates/sec and reply latency (update queued -> reply sent).
+- ``complaints``: users run the multi-turn /complaint conversation in
+  parallel; reports per-turn reply latency and complaints linked.
+- ``fanout``: verified evidence rows for clusters with many complainers;
+  reports notifications/sec and the delay from row insert to last delivery.
+
+Results, the configuration and the peak RSS of the bot are written as JSON.
+
+    python bench/run.py --scenario commands,fanout --users 50 --output bench-results.json
+    python bench/run.py --wxo-latency 1.5 --supabase-error-rate 0.05
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (  # noqa: E402
+    DISPATCHER_ID, MEDIA_ID, Harness, add_upstream_arguments, environment, harness_from_args, latency_summary,
+)
+from stubs import utc_now_iso  # noqa: E402
+
+COMMANDS = ('/help', '/status', '/mycomplaints')
+ISSUES = (
+    'Overflowing rubbish bin near the lift lobby',
+    'Dead rat at the void deck',
+    'Pigeon droppings all over the corridor',
+    'Broken glass bottles at the playground',
+    'Stagnant water in the drain by the carpark',
+    'Cigarette butts littered along the staircase',
+)
+
+SCENARIOS = ('commands', 'complaints', 'fanout')
+USER_BASE = 500000000
+
+
+def seed_complaints(harness: Harness, users: List[int], per_user: int = 3) -> Dict[int, List[str]]:
+    by_user: Dict[int, List[str]] = {}
+    for user_id in users:
+        for index in range(per_user):
+            row = harness.postgrest.insert('complaints', {
+                'text': f'{ISSUES[index % len(ISSUES)]} (seeded)',
+                'status': random.choice(('RECEIVED', 'CLUSTERED', 'VERIFIED')),
+                'category_pred': 'litter',
+                'severity_pred': 3,
+                'telegram_user_id': str(user_id),
+                'created_at': utc_now_iso(),
+            })
+            by_user.setdefault(user_id, []).append(row['id'])
+    return by_user
+
+
+def run_commands(harness: Harness, args: argparse.Namespace) -> dict:
+    users = [USER_BASE + index for index in range(args.users)]
+    owned = seed_complaints(harness, users)
+    telegram = harness.telegram
+
+    started = time.time()
+    pushed: Dict[int, List[float]] = {}
+    for index in range(args.updates):
+        user_id = users[index % len(users)]
+        command = COMMANDS[index % len(COMMANDS)]
+        if command == '/status':
+            command = f'/status {random.choice(owned[user_id])[:8]}'
+        pushed.setdefault(user_id, []).append(time.time())
+        telegram.push_text(user_id, command)
+
+    latencies: List[float] = []
+    last_reply = started
+    deadline = started + args.timeout
+    for user_id, times in pushed.items():
+        replies = telegram.wait_replies(user_id, len(times), started, max(0.0, deadline - time.time()))
+        # Every command gets exactly one reply, in order.
+        for queued, reply in zip(times, replies):
+            latencies.append(reply['at'] - queued)
+            last_reply = max(last_reply, reply['at'])
+        harness.sample_rss()
+
+    elapsed = max(last_reply - started, 1e-6)
+    return {
+        'updates': args.updates,
+        'users': args.users,
+        'replied': len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_s': round(len(latencies) / elapsed, 2),
+        'reply_latency': latency_summary(latencies),
+    }
+
+
+def run_complaints(harness: Harness, args: argparse.Namespace) -> dict:
+    users = [USER_BASE + 100000 + index for index in range(args.users)]
+    turn_latencies: Dict[str, List[float]] = {'start': [], 'detail': [], 'submit': []}
+    timeouts = [0]
+    lock = threading.Lock()
+    linked_before = sum(1 for row in harness.postgrest.rows('complaints') if row.get('telegram_user_id'))
+
+    def converse(index: int, user_id: int) -> None:
+        issue = ISSUES[index % len(ISSUES)]
+        block = 100 + index
+        turns = (
+            ('start', '/complaint'),
+            ('detail', f'{issue}, it has been there for {index % 5 + 2} days'),
+            ('submit', f'Blk {block} Ang Mo Kio Avenue {index % 10 + 1}, next to unit #{index:03d}'),
+        )
+        for name, text in turns:
+            since = time.time()
+            harness.telegram.push_text(user_id, text)
+            latency = harness.await_answer(user_id, since, args.timeout)
+            with lock:
+                if latency is None:
+                    timeouts[0] += 1
+                    return
+                turn_latencies[name].append(latency)
+            time.sleep(args.think_time)
+
+    started = time.time()
+    threads = [threading.Thread(target=converse, args=(index, user_id)) for index, user_id in enumerate(users)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        harness.sample_rss()
+        time.sleep(0.2)
+    elapsed = time.time() - started
+
+    linked = sum(1 for row in harness.postgrest.rows('complaints') if row.get('telegram_user_id')) - linked_before
+    return {
+        'users': args.users,
+        'elapsed_s': round(elapsed, 3),
+        'timeouts': timeouts[0],
+        'complaints_created': harness.watson.complaints_created,
+        'complaints_linked': linked,
+        'conversations_per_s': round(len(turn_latencies['submit']) / max(elapsed, 1e-6), 2),
+        'turn_latency': {name: latency_summary(values) for name, values in turn_latencies.items()},
+    }
+
+
+def run_fanout(harness: Harness, args: argparse.Namespace) -> dict:
+    postgrest = harness.postgrest
+    telegram = harness.telegram
+    sent_before = len(telegram.sent)
+
+    recipients = [USER_BASE + 200000 + index for index in range(args.recipients)]
+    expected = 0
+    rows = []
+    for index in range(args.notifications):
+        cluster = {
+            'id': f'bench-cluster-{index}',
+            'description': f'{ISSUES[index % len(ISSUES)]} hotspot',
+            'location_label': f'Blk {200 + index}',
+            'zone_id': 'AMK',
+            'category': 'litter',
+        }
+        for user_id in recipients:
+            postgrest.insert('complaints', {
+                'text': cluster['description'],
+                'status': 'CLUSTERED',
+                'cluster_id': cluster['id'],
+                'telegram_user_id': str(user_id),
+            })
+        task_id = f'bench-task-{index:04d}-0000-0000-000000000000'
+        rows.append({
+            'task_id': task_id,
+            'before_image_url': f'{postgrest.url}/storage/v1/object/public/evidence-photos/{task_id}/before.jpg',
+            'after_image_url': f'{postgrest.url}/storage/v1/object/public/evidence-photos/{task_id}/after.jpg',
+            'notes': 'Verified by supervisor',
+            'submitted_by': 'supervisor-bench',
+            'task': {'id': task_id, 'task_type': 'CLEANUP', 'cluster': cluster},
+        })
+        # Complainers plus the media chat; the media chat may also be a complainer.
+        expected += len(set(recipients) | {MEDIA_ID})
+
+    started = time.time()
+    for row in rows:
+        postgrest.insert('evidence', {**row, 'submitted_at': utc_now_iso()})
+
+    deadline = started + args.timeout
+    while time.time() < deadline:
+        if telegram.wait_sent(sent_before + expected, min(1.0, max(0.0, deadline - time.time()))) >= sent_before + expected:
+            break
+        harness.sample_rss()
+
+    deliveries = [sent for sent in telegram.sent[sent_before:] if sent['at'] >= started]
+    first = min((sent['at'] for sent in deliveries), default=started)
+    last = max((sent['at'] for sent in deliveries), default=started)
+    photos = sum(sent['photos'] for sent in deliveries)
+    return {
+        'notifications': args.notifications,
+        'recipients_per_notification': args.recipients,
+        'expected_deliveries': expected,
+        'deliveries': len(deliveries),
+        'photos_sent': photos,
+        'first_delivery_s': round(first - started, 3),
+        'last_delivery_s': round(last - started, 3),
+        'deliveries_per_s': round(len(deliveries) / max(last - first, 1e-6), 2) if len(deliveries) > 1 else None,
+    }
+
+
+RUNNERS = {'commands': run_commands, 'complaints': run_complaints, 'fanout': run_fanout}
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', default=','.join(SCENARIOS), help=f'comma-separated subset of {", ".join(SCENARIOS)}')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=300, help='updates in the commands burst')
+    parser.add_argument('--think-time', type=float, default=0.0, help='seconds between complaint turns')
+    parser.add_argument('--notifications', type=int, default=10, help='verified evidence rows in the fanout scenario')
+    parser.add_argument('--recipients', type=int, default=20, help='complainers per notified cluster')
+    parser.add_argument('--timeout', type=float, default=120.0, help='per-scenario wait for replies')
+    add_upstream_arguments(parser)
+    parser.add_argument('--output', default='bench-results.json')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenario.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in RUNNERS]
+    if unknown:
+        raise SystemExit(f'Unknown scenario(s): {", ".join(unknown)}')
+
+    harness = harness_from_args(args)
+    results: Dict[str, dict] = {}
+    with harness:
+        for name in scenarios:
+            print(f'Running {name}...', flush=True)
+            results[name] = RUNNERS[name](harness, args)
+            print(json.dumps(results[name], indent=2), flush=True)
+        peak_rss_kb = harness.sample_rss()
+    upstreams = harness.upstream_stats()
+
+    report = {
+        'generated_at': utc_now_iso(),
+        'environment': environment(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'scenarios': results,
+        'bot': {'peak_rss_kb': peak_rss_kb or harness.peak_rss_kb, 'dispatcher_id': DISPATCHER_ID},
+        'upstreams': upstreams,
+    }
+    with open(args.output, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2)
+    print(f'Peak RSS {report["bot"]["peak_rss_kb"]} KiB; results written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,601 @@
+"""Stand-in upstreams for offline benchmarks.
+
+Each stub is a small threaded HTTP server speaking just enough of the real
+protocol for the bot to run unmodified against it:
+
+- ``FakeTelegram``: Bot API long polling (``getUpdates``), the send methods
+  the bot uses, ``getFile`` and file downloads. Updates are queued with
+  ``push_text`` / ``push_photo``; everything the bot sends is recorded so a
+  driver can wait for replies and measure latency.
+- ``FakePostgrest``: in-memory PostgREST tables (``eq``/``gt``/``in``/``is``/
+  ``or`` filters, ``order``, ``limit``, upserts, ``return=representation``),
+  Storage uploads and the ``watson-token`` / ``cluster-complaints`` functions.
+  Embedded resources are not joined: rows are stored with their embeds
+  already in place, and filters on embedded columns walk the nesting.
+- ``FakeWatson``: the orchestrate chat completions endpoint. It asks a
+  follow-up question until the conversation has ``turns`` user messages, then
+  inserts a complaint row into the PostgREST stub the way the real agent's
+  tool call would (with the conversation's ``[complaint ref: ...]`` tag as
+  ``correlation_id``) and confirms it.
+
+JSON responses of 1 KiB or more are gzipped for clients that accept it, and
+each stub counts the bytes it sent before and after compression.
+
+Every stub takes a ``Faults`` (fixed latency plus jitter, and a rate of
+injected error responses) so benchmarks can model slow or flaky upstreams.
+"""
+
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+Response = Tuple[int, str, bytes]
+
+JSON = 'application/json'
+# Smallest valid JPEG header padded to a configurable size; the bot never decodes photos.
+JPEG_MAGIC = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+
+
+def utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def json_response(payload: object, status: int = 200) -> Response:
+    return status, JSON, json.dumps(payload).encode('utf-8')
+
+
+class Faults:
+    """Latency and error injection: each request sleeps ``latency`` +/- ``jitter``
+    seconds, then fails with ``error_status`` with probability ``error_rate``."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def apply(self) -> Optional[int]:
+        delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            'latency': self.latency,
+            'jitter': self.jitter,
+            'error_rate': self.error_rate,
+            'error_status': self.error_status,
+        }
+
+
+class StubServer:
+    """Threaded HTTP server dispatching every request to ``handle``."""
+
+    name = 'stub'
+
+    def __init__(self, faults: Optional[Faults] = None, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.faults = faults or Faults()
+        self.host = host
+        self.port = port
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.injected_errors = 0
+        self.bytes_sent = 0
+        self.bytes_uncompressed = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def start(self) -> 'StubServer':
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _dispatch(self) -> None:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                parsed = urllib.parse.urlsplit(self.path)
+                status, content_type, payload = stub.serve(self.command, parsed.path, parsed.query, self.headers, body)
+                size = len(payload)
+                # Like PostgREST behind its gateway and the Bot API: gzip JSON bodies worth compressing.
+                compress = content_type == JSON and len(payload) >= 1024 and 'gzip' in (self.headers.get('Accept-Encoding') or '')
+                if compress:
+                    payload = gzip.compress(payload, compresslevel=5)
+                with stub.lock:
+                    stub.bytes_sent += len(payload)
+                    stub.bytes_uncompressed += size
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    if compress:
+                        self.send_header('Content-Encoding', 'gzip')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The bot gave up on the request (timeout) or is shutting down.
+                    pass
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _dispatch
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name=f'{self.name}-stub', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def serve(self, method: str, path: str, query: str, headers, body: bytes) -> Response:
+        route = self.route(method, path)
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+        # Long polls wait for updates instead of modelling upstream latency.
+        if route != 'getUpdates':
+            status = self.faults.apply()
+            if status is not None:
+                with self.lock:
+                    self.injected_errors += 1
+                return json_response({'ok': False, 'error_code': status, 'description': 'injected fault'}, status)
+        try:
+            return self.handle(method, path, urllib.parse.parse_qs(query, keep_blank_values=True), headers, body)
+        except Exception as exc:
+            return json_response({'message': f'{type(exc).__name__}: {exc}'}, 500)
+
+    def route(self, method: str, path: str) -> str:
+        return f'{method} {path}'
+
+    def handle(self, method: str, path: str, params: Dict[str, List[str]], headers, body: bytes) -> Response:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'injected_errors': self.injected_errors,
+                'bytes_sent': self.bytes_sent,
+                'bytes_uncompressed': self.bytes_uncompressed,
+                'faults': self.faults.to_dict(),
+            }
+
+
+class FakeTelegram(StubServer):
+    name = 'telegram'
+
+    def __init__(self, faults: Optional[Faults] = None, file_size: int = 64 * 1024, **kwargs) -> None:
+        super().__init__(faults, **kwargs)
+        self.file_size = file_size
+        self.cond = threading.Condition(self.lock)
+        self.updates: List[dict] = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.pushed_at: Dict[int, float] = {}
+        self.sent: List[dict] = []
+        self.sent_by_chat: Dict[int, List[dict]] = {}
+
+    def route(self, method: str, path: str) -> str:
+        if path.startswith('/file/'):
+            return 'file'
+        return path.rsplit('/', 1)[-1]
+
+    # --- driver side -------------------------------------------------------
+
+    def push(self, message: dict) -> int:
+        with self.cond:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            message.setdefault('message_id', update_id)
+            message.setdefault('date', int(time.time()))
+            self.updates.append({'update_id': update_id, 'message': message})
+            self.pushed_at[update_id] = time.time()
+            self.cond.notify_all()
+            return update_id
+
+    def push_text(self, user_id: int, text: str, username: Optional[str] = None) -> int:
+        return self.push({
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'username': username or f'user{user_id}'},
+            'text': text,
+        })
+
+    def push_photo(self, user_id: int, file_id: str, username: Optional[str] = None) -> int:
+        sizes = [
+            {'file_id': f'{file_id}-s', 'file_unique_id': f'{file_id}-s', 'width': 90, 'height': 90, 'file_size': 1024},
+            {'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960, 'file_size': self.file_size},
+        ]
+        return self.push({
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'username': username or f'user{user_id}'},
+            'photo': sizes,
+        })
+
+    def pending(self) -> int:
+        with self.cond:
+            return len(self.updates)
+
+    def replies(self, chat_id: int, since: float = 0.0) -> List[dict]:
+        with self.cond:
+            return [sent for sent in self.sent_by_chat.get(chat_id, []) if sent['at'] >= since]
+
+    def wait_replies(self, chat_id: int, count: int, since: float, timeout: float) -> List[dict]:
+        """Wait until ``count`` messages were sent to ``chat_id`` at or after ``since``."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                found = [sent for sent in self.sent_by_chat.get(chat_id, []) if sent['at'] >= since]
+                remaining = deadline - time.time()
+                if len(found) >= count or remaining <= 0:
+                    return found
+                self.cond.wait(remaining)
+
+    def wait_sent(self, count: int, timeout: float) -> int:
+        """Wait until at least ``count`` messages were sent in total; returns the total."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while len(self.sent) < count:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return len(self.sent)
+
+    # --- Bot API side ------------------------------------------------------
+
+    def _record(self, method: str, chat_id: int, text: str, photos: int = 0) -> dict:
+        with self.cond:
+            message_id = self.next_message_id
+            self.next_message_id += photos or 1
+            sent = {'method': method, 'chat_id': chat_id, 'text': text, 'photos': photos, 'at': time.time()}
+            self.sent.append(sent)
+            self.sent_by_chat.setdefault(chat_id, []).append(sent)
+            self.cond.notify_all()
+            return {'message_id': message_id, 'chat': {'id': chat_id, 'type': 'private'}, 'date': int(time.time())}
+
+    def _photo_sizes(self, media: str) -> List[dict]:
+        file_id = media if not media.startswith('http') else f'photo-{uuid.uuid5(uuid.NAMESPACE_URL, media).hex[:16]}'
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960}]
+
+    def handle(self, method: str, path: str, params: Dict[str, List[str]], headers, body: bytes) -> Response:
+        if path.startswith('/file/'):
+            return 200, 'image/jpeg', JPEG_MAGIC + b'\x00' * max(0, self.file_size - len(JPEG_MAGIC))
+
+        api_method = path.rsplit('/', 1)[-1]
+        payload = json.loads(body) if body else {}
+        if api_method == 'getUpdates':
+            return json_response({'ok': True, 'result': self._get_updates(params)})
+        if api_method == 'getFile':
+            file_id = payload.get('file_id') or (params.get('file_id') or [''])[0]
+            return json_response({'ok': True, 'result': {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': self.file_size,
+                'file_path': f'photos/{file_id}.jpg',
+            }})
+        chat_id = int(payload.get('chat_id') or 0)
+        if api_method == 'sendMessage':
+            return json_response({'ok': True, 'result': {**self._record(api_method, chat_id, payload.get('text', '')), 'text': payload.get('text', '')}})
+        if api_method == 'sendPhoto':
+            message = self._record(api_method, chat_id, payload.get('caption', ''), photos=1)
+            return json_response({'ok': True, 'result': {**message, 'photo': self._photo_sizes(payload.get('photo', ''))}})
+        if api_method == 'sendMediaGroup':
+            media = payload.get('media') or []
+            caption = next((item.get('caption', '') for item in media if item.get('caption')), '')
+            first = self._record(api_method, chat_id, caption, photos=len(media))
+            result = [
+                {**first, 'message_id': first['message_id'] + index, 'photo': self._photo_sizes(item.get('media', ''))}
+                for index, item in enumerate(media)
+            ]
+            return json_response({'ok': True, 'result': result})
+        return json_response({'ok': False, 'error_code': 404, 'description': f'Not Found: {api_method}'}, 404)
+
+    def _get_updates(self, params: Dict[str, List[str]]) -> List[dict]:
+        offset = int((params.get('offset') or ['0'])[0] or 0)
+        timeout = float((params.get('timeout') or ['0'])[0] or 0)
+        deadline = time.time() + timeout
+        with self.cond:
+            # Confirming an offset drops every earlier update, as the real API does.
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self.cond.wait(remaining)
+            return list(self.updates[:100])
+
+
+def _split_top_level(text: str) -> List[str]:
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        depth += (char == '(') - (char == ')')
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _lookup(row: dict, column: str) -> object:
+    value: object = row
+    for part in column.split('.'):
+        if isinstance(value, list):
+            # A filter on a to-many embed matches if any embedded row matches.
+            values = [item.get(part) for item in value if isinstance(item, dict)]
+            value = values
+        elif isinstance(value, dict):
+            value = value.get(part)
+        else:
+            return None
+    return value
+
+
+def _coerce(value: object) -> object:
+    if isinstance(value, (int, float)) or value is None:
+        return value
+    text = str(value)
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return text
+
+
+def _text(value: object) -> str:
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+
+def _compare(actual: object, op: str, expected: str) -> bool:
+    if isinstance(actual, list):
+        return any(_compare(item, op, expected) for item in actual)
+    if op == 'is':
+        if expected == 'null':
+            return actual is None
+        return _text(actual) == expected
+    if op in ('in', 'not.in'):
+        options = [item.strip().strip('"') for item in expected.strip('()').split(',') if item.strip()]
+        found = actual is not None and _text(actual) in options
+        return found if op == 'in' else not found
+    if op == 'eq':
+        return actual is not None and _text(actual) == expected
+    if op == 'neq':
+        return actual is not None and _text(actual) != expected
+    if actual is None:
+        return False
+    left, right = _coerce(actual), _coerce(expected)
+    if type(left) is not type(right):
+        left, right = str(actual), expected
+    return {'gt': left > right, 'gte': left >= right, 'lt': left < right, 'lte': left <= right}.get(op, False)
+
+
+def _parse_filter(expression: str) -> Tuple[str, str]:
+    """``gt.2026-01-01`` -> ('gt', '2026-01-01'); handles the ``not.`` prefix."""
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[4:]
+    op, _, value = expression.partition('.')
+    # Values with reserved characters arrive double-quoted.
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    return ('not.' + op if negate else op), value
+
+
+def _matches(row: dict, column: str, expression: str) -> bool:
+    op, value = _parse_filter(expression)
+    if op.startswith('not.') and op != 'not.in':
+        return not _compare(_lookup(row, column), op[4:], value)
+    return _compare(_lookup(row, column), op, value)
+
+
+def _matches_or(row: dict, expression: str) -> bool:
+    for condition in _split_top_level(expression.strip('()')):
+        column, _, rest = condition.partition('.')
+        if _matches(row, column, rest):
+            return True
+    return False
+
+
+class FakePostgrest(StubServer):
+    name = 'supabase'
+    CONTROL_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'or', 'columns'}
+
+    def __init__(self, faults: Optional[Faults] = None, **kwargs) -> None:
+        super().__init__(faults, **kwargs)
+        self.tables: Dict[str, List[dict]] = {}
+        self.objects: Dict[str, bytes] = {}
+        self.data_lock = threading.Lock()
+
+    def route(self, method: str, path: str) -> str:
+        parts = [part for part in path.split('/') if part]
+        if len(parts) >= 3 and parts[0] in ('rest', 'functions'):
+            return f'{method} {parts[2]}'
+        if parts and parts[0] == 'storage':
+            return f'{method} storage'
+        return f'{method} {path}'
+
+    # --- driver side -------------------------------------------------------
+
+    def insert(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        row.setdefault('id', str(uuid.uuid4()))
+        row.setdefault('created_at', utc_now_iso())
+        with self.data_lock:
+            self.tables.setdefault(table, []).append(row)
+        return row
+
+    def rows(self, table: str) -> List[dict]:
+        with self.data_lock:
+            return list(self.tables.get(table, []))
+
+    # --- PostgREST side ----------------------------------------------------
+
+    def handle(self, method: str, path: str, params: Dict[str, List[str]], headers, body: bytes) -> Response:
+        parts = [urllib.parse.unquote(part) for part in path.split('/') if part]
+        if parts[:2] == ['functions', 'v1'] and len(parts) >= 3:
+            return self._function(parts[2], json.loads(body) if body else {})
+        if parts[:2] == ['storage', 'v1']:
+            return self._storage(method, '/'.join(parts[3:]), body)
+        if parts[:2] != ['rest', 'v1'] or len(parts) < 3:
+            return json_response({'message': 'not found'}, 404)
+
+        table = parts[2]
+        prefer = headers.get('Prefer') or ''
+        if method == 'GET':
+            return json_response(self._select(table, params))
+        if method == 'POST':
+            payload = json.loads(body) if body else []
+            rows = payload if isinstance(payload, list) else [payload]
+            on_conflict = (params.get('on_conflict') or [''])[0]
+            ignore = 'resolution=ignore-duplicates' in prefer
+            written = [row for row in (self._upsert(table, row, on_conflict, ignore) for row in rows) if row is not None]
+            return json_response(written, 201) if 'return=representation' in prefer else (201, JSON, b'')
+        if method == 'PATCH':
+            changes = json.loads(body) if body else {}
+            with self.data_lock:
+                matched = [row for row in self.tables.get(table, []) if self._filter(row, params)]
+                for row in matched:
+                    row.update(changes)
+                written = [dict(row) for row in matched]
+            return json_response(written) if 'return=representation' in prefer else (204, JSON, b'')
+        if method == 'DELETE':
+            with self.data_lock:
+                rows = self.tables.get(table, [])
+                self.tables[table] = [row for row in rows if not self._filter(row, params)]
+            return 204, JSON, b''
+        return json_response({'message': f'unsupported method {method}'}, 405)
+
+    def _filter(self, row: dict, params: Dict[str, List[str]]) -> bool:
+        for key, values in params.items():
+            if key in self.CONTROL_PARAMS:
+                if key == 'or' and not all(_matches_or(row, value) for value in values):
+                    return False
+                continue
+            if not all(_matches(row, key, value) for value in values):
+                return False
+        return True
+
+    def _select(self, table: str, params: Dict[str, List[str]]) -> List[dict]:
+        with self.data_lock:
+            rows = [dict(row) for row in self.tables.get(table, []) if self._filter(row, params)]
+        for clause in reversed(_split_top_level((params.get('order') or [''])[0])):
+            if not clause:
+                continue
+            column, _, direction = clause.partition('.')
+            rows.sort(
+                key=lambda row: (_lookup(row, column) is None, _coerce(_lookup(row, column)) if _lookup(row, column) is not None else 0),
+                reverse=direction.startswith('desc'),
+            )
+        offset = int((params.get('offset') or ['0'])[0] or 0)
+        limit = (params.get('limit') or [''])[0]
+        rows = rows[offset:]
+        return rows[:int(limit)] if limit else rows
+
+    def _upsert(self, table: str, row: dict, on_conflict: str, ignore: bool = False) -> Optional[dict]:
+        """Insert, or on an ``on_conflict`` match merge (or skip, returning None, when ``ignore``)."""
+        keys = [key for key in on_conflict.split(',') if key]
+        with self.data_lock:
+            existing = self.tables.setdefault(table, [])
+            if keys:
+                for current in existing:
+                    if all(current.get(key) == row.get(key) for key in keys):
+                        if ignore:
+                            return None
+                        current.update(row)
+                        return dict(current)
+        return dict(self.insert(table, row))
+
+    def _storage(self, method: str, path: str, body: bytes) -> Response:
+        if method in ('POST', 'PUT'):
+            with self.data_lock:
+                self.objects[path] = body
+            return json_response({'Key': path})
+        key = path[len('public/'):] if path.startswith('public/') else path
+        with self.data_lock:
+            data = self.objects.get(key)
+        if data is None:
+            return json_response({'message': 'Object not found'}, 404)
+        return 200, 'image/jpeg', data
+
+    def _function(self, name: str, payload: dict) -> Response:
+        if name == 'watson-token':
+            return json_response({'token': 'bench-token', 'expires_at': int(time.time()) + 3600})
+        if name == 'cluster-complaints':
+            complaint_id = payload.get('complaint_id')
+            with self.data_lock:
+                for row in self.tables.get('complaints', []):
+                    if row.get('id') == complaint_id and row.get('status') == 'RECEIVED':
+                        row['status'] = 'CLUSTERED'
+            return json_response({'ok': True, 'complaint_id': complaint_id})
+        return json_response({'ok': True})
+
+
+CORRELATION_TAG = re.compile(r'\s*\[complaint ref: ([0-9a-f]+)\]')
+
+
+class FakeWatson(StubServer):
+    name = 'wxo'
+
+    QUESTION = 'Thanks for reporting. Could you tell me where exactly this is, with a block number?'
+    CONFIRMATION = 'Your complaint has been logged for the estate team. Thank you!'
+
+    def __init__(self, postgrest: FakePostgrest, faults: Optional[Faults] = None, turns: int = 2, **kwargs) -> None:
+        super().__init__(faults, **kwargs)
+        self.postgrest = postgrest
+        self.turns = turns
+        self.complaints_created = 0
+
+    def route(self, method: str, path: str) -> str:
+        return path.rsplit('/', 1)[-1] if path.endswith('/chat/completions') else f'{method} {path}'
+
+    def handle(self, method: str, path: str, params: Dict[str, List[str]], headers, body: bytes) -> Response:
+        if not path.endswith('/chat/completions'):
+            return json_response({'message': 'not found'}, 404)
+        messages = (json.loads(body) if body else {}).get('messages') or []
+        user_texts = [
+            part.get('text', '')
+            for message in messages if message.get('role') == 'user'
+            for part in (message.get('content') or []) if isinstance(part, dict)
+        ]
+        refs = [found.group(1) for found in map(CORRELATION_TAG.search, user_texts) if found]
+        user_texts = [CORRELATION_TAG.sub('', text) for text in user_texts]
+        if len(user_texts) < self.turns:
+            reply = self.QUESTION
+        else:
+            self.postgrest.insert('complaints', {
+                'text': ' '.join(user_texts),
+                'correlation_id': refs[0] if refs else None,
+                'location_label': user_texts[-1][:80],
+                'category_pred': 'litter',
+                'severity_pred': 3,
+                'urgency_pred': '48H',
+                'status': 'RECEIVED',
+                'telegram_user_id': None,
+            })
+            with self.lock:
+                self.complaints_created += 1
+            reply = self.CONFIRMATION
+        return json_response({'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}}]})
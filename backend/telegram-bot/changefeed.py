@@ -0,0 +1,183 @@
+"""Row changes pushed by Postgres instead of polled through PostgREST.
+
+The ``change_feed_notify`` migration adds triggers that ``pg_notify`` the
+``bot_changes`` channel with ``{"table", "op", "id"}`` when a run sheet
+becomes dispatched, evidence is inserted or updated, or a complaint moves to
+VERIFIED or CLOSED. ``ChangeFeed`` keeps one direct connection (needs
+``psycopg`` 3.2 or later) that LISTENs on the channel and hands the changed
+ids, grouped by table, to ``on_changes`` a batch at a time.
+
+Postgres only delivers a notification to sessions listening when it is
+committed, so changes made while the connection is down are never seen. The
+notification polls therefore stay, as reconcilers: wrapped by
+``reconciler``, a poll is due while the feed is disconnected, after every
+(re)connect and after a batch failed to apply, until one finds nothing new;
+then only every ``reconcile_interval``. ``on_gap`` is called whenever a poll
+becomes due that way, so it can run at once. Put TCP keepalive settings in the
+DSN so a dead connection is noticed between the idle heartbeats.
+"""
+
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+MAX_BACKOFF = 30.0
+
+
+class ChangeFeed:
+    def __init__(
+        self,
+        dsn: str,
+        on_changes: Callable[[Dict[str, List[str]]], None],
+        channel: str = 'bot_changes',
+        reconcile_interval: float = 300.0,
+        batch_window: float = 0.05,
+        max_batch: int = 100,
+        heartbeat: float = 30.0,
+        on_gap: Optional[Callable[[], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+    ) -> None:
+        """``on_changes({table: [id, ...]})`` is called on the listener thread and should raise
+        if the batch was not applied, so the polls catch up on it."""
+        try:
+            import psycopg  # noqa: F401
+        except ImportError as exc:
+            raise RuntimeError('ChangeFeed needs the psycopg package (pip install psycopg).') from exc
+        self.dsn = dsn
+        self.on_changes = on_changes
+        self.channel = channel
+        self.reconcile_interval = reconcile_interval
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        self.heartbeat = heartbeat
+        self.on_gap = on_gap
+        self.on_error = on_error
+        self.connected = False
+        # Bumped on every successful LISTEN and every failed batch: a reconcile
+        # done in an older generation does not cover what was missed since.
+        self.generation = 0
+        # Feed name -> (generation, monotonic time) of its last complete reconcile.
+        self.reconciled: Dict[str, Tuple[int, float]] = {}
+        self.events = 0
+        self.batches = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def reconcile_due(self, name: str) -> bool:
+        with self.lock:
+            if not self.connected:
+                return True
+            done = self.reconciled.get(name)
+            generation = self.generation
+        return done is None or done[0] != generation or time.monotonic() - done[1] >= self.reconcile_interval
+
+    def reconciler(self, name: str, poll: Callable[[], Optional[List[float]]], position: Callable[[], object]):
+        """Wrap a feed poll so it counts as a reconcile once it finds nothing new: it
+        handled no rows and ``position`` (the feed's watermark) did not move."""
+        def run() -> Optional[List[float]]:
+            with self.lock:
+                generation = self.generation
+            before = position()
+            handled = poll()
+            if not handled and position() == before:
+                with self.lock:
+                    self.reconciled[name] = (generation, time.monotonic())
+            return handled
+
+        return run
+
+    def invalidate(self) -> None:
+        """Make every reconciler due, e.g. when this replica starts acting on events again."""
+        with self.lock:
+            self.generation += 1
+        if self.on_gap:
+            self.on_gap()
+
+    def _listen(self) -> None:
+        import psycopg
+        from psycopg import sql
+
+        with psycopg.connect(self.dsn, autocommit=True) as conn:
+            conn.execute(sql.SQL('listen {}').format(sql.Identifier(self.channel)))
+            with self.lock:
+                self.connected = True
+                self.generation += 1
+            self.failures = 0
+            if self.on_gap:
+                self.on_gap()
+            idle_since = time.monotonic()
+            while not self.stopped.is_set():
+                notifies = list(conn.notifies(timeout=1.0, stop_after=1))
+                if not notifies:
+                    if time.monotonic() - idle_since >= self.heartbeat:
+                        conn.execute('select 1')
+                        idle_since = time.monotonic()
+                    continue
+                # Collect whatever else arrives right behind the first one.
+                notifies += conn.notifies(timeout=self.batch_window, stop_after=self.max_batch - 1)
+                self._deliver([notify.payload for notify in notifies])
+                idle_since = time.monotonic()
+
+    def _deliver(self, payloads: List[str]) -> None:
+        changes: Dict[str, List[str]] = {}
+        for payload in payloads:
+            try:
+                event = json.loads(payload)
+                table, row_id = event['table'], str(event['id'])
+            except (ValueError, KeyError, TypeError):
+                continue
+            ids = changes.setdefault(table, [])
+            if row_id not in ids:
+                ids.append(row_id)
+        self.events += len(payloads)
+        self.batches += 1
+        if not changes:
+            return
+        try:
+            self.on_changes(changes)
+        except Exception as exc:
+            if self.on_error:
+                self.on_error(exc)
+            self.invalidate()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self._listen()
+            except Exception as exc:
+                if self.on_error and not self.stopped.is_set():
+                    self.on_error(exc)
+            with self.lock:
+                was_connected = self.connected
+                self.connected = False
+            if self.stopped.is_set():
+                return
+            if was_connected:
+                self.reconnects += 1
+                # Poll on the normal schedule until the feed is back.
+                if self.on_gap:
+                    self.on_gap()
+            self.failures += 1
+            self.stopped.wait(min(MAX_BACKOFF, 2 ** (self.failures - 1)))
+
+    def start(self) -> threading.Thread:
+        self.thread = threading.Thread(target=self.run, name='change-feed', daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def status(self) -> dict:
+        with self.lock:
+            connected = self.connected
+        return {
+            'connected': connected,
+            'events': self.events,
+            'batches': self.batches,
+            'reconnects': self.reconnects,
+        }
@@ -0,0 +1,140 @@
+"""JSON encoding and compressed transfer for the bot's HTTP calls.
+
+``loads``/``dumps`` work on bytes and use ``orjson`` when it is installed,
+falling back to the stdlib ``json`` module. ``ACCEPT_ENCODING`` advertises
+gzip, plus brotli when the ``brotli`` package is installed; ``decompress``
+and ``open_stream`` undo whichever ``Content-Encoding`` the server chose.
+
+``iter_array`` parses a top-level JSON array incrementally from a stream,
+yielding one element at a time, so a large result set can be processed
+(and abandoned early) without holding the whole body or the whole list.
+"""
+
+import codecs
+import gzip
+import json
+import zlib
+from typing import Iterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPT_ENCODING = 'gzip, br' if brotli else 'gzip'
+CHUNK_SIZE = 64 * 1024
+JSON_BACKEND = 'orjson' if orjson else 'json'
+
+
+def loads(data: bytes) -> object:
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value: object) -> bytes:
+    if orjson:
+        # Non-str dict keys (e.g. ints) are stringified like the stdlib does.
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value).encode('utf-8')
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return data
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.decompress(data)
+    if encoding == 'deflate':
+        return zlib.decompress(data)
+    if encoding == 'br' and brotli:
+        return brotli.decompress(data)
+    raise ValueError(f'Unsupported Content-Encoding: {encoding}')
+
+
+class _BrotliStream:
+    def __init__(self, raw) -> None:
+        self.raw = raw
+        self.decompressor = brotli.Decompressor()
+
+    def read(self, size: int = -1) -> bytes:
+        while True:
+            chunk = self.raw.read(CHUNK_SIZE)
+            if not chunk:
+                return b''
+            data = self.decompressor.process(chunk)
+            if data:
+                return data
+
+
+def open_stream(resp):
+    """A readable stream of the decoded body of ``resp``."""
+    encoding = (resp.headers.get('Content-Encoding') or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return resp
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.GzipFile(fileobj=resp)
+    if encoding == 'br' and brotli:
+        return _BrotliStream(resp)
+    raise ValueError(f'Unsupported Content-Encoding: {encoding}')
+
+
+def iter_array(stream, chunk_size: int = CHUNK_SIZE) -> Iterator[object]:
+    """Yield the elements of the JSON array read from ``stream``. A body that is not
+    an array (e.g. an error object) is yielded whole."""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        if eof:
+            return False
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + text.decode(chunk or b'', final=eof)
+        position = 0
+        return True
+
+    def skip(chars: str) -> None:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in chars:
+                position += 1
+            if position < len(buffer) or not fill():
+                return
+
+    skip(' \t\r\n')
+    if position >= len(buffer):
+        return
+    if buffer[position] != '[':
+        while fill():
+            pass
+        yield decoder.decode(buffer[position:])
+        return
+    position += 1
+    while True:
+        skip(' \t\r\n,')
+        if position >= len(buffer):
+            raise ValueError('Unterminated JSON array')
+        if buffer[position] == ']':
+            return
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # A number at the end of the buffer may continue in the next chunk.
+                if end < len(buffer) or eof:
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+        position = end
+        yield value
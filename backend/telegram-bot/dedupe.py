@@ -0,0 +1,169 @@
+"""Near-duplicate detection for incoming complaints.
+
+Complaint text is normalised, cut into character shingles and summarised by
+a MinHash signature. Signatures are split into LSH bands so a lookup only
+compares against complaints sharing at least one band; candidates are then
+confirmed by exact shingle Jaccard similarity and by sharing an area token
+(postal code or block number) with the incoming text, so similar wording about
+a different block never matches.
+"""
+
+import re
+import threading
+import zlib
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+_POSTAL = re.compile(r'\b(?:s\s*)?(\d{6})\b')
+_BLOCK = re.compile(r'\b(?:blk|block|bk)\.?\s*#?(\d{1,4}[a-z]?)\b')
+
+
+def _permutations(count: int, seed: int = 1) -> List[Tuple[int, int]]:
+    # Deterministic LCG so signatures stay comparable across restarts.
+    state = seed
+    params = []
+    for _ in range(count):
+        state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+        a = (state >> 3) % (MERSENNE_PRIME - 1) + 1
+        state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+        b = (state >> 3) % MERSENNE_PRIME
+        params.append((a, b))
+    return params
+
+
+PERMUTATIONS = _permutations(NUM_PERM)
+
+
+# Address abbreviations residents use interchangeably with the full word.
+ABBREVIATIONS = {
+    'blk': 'block', 'bk': 'block', 'ave': 'avenue', 'av': 'avenue', 'st': 'street', 'rd': 'road',
+    'dr': 'drive', 'cres': 'crescent', 'ctr': 'centre', 'center': 'centre', 'nr': 'near', 'opp': 'opposite',
+    'mscp': 'carpark', 'cp': 'carpark', 'lvl': 'level', 'flr': 'floor',
+}
+STOPWORDS = {'the', 'a', 'an', 'at', 'is', 'are', 'of', 'in', 'on', 'there', 'my', 'please'}
+
+
+def normalise(text: str) -> str:
+    words = re.sub(r'[^a-z0-9]+', ' ', (text or '').lower()).split()
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words if word not in STOPWORDS)
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> FrozenSet[int]:
+    value = normalise(text)
+    if len(value) <= size:
+        return frozenset({zlib.crc32(value.encode('utf-8'))}) if value else frozenset()
+    return frozenset(zlib.crc32(value[i:i + size].encode('utf-8')) for i in range(len(value) - size + 1))
+
+
+def minhash(shingle_set: FrozenSet[int]) -> Tuple[int, ...]:
+    if not shingle_set:
+        return tuple([MAX_HASH] * NUM_PERM)
+    return tuple(
+        min(((a * value + b) % MERSENNE_PRIME) & MAX_HASH for value in shingle_set)
+        for a, b in PERMUTATIONS
+    )
+
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def area_tokens(text: str) -> Set[str]:
+    """Postal codes and block numbers mentioned in free text or a location label."""
+    value = (text or '').lower()
+    tokens = {f'postal:{match}' for match in _POSTAL.findall(value)}
+    tokens.update(f'blk:{match}' for match in _BLOCK.findall(value))
+    return tokens
+
+
+class Entry:
+    __slots__ = ('row', 'shingles', 'signature', 'areas')
+
+    def __init__(self, row: dict, shingle_set: FrozenSet[int], signature: Tuple[int, ...], areas: Set[str]) -> None:
+        self.row = row
+        self.shingles = shingle_set
+        self.signature = signature
+        self.areas = areas
+
+
+class NearDuplicateIndex:
+    """Rolling MinHash/LSH index of open complaints, keyed by complaint id."""
+
+    def __init__(self, threshold: float = 0.5) -> None:
+        self.threshold = threshold
+        self.entries: Dict[str, Entry] = {}
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _bands(self, signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        return [(band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def add(self, row: dict) -> None:
+        complaint_id = row.get('id')
+        if not complaint_id:
+            return
+        text = f"{row.get('text') or ''} {row.get('location_label') or ''}"
+        shingle_set = shingles(text)
+        if not shingle_set:
+            return
+        entry = Entry(row, shingle_set, minhash(shingle_set), area_tokens(text))
+        with self.lock:
+            self._remove(complaint_id)
+            self.entries[complaint_id] = entry
+            for key in self._bands(entry.signature):
+                self.buckets.setdefault(key, set()).add(complaint_id)
+
+    def _remove(self, complaint_id: str) -> None:
+        entry = self.entries.pop(complaint_id, None)
+        if entry is None:
+            return
+        for key in self._bands(entry.signature):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(complaint_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def remove(self, complaint_id: str) -> None:
+        with self.lock:
+            self._remove(complaint_id)
+
+    def prune(self, keep) -> int:
+        """Drop entries whose row fails ``keep(row)``; returns how many were dropped."""
+        with self.lock:
+            stale = [complaint_id for complaint_id, entry in self.entries.items() if not keep(entry.row)]
+            for complaint_id in stale:
+                self._remove(complaint_id)
+        return len(stale)
+
+    def match(self, text: str) -> Optional[Tuple[dict, float]]:
+        """Best open complaint in the same area whose similarity clears the threshold."""
+        shingle_set = shingles(text)
+        areas = area_tokens(text)
+        if not shingle_set or not areas:
+            return None
+        signature = minhash(shingle_set)
+        with self.lock:
+            candidates: Set[str] = set()
+            for key in self._bands(signature):
+                candidates.update(self.buckets.get(key, ()))
+            best: Optional[Tuple[dict, float]] = None
+            for complaint_id in candidates:
+                entry = self.entries[complaint_id]
+                if not entry.areas & areas:
+                    continue
+                score = jaccard(shingle_set, entry.shingles)
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (entry.row, score)
+        return best
@@ -0,0 +1,113 @@
+"""Coalesce notifications bound for the same chat into digest messages.
+
+Messages queued during a notification tick are grouped per chat and sent as
+one message (or a few, split at Telegram's length limit) when the tick is
+flushed. ``max_hold`` lets a chat's queue wait across ticks for more messages,
+but never longer than that many seconds after its first message was queued.
+``add`` and ``flush`` may be called from different threads.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from messages import TELEGRAM_MESSAGE_LIMIT
+
+MAX_SEND_ATTEMPTS = 3
+
+
+def pack_messages(messages: List[str], separator: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[List[str]]:
+    """Greedily group messages so each joined group stays within ``limit``.
+    A single message longer than the limit gets a group of its own."""
+    groups: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    for message in messages:
+        extra = len(message) + (len(separator) if current else 0)
+        if current and size + extra > limit:
+            groups.append(current)
+            current, size = [], 0
+            extra = len(message)
+        current.append(message)
+        size += extra
+    if current:
+        groups.append(current)
+    return groups
+
+
+class DigestCoalescer:
+    def __init__(
+        self,
+        send: Callable[[int, str], None],
+        max_hold: float = 0.0,
+        separator: str = '\n\n———\n\n',
+        header: Optional[Callable[[int], str]] = None,
+        limit: int = TELEGRAM_MESSAGE_LIMIT,
+        on_error: Optional[Callable[[int, Exception], None]] = None,
+    ) -> None:
+        self.send = send
+        self.max_hold = max_hold
+        self.separator = separator
+        self.header = header
+        self.limit = limit
+        self.on_error = on_error
+        self.pending: Dict[int, List[str]] = {}
+        self.first_queued: Dict[int, float] = {}
+        self.attempts: Dict[int, int] = {}
+        self.lock = threading.Lock()
+        # Held while sending, so two flushes cannot deliver a chat's messages out of order.
+        self.send_lock = threading.Lock()
+
+    def add(self, chat_id: int, text: str, now: Optional[float] = None) -> None:
+        with self.lock:
+            self.pending.setdefault(chat_id, []).append(text)
+            self.first_queued.setdefault(chat_id, time.time() if now is None else now)
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return sum(len(messages) for messages in self.pending.values())
+
+    def chunks(self, messages: List[str]) -> List[Tuple[str, List[str]]]:
+        """The texts to send for a chat queue, each with the messages it carries."""
+        if len(messages) == 1:
+            return [(messages[0], list(messages))]
+        prefix = self.header(len(messages)) if self.header else ''
+        budget = self.limit - len(prefix)
+        return [(prefix + self.separator.join(group), group) for group in pack_messages(messages, self.separator, budget)]
+
+    def render(self, messages: List[str]) -> List[str]:
+        return [text for text, _ in self.chunks(messages)]
+
+    def flush(self, now: Optional[float] = None, force: bool = False) -> int:
+        """Send every chat queue that is due. Returns the number of messages sent."""
+        now = time.time() if now is None else now
+        sent = 0
+        with self.send_lock:
+            with self.lock:
+                due = {
+                    chat_id: self.pending.pop(chat_id) for chat_id in list(self.pending)
+                    if force or now - self.first_queued.get(chat_id, now) >= self.max_hold
+                }
+                for chat_id in due:
+                    self.first_queued.pop(chat_id, None)
+            for chat_id, messages in due.items():
+                unsent: List[str] = []
+                chunks = self.chunks(messages)
+                for index, (text, _) in enumerate(chunks):
+                    try:
+                        self.send(chat_id, text)
+                        sent += 1
+                    except Exception as exc:
+                        if self.on_error:
+                            self.on_error(chat_id, exc)
+                        # The failed chunk and the ones after it; chunks already delivered are not re-sent.
+                        unsent = [message for _, group in chunks[index:] for message in group]
+                        break
+                with self.lock:
+                    attempts = self.attempts.pop(chat_id, 0) + 1
+                    if unsent and attempts < MAX_SEND_ATTEMPTS:
+                        # Retry on the next flush, ahead of anything queued since.
+                        self.pending[chat_id] = unsent + self.pending.get(chat_id, [])
+                        self.first_queued[chat_id] = now - self.max_hold
+                        self.attempts[chat_id] = attempts
+        return sent
@@ -0,0 +1,274 @@
+"""Leader election for work that must run on exactly one replica.
+
+Replicas compete for a named, time-bounded lease. The holder renews it every
+third of the lease period; a standby retries more often than that, so when a
+leader dies its lease lapses and a standby takes over within one lease period
+(plus one retry interval). A leader that cannot renew stops acting as leader
+at 80% of the period, before any standby can win, so two replicas never act
+as leader at once as long as clocks agree to within the remaining margin.
+
+The lease row also carries the leader's state (feed watermarks and the ids
+handled at them). It is written with every renewal and after each batch, and
+handed to the next leader on election so it resumes where the last one
+stopped. A leader that dies after sending a batch but before saving it can
+cause that one batch to be re-sent.
+
+Two backends:
+
+- ``PostgrestLease``: a ``bot_leases`` row taken with a conditional PATCH
+  (``expires_at`` in the past, or already ours) through PostgREST.
+- ``AdvisoryLease``: a Postgres session advisory lock over a direct
+  connection (needs ``psycopg``). The lock is released by the server when the
+  holder's session ends; put TCP keepalive settings in the DSN so a
+  partitioned holder is noticed quickly. State is kept in ``bot_leases`` too.
+"""
+
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+# Fraction of the lease period a leader trusts its last successful renewal.
+SAFETY_MARGIN = 0.8
+
+
+def _iso(ts: datetime) -> str:
+    return ts.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class PostgrestLease:
+    def __init__(self, name: str, base_url: str, api_key: str, request: Callable[..., object]) -> None:
+        """``request(url, method=..., headers=..., body=...)`` performs one HTTP call and returns parsed JSON."""
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.request = request
+        self.row_exists = False
+
+    def _headers(self, prefer: str) -> dict:
+        return {
+            'apikey': self.api_key,
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+            'Prefer': prefer,
+        }
+
+    def _patch(self, filters: str, body: dict) -> list:
+        url = f"{self.base_url}/rest/v1/bot_leases?name=eq.{urllib.parse.quote(self.name)}&{filters}"
+        rows = self.request(url, method='PATCH', headers=self._headers('return=representation'), body=body)
+        return rows if isinstance(rows, list) else []
+
+    def _owned_by(self, owner: str) -> str:
+        return f'owner=eq.{urllib.parse.quote(owner)}'
+
+    def acquire(self, owner: str, ttl: float) -> Optional[dict]:
+        """Take the lease if it is free or already ours; returns the stored state, or None if held elsewhere."""
+        now = datetime.now(timezone.utc)
+        expires = _iso(now + timedelta(seconds=ttl))
+        condition = urllib.parse.quote(f'(expires_at.lt."{_iso(now)}",owner.eq."{owner}")', safe='(),.')
+        rows = self._patch(f'or={condition}', {'owner': owner, 'expires_at': expires, 'acquired_at': _iso(now)})
+        if not rows and not self.row_exists:
+            # First use: create the row; an existing row is left alone.
+            rows = self.request(
+                f"{self.base_url}/rest/v1/bot_leases?on_conflict=name",
+                method='POST',
+                headers=self._headers('resolution=ignore-duplicates,return=representation'),
+                body={'name': self.name, 'owner': owner, 'expires_at': expires, 'acquired_at': _iso(now)},
+            )
+            rows = rows if isinstance(rows, list) else []
+            self.row_exists = True
+        if not rows:
+            return None
+        return rows[0].get('state') or {}
+
+    def renew(self, owner: str, ttl: float, state: Optional[dict] = None) -> bool:
+        """Extend the lease (and save ``state``) only if we still hold it."""
+        body: dict = {'expires_at': _iso(datetime.now(timezone.utc) + timedelta(seconds=ttl))}
+        if state is not None:
+            body['state'] = state
+        return bool(self._patch(self._owned_by(owner), body))
+
+    def release(self, owner: str, state: Optional[dict] = None) -> None:
+        body: dict = {'expires_at': _iso(datetime.now(timezone.utc) - timedelta(seconds=1))}
+        if state is not None:
+            body['state'] = state
+        self._patch(self._owned_by(owner), body)
+
+
+def _jsonb(value: Optional[dict]):
+    from psycopg.types.json import Jsonb
+    return None if value is None else Jsonb(value)
+
+
+class AdvisoryLease:
+    def __init__(self, name: str, dsn: str) -> None:
+        try:
+            import psycopg  # noqa: F401
+        except ImportError as exc:
+            raise RuntimeError('AdvisoryLease needs the psycopg package (pip install psycopg).') from exc
+        self.name = name
+        self.dsn = dsn
+        self.conn = None
+
+    def _connect(self):
+        import psycopg
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg.connect(self.dsn, autocommit=True)
+        return self.conn
+
+    def _drop(self) -> None:
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+
+    def acquire(self, owner: str, ttl: float) -> Optional[dict]:
+        try:
+            conn = self._connect()
+            if not conn.execute('select pg_try_advisory_lock(hashtext(%s))', (self.name,)).fetchone()[0]:
+                return None
+            row = conn.execute('select state from public.bot_leases where name = %s', (self.name,)).fetchone()
+        except Exception:
+            self._drop()
+            raise
+        self._write(owner, ttl, None)
+        return (row[0] if row else None) or {}
+
+    def _write(self, owner: str, ttl: float, state: Optional[dict]) -> None:
+        self.conn.execute(
+            'insert into public.bot_leases (name, owner, expires_at, acquired_at, state) '
+            "values (%(name)s, %(owner)s, now() + make_interval(secs => %(ttl)s), now(), coalesce(%(state)s, '{}'::jsonb)) "
+            'on conflict (name) do update set owner = excluded.owner, expires_at = excluded.expires_at, '
+            'state = coalesce(%(state)s, public.bot_leases.state)',
+            {'name': self.name, 'owner': owner, 'ttl': ttl, 'state': _jsonb(state)},
+        )
+
+    def renew(self, owner: str, ttl: float, state: Optional[dict] = None) -> bool:
+        # The lock lives as long as the session: a working connection means we still hold it.
+        if self.conn is None:
+            return False
+        try:
+            self._write(owner, ttl, state)
+            return True
+        except Exception:
+            self._drop()
+            return False
+
+    def release(self, owner: str, state: Optional[dict] = None) -> None:
+        if self.conn is None:
+            return
+        try:
+            self.conn.execute(
+                'update public.bot_leases set expires_at = now(), state = coalesce(%s, state) where name = %s',
+                (_jsonb(state), self.name),
+            )
+            self.conn.execute('select pg_advisory_unlock(hashtext(%s))', (self.name,))
+        finally:
+            self._drop()
+
+
+class LeaderElector:
+    def __init__(
+        self,
+        lease,
+        owner: str,
+        ttl: float,
+        state: Callable[[], dict],
+        on_elected: Optional[Callable[[dict], None]] = None,
+        on_demoted: Optional[Callable[[], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+    ) -> None:
+        """``state()`` returns the leader's current state for saving; ``on_elected(saved_state)``
+        restores it on the new leader."""
+        self.lease = lease
+        self.owner = owner
+        self.ttl = ttl
+        self.state = state
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.on_error = on_error
+        self.lock = threading.Lock()
+        self.held_until = 0.0
+        self.leading = False
+        self.elections = 0
+        self.stopped = threading.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.leading and time.monotonic() < self.held_until
+
+    def _held(self, started: float) -> None:
+        self.held_until = started + self.ttl * SAFETY_MARGIN
+
+    def step(self) -> None:
+        """Renew while leading, otherwise try to take the lease."""
+        with self.lock:
+            started = time.monotonic()
+            try:
+                if self.leading:
+                    if self.lease.renew(self.owner, self.ttl, self.state()):
+                        self._held(started)
+                else:
+                    saved = self.lease.acquire(self.owner, self.ttl)
+                    if saved is not None:
+                        self._held(started)
+                        self.leading = True
+                        self.elections += 1
+                        if self.on_elected:
+                            self.on_elected(saved)
+            except Exception as exc:
+                if self.on_error:
+                    self.on_error(exc)
+            if self.leading and time.monotonic() >= self.held_until:
+                self.leading = False
+                if self.on_demoted:
+                    self.on_demoted()
+
+    def save(self) -> bool:
+        """Write the current state now (after a batch); returns False when not leading."""
+        if not self.is_leader:
+            return False
+        with self.lock:
+            started = time.monotonic()
+            try:
+                if self.lease.renew(self.owner, self.ttl, self.state()):
+                    self._held(started)
+                    return True
+            except Exception as exc:
+                if self.on_error:
+                    self.on_error(exc)
+            return False
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            self.step()
+            self.stopped.wait(self.ttl / 3 if self.leading else self.ttl / 5)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name='leader-election', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        """Stop competing and hand the lease over immediately if we hold it."""
+        self.stopped.set()
+        with self.lock:
+            if not self.leading:
+                return
+            self.leading = False
+            try:
+                self.lease.release(self.owner, self.state())
+            except Exception as exc:
+                if self.on_error:
+                    self.on_error(exc)
+
+    def status(self) -> dict:
+        return {
+            'owner': self.owner,
+            'leader': self.is_leader,
+            'held_for': max(0.0, self.held_until - time.monotonic()) if self.is_leader else None,
+            'elections': self.elections,
+        }
@@ -0,0 +1,141 @@
+"""Priority-aware concurrency limiter for agent calls.
+
+At most ``max_in_flight`` calls run at once. Callers that find every slot busy
+wait in a bounded queue for their priority class; when a slot frees up the
+oldest waiter of the highest class gets it. A waiter gives up (is shed) when
+its class queue is full, when the expected wait already exceeds its deadline,
+or when the deadline passes, so callers can answer quickly instead of piling
+on a saturated upstream.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics import Histogram
+
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+HOLD_SMOOTHING = 0.2
+
+
+class LimiterBusy(RuntimeError):
+    def __init__(self, priority: str, reason: str) -> None:
+        super().__init__(f'{priority} call shed: {reason}')
+        self.priority = priority
+        self.reason = reason
+
+
+class PriorityClass:
+    __slots__ = ('name', 'rank', 'queue_limit', 'max_wait', 'queued', 'admitted', 'shed', 'waits')
+
+    def __init__(self, name: str, rank: int, queue_limit: int, max_wait: float) -> None:
+        self.name = name
+        self.rank = rank
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self.queued = 0
+        self.admitted = 0
+        self.shed: Dict[str, int] = {}
+        self.waits = Histogram(WAIT_BUCKETS)
+
+
+class PriorityLimiter:
+    def __init__(self, max_in_flight: int, classes: List[Tuple[str, int, float]]) -> None:
+        """``classes`` is ``[(name, queue_limit, max_wait_seconds), ...]``, highest priority first."""
+        self.max_in_flight = max(1, max_in_flight)
+        self.classes = {
+            name: PriorityClass(name, rank, queue_limit, max_wait)
+            for rank, (name, queue_limit, max_wait) in enumerate(classes)
+        }
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting: List[list] = []
+        self.sequence = itertools.count()
+        self.avg_hold: Optional[float] = None
+
+    def _shed(self, cls: PriorityClass, reason: str) -> LimiterBusy:
+        cls.shed[reason] = cls.shed.get(reason, 0) + 1
+        return LimiterBusy(cls.name, reason)
+
+    def _expected_wait(self, cls: PriorityClass) -> float:
+        if self.avg_hold is None:
+            return 0.0
+        ahead = sum(1 for entry in self.waiting if entry[0] <= cls.rank)
+        return (ahead + 1) * self.avg_hold / self.max_in_flight
+
+    def acquire(self, priority: str) -> float:
+        """Take a slot, waiting if needed; returns seconds waited or raises LimiterBusy."""
+        cls = self.classes[priority]
+        started = time.monotonic()
+        with self.cond:
+            if self.in_flight < self.max_in_flight and not self.waiting:
+                self.in_flight += 1
+                cls.admitted += 1
+                cls.waits.observe(0.0)
+                return 0.0
+            if cls.queued >= cls.queue_limit:
+                raise self._shed(cls, 'queue_full')
+            if self._expected_wait(cls) > cls.max_wait:
+                raise self._shed(cls, 'deadline')
+
+            entry = [cls.rank, next(self.sequence)]
+            heapq.heappush(self.waiting, entry)
+            cls.queued += 1
+            deadline = started + cls.max_wait
+            try:
+                while True:
+                    if self.waiting[0] is entry and self.in_flight < self.max_in_flight:
+                        heapq.heappop(self.waiting)
+                        self.in_flight += 1
+                        waited = time.monotonic() - started
+                        cls.admitted += 1
+                        cls.waits.observe(waited)
+                        # The next waiter may also fit if several slots freed at once.
+                        self.cond.notify_all()
+                        return waited
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.waiting.remove(entry)
+                        heapq.heapify(self.waiting)
+                        self.cond.notify_all()
+                        raise self._shed(cls, 'timeout')
+                    self.cond.wait(remaining)
+            finally:
+                cls.queued -= 1
+
+    def release(self, held: float) -> None:
+        with self.cond:
+            self.in_flight -= 1
+            self.avg_hold = held if self.avg_hold is None else self.avg_hold + HOLD_SMOOTHING * (held - self.avg_hold)
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str) -> Iterator[float]:
+        waited = self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - started)
+
+    def status(self) -> List[dict]:
+        with self.cond:
+            return [
+                {
+                    'priority': cls.name,
+                    'in_flight': self.in_flight,
+                    'queued': cls.queued,
+                    'admitted': cls.admitted,
+                    'shed': sum(cls.shed.values()),
+                    'shed_by_reason': dict(cls.shed),
+                    'wait_p50': cls.waits.quantile(0.5),
+                    'wait_p99': cls.waits.quantile(0.99),
+                    'wait_buckets': cls.waits.cumulative(),
+                    'wait_sum': cls.waits.total,
+                    'wait_count': cls.waits.count,
+                }
+                for cls in sorted(self.classes.values(), key=lambda cls: cls.rank)
+            ]
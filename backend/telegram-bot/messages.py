@@ -0,0 +1,413 @@
+"""Telegram message templates with context-aware escaping.
+
+Templates are compiled once at import: the literal markup is validated against
+Telegram's entity rules, and every ``{field}`` is escaped for the template's
+parse mode when rendered. ``{field:raw}`` inserts an already-rendered fragment
+(e.g. the output of another template) unchanged. Because the literal markup is
+known-valid and interpolated values are always escaped, rendered messages parse
+on the first send and never need a plain-text retry.
+"""
+
+import html
+import re
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_CAPTION_LIMIT = 1024
+
+HTML_TAGS = {
+    'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'code', 'pre', 'a',
+    'tg-spoiler', 'span', 'blockquote', 'tg-emoji',
+}
+MARKDOWN_V2_RESERVED = '_*[]()~`>#+-=|{}.!\\'
+
+_HTML_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)((?:\s+[^<>]*)?)>')
+_HTML_ENTITY_RE = re.compile(r'&(?:#\d+|#x[0-9a-fA-F]+|lt|gt|amp|quot);')
+_MARKDOWN_V2_ESCAPE_RE = re.compile('([' + re.escape(MARKDOWN_V2_RESERVED) + '])')
+
+
+def escape_html(value) -> str:
+    return html.escape(str(value), quote=False)
+
+
+def escape_markdown_v2(value, entity: Optional[str] = None) -> str:
+    text = str(value)
+    if entity in ('code', 'pre'):
+        return text.replace('\\', '\\\\').replace('`', '\\`')
+    if entity == 'url':
+        return text.replace('\\', '\\\\').replace(')', '\\)')
+    return _MARKDOWN_V2_ESCAPE_RE.sub(r'\\\1', text)
+
+
+def validate_html(text: str) -> List[str]:
+    """Return the problems Telegram would reject in an HTML-formatted message."""
+    errors: List[str] = []
+    stack: List[str] = []
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char == '<':
+            match = _HTML_TAG_RE.match(text, pos)
+            if not match:
+                errors.append(f'unescaped "<" at {pos}')
+                pos += 1
+                continue
+            closing, tag, attrs = match.group(1), match.group(2).lower(), match.group(3)
+            if tag not in HTML_TAGS:
+                errors.append(f'unsupported tag <{tag}> at {pos}')
+            elif closing:
+                if not stack or stack[-1] != tag:
+                    errors.append(f'unexpected </{tag}> at {pos}')
+                else:
+                    stack.pop()
+            else:
+                if stack and stack[-1] in ('code', 'pre') and not (stack[-1] == 'pre' and tag == 'code'):
+                    errors.append(f'<{tag}> nested inside <{stack[-1]}> at {pos}')
+                if tag == 'a' and 'href=' not in attrs:
+                    errors.append(f'<a> without href at {pos}')
+                stack.append(tag)
+            pos = match.end()
+            continue
+        if char == '&':
+            match = _HTML_ENTITY_RE.match(text, pos)
+            if not match:
+                errors.append(f'unescaped "&" at {pos}')
+                pos += 1
+                continue
+            pos = match.end()
+            continue
+        if char == '>':
+            errors.append(f'unescaped ">" at {pos}')
+        pos += 1
+    for tag in reversed(stack):
+        errors.append(f'unclosed <{tag}>')
+    return errors
+
+
+def validate_markdown_v2(text: str) -> List[str]:
+    """Return the problems Telegram would reject in a MarkdownV2-formatted message."""
+    errors: List[str] = []
+    open_entities: List[str] = []
+    pos = 0
+    in_code = False
+    while pos < len(text):
+        char = text[pos]
+        if char == '\\':
+            if pos + 1 >= len(text):
+                errors.append('trailing backslash')
+            pos += 2
+            continue
+        if in_code:
+            if text.startswith('```', pos) and open_entities[-1] == '```':
+                open_entities.pop()
+                in_code = False
+                pos += 3
+                continue
+            if char == '`' and open_entities[-1] == '`':
+                open_entities.pop()
+                in_code = False
+            pos += 1
+            continue
+        if text.startswith('```', pos) or char == '`':
+            marker = '```' if text.startswith('```', pos) else '`'
+            open_entities.append(marker)
+            in_code = True
+            pos += len(marker)
+            continue
+        marker = None
+        for candidate in ('__', '||', '*', '_', '~'):
+            if text.startswith(candidate, pos):
+                marker = candidate
+                break
+        if marker:
+            if open_entities and open_entities[-1] == marker:
+                open_entities.pop()
+            else:
+                open_entities.append(marker)
+            pos += len(marker)
+            continue
+        if char == '[':
+            open_entities.append('[')
+            pos += 1
+            continue
+        if char == ']' and open_entities and open_entities[-1] == '[':
+            open_entities.pop()
+            if not text.startswith('(', pos + 1):
+                errors.append(f'link text without url at {pos}')
+                pos += 1
+                continue
+            end = pos + 2
+            while end < len(text) and text[end] != ')':
+                end += 2 if text[end] == '\\' else 1
+            if end >= len(text):
+                errors.append(f'unterminated link url at {pos}')
+            pos = end + 1
+            continue
+        if char in MARKDOWN_V2_RESERVED:
+            errors.append(f'unescaped "{char}" at {pos}')
+        pos += 1
+    for marker in reversed(open_entities):
+        errors.append(f'unclosed "{marker}"')
+    return errors
+
+
+def to_plain_text(text: str, parse_mode: Optional[str]) -> str:
+    if parse_mode == 'HTML':
+        return html.unescape(_HTML_TAG_RE.sub('', text))
+    if parse_mode == 'MarkdownV2':
+        return re.sub(r'\\(.)', r'\1', re.sub(r'(?<!\\)(\*|__|_|~|\|\||`)', '', text))
+    return text
+
+
+def validate(text: str, parse_mode: Optional[str], limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    errors: List[str] = []
+    if parse_mode == 'HTML':
+        errors = validate_html(text)
+    elif parse_mode == 'MarkdownV2':
+        errors = validate_markdown_v2(text)
+    if not errors and len(to_plain_text(text, parse_mode)) > limit:
+        errors.append(f'text longer than {limit} characters')
+    return errors
+
+
+class MessageTemplate:
+    """A compiled template; ``render(**values)`` escapes each value for ``parse_mode``."""
+
+    def __init__(self, source: str, parse_mode: str = 'HTML') -> None:
+        self.source = source
+        self.parse_mode = parse_mode
+        self.parts: List[Tuple[str, Optional[str], bool]] = []
+        for literal, field, spec, _ in Formatter().parse(source):
+            if field is not None and spec not in ('', 'raw'):
+                raise ValueError(f'Unsupported format spec {spec!r} in template')
+            self.parts.append((literal, field or None, spec == 'raw'))
+        errors = validate(''.join(literal for literal, _, _ in self.parts), parse_mode)
+        if errors:
+            raise ValueError(f'Invalid {parse_mode} template {source[:40]!r}: {"; ".join(errors)}')
+
+    def escape(self, value) -> str:
+        if value is None:
+            value = ''
+        if self.parse_mode == 'HTML':
+            return escape_html(value)
+        if self.parse_mode == 'MarkdownV2':
+            return escape_markdown_v2(value)
+        return str(value)
+
+    def render(self, **values) -> str:
+        out = []
+        for literal, field, raw in self.parts:
+            out.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            out.append(str(value) if raw else self.escape(value))
+        return ''.join(out)
+
+
+_CATALOGUE: Dict[str, str] = {
+    'dispatch': (
+        "🚨 <b>Dispatch Update</b>\n\n"
+        "Team: <b>{team}</b>\n"
+        "Run Sheet: <code>{run_sheet}</code>\n"
+        "Date: {date}\n"
+        "Window: {time_window}\n"
+        "Tasks: {tasks}\n"
+        "Zones: {zones}\n"
+        "Issue: {task_summary}\n"
+        "Notes: {notes}\n"
+        "Capacity used: {capacity}\n\n"
+        "{route:raw}"
+        "Please acknowledge and proceed."
+    ),
+    'dispatch_digest_header': "📦 <b>{count} dispatch updates</b>\n\n",
+    'dispatch_route': "Route:\n{stops:raw}\n\n",
+    'dispatch_stop': "{index}. {eta} {category} — {label} ({task_type}, ~{duration}m)",
+    'evidence_resolved': (
+        "✅ <b>Your reported issue has been resolved!</b>\n\n"
+        "Issue: {category} — {desc}\n"
+        "Resolution notes: {notes}\n"
+        "Task reference: <code>{task_ref}</code>\n\n"
+        "Thank you for reporting this!"
+    ),
+    'photo_before': "📸 <b>Before</b> (task {task_ref})",
+    'photo_after': "✅ <b>After</b> (task {task_ref})",
+    'photo_pair': "📸 <b>Before</b> / ✅ <b>After</b> (task {task_ref})",
+    'complaint_resolved': (
+        "✅ <b>Your complaint has been resolved!</b>\n\n"
+        "📂 Category: {category}\n"
+        "📍 Location: {location}\n"
+        "🆔 ID: <code>{complaint_ref}</code>"
+        "{miniapp:raw}\n\n"
+        "Thank you for reporting this! 🌟"
+    ),
+    'miniapp_link': "\n\n📱 View details &amp; resolution photos:\n{url}",
+    'sla_header': "⏱ <b>Resolution SLA by {dimension}</b> (last {days}d)\n\np50 / p90 / p99 (n)",
+    'sla_row': "{key}: {p50} / {p90} / {p99} ({count})",
+    'sla_empty': "No resolved complaints in the last {days} day(s).",
+    'plan_header': "🗓 <b>Auto-plan {date}</b>{suffix}\n",
+    'plan_row': "{team} {window}: {count} tasks, {percent}% ({zones})",
+    'plan_empty': "No tasks could be planned.",
+    'plan_unassigned': "\n⚠️ {count} tasks left unassigned (no capacity).",
+    'health_header': "🩺 <b>Upstreams</b>\n\nstate (retry in) / ok / failed / rejected / opened",
+    'health_row': "{upstream}: {state} ({retry_in}) / {success} / {failure} / {rejected} / {opened}",
+    'agent_queue_header': "\n🤖 <b>Agent queue</b>\n\nwaiting / admitted / shed, wait p50 / p99",
+    'agent_queue_row': "{priority}: {queued} / {admitted} / {shed}, {p50} / {p99}",
+    'profile_disabled': "Profiling is disabled. Set PROFILE_ENABLED=1 to allow it.",
+    'profile_busy': "A profile is already running.",
+    'profile_started': "🔬 Profiling for {seconds}s at {hz} Hz…",
+    'profile_done': "🔬 <b>Profile ready</b> ({samples} samples)\n<code>{path}</code>\n\nHottest frames:\n{frames:raw}",
+    'profile_frame': "<code>{frame}</code> {count}",
+    'feeds_header': "📡 <b>Notification feeds</b>\n\ninterval / lag (avg) / events",
+    'feeds_row': "{feed}: {interval} / {lag} ({avg_lag}) / {events}, {errors} errors",
+    'feeds_role': "\nRole: {role} ({replica})",
+    'feeds_change_feed': "Change feed: {state}, {events} events, {reconnects} reconnects",
+    'autoplan_failed': "❌ Auto-plan failed: {error}",
+    'autoplan_usage': "⚠️ Usage: <code>/autoplan [YYYY-MM-DD] [dry]</code>",
+    'error': "❌ Error: {error}",
+    'db_not_configured': "❌ Database not configured.",
+    'complaint_not_found': "❌ Complaint not found.",
+    'complaint_status': (
+        "📋 <b>Complaint Status</b>\n\n"
+        "🆔 <code>{complaint_id}</code>\n"
+        "📊 Status: <b>{status}</b>\n"
+        "📂 Category: {category}\n"
+        "⚡ Severity: {severity}/5\n"
+        "📅 Submitted: {submitted}"
+    ),
+    'my_complaints_header': "📋 <b>Your Recent Complaints</b>\n\n",
+    'my_complaints_row': "{index}. {preview}...\n   🆔 <code>{complaint_ref}</code> | {status}\n\n",
+    'no_complaints': "You have no complaints on record.",
+    'evidence_timeout': "⏰ Evidence session timed out. Use <code>/evidence &lt;task_id&gt;</code> to start again.",
+    'photo_unreadable': "⚠️ Could not read the photo. Please try again.",
+    'photo_downloading': "⏳ Downloading photo...",
+    'photo_download_failed': "⚠️ Failed to download photo: {error}",
+    'before_received': "✅ Before photo received.\n\nNow please send the <b>AFTER</b> photo.",
+    'evidence_uploading': "⏳ Uploading evidence...",
+    'evidence_submitted': (
+        "✅ <b>Evidence submitted successfully!</b>\n\n"
+        "Task: <code>{task_ref}</code> ({task_type})\n"
+        "Issue: {desc}\n"
+        "Status: PENDING REVIEW\n\n"
+        "A supervisor will verify and close the task."
+    ),
+    'evidence_upload_failed': (
+        "⚠️ Failed to upload evidence: {error}\n\n"
+        "Please try again with <code>/evidence &lt;task_id&gt;</code>."
+    ),
+    'evidence_photo_hint': "To upload evidence photos, first start with:\n<code>/evidence &lt;task_id&gt;</code>",
+    'welcome': (
+        "👋 <b>Welcome to Lulu Town Council Bot!</b>\n\n"
+        "📝 /complaint - Submit a complaint\n"
+        "🔍 /status &lt;ID&gt; - Check complaint\n"
+        "📋 /mycomplaints - Your history\n"
+        "📸 /evidence &lt;task_id&gt; - Upload evidence\n"
+        "❓ /help - Show help"
+    ),
+    'help': (
+        "🆘 <b>Help &amp; Commands</b>\n\n"
+        "<b>Submit:</b> /complaint\n"
+        "<b>Check:</b> /status &lt;ID&gt;\n"
+        "<b>History:</b> /mycomplaints\n"
+        "<b>Evidence:</b> /evidence &lt;task_id&gt;\n"
+        "<b>Cancel:</b> /cancel\n\n"
+        "✅ Include location\n"
+        "✅ Be specific\n\n"
+        "Urgent? Call 6123-4567"
+    ),
+    'register': (
+        "✅ <b>Registration Complete</b>\n\n"
+        "Your chat_id is: <code>{chat_id}</code>\n\n"
+        "Share this ID with the dispatcher if needed."
+    ),
+    'dispatcher_only': "❌ This command is restricted to the dispatcher.",
+    'status_usage': "⚠️ Usage: <code>/status &lt;complaint_id&gt;</code>",
+    'unknown_user': "❌ Unable to identify user.",
+    'evidence_usage': (
+        "⚠️ Usage: <code>/evidence &lt;task_id_prefix&gt;</code>\n\n"
+        "Enter at least the first 8 characters of the task ID."
+    ),
+    'evidence_prefix_short': "⚠️ Please provide at least 8 characters of the task ID.",
+    'task_not_found': (
+        "❌ No scheduled task found matching <code>{prefix}</code>.\n\n"
+        "You can use a task ID or run sheet ID prefix."
+    ),
+    'evidence_started': (
+        "📋 <b>Evidence submission started</b>\n\n"
+        "Task: <code>{task_ref}</code>\n"
+        "Type: {task_type}\n"
+        "Issue: {category} — {desc}\n\n"
+        "📸 Please send the <b>BEFORE</b> photo now.\n"
+        "Type /cancel to abort."
+    ),
+    'cancelled': "🚫 Cancelled.",
+    'nothing_to_cancel': "No active session to cancel.",
+    'send_before': "📸 Please send a <b>BEFORE</b> photo, or type /cancel to abort.",
+    'send_after': "📸 Please send an <b>AFTER</b> photo, or type /cancel to abort.",
+    'complaint_started': (
+        "📝 <b>Complaint mode started</b>\n\n"
+        "Please describe your issue, including the location.\n"
+        "Type /cancel to abort."
+    ),
+    'processing': "⏳ Processing...",
+    'agent_reply': "{reply}",
+    'complaint_submitted': (
+        "✅ <b>Complaint Submitted!</b>\n\n"
+        "{reply}\n\n"
+        "{id_line:raw}"
+        "📱 /status &lt;id&gt;\n📋 /mycomplaints\n\nThank you! 🌟"
+    ),
+    'complaint_id_line': "🆔 Complaint ID: <code>{complaint_ref}</code>\n\n",
+    'duplicate_own': (
+        "ℹ️ <b>You've already reported this</b>\n\n"
+        "Complaint <code>{complaint_ref}</code> is {status}. "
+        "We'll message you when it's resolved.\n\n"
+        "📱 /status {complaint_ref}"
+    ),
+    'duplicate_linked': (
+        "✅ <b>Already being handled</b>\n\n"
+        "This matches a report of {category} at {location} that we're already working on. "
+        "We've added your report to it and will message you when it's resolved.\n\n"
+        "🆔 Complaint ID: <code>{complaint_ref}</code>\n\n"
+        "📱 /status &lt;id&gt;"
+    ),
+    'complaint_error': (
+        "⚠️ <b>Error</b>\n\n{error}\n\n"
+        "Your complaint has been queued. Urgent? Call 6123-4567."
+    ),
+    'replay_reply': "🔁 <b>Following up on your earlier message</b>\n\n{reply}",
+    'replay_submitted': (
+        "🔁 <b>Your earlier complaint has now been processed</b>\n\n"
+        "{reply}\n\n"
+        "{id_line:raw}"
+        "📱 /status &lt;id&gt;"
+    ),
+    'replay_already_submitted': (
+        "🔁 <b>Your earlier complaint was already recorded</b>\n\n"
+        "{id_line:raw}"
+        "📱 /status &lt;id&gt;"
+    ),
+    'replay_failed': (
+        "⚠️ We still couldn't process your earlier complaint. "
+        "Please send it again with /complaint. Urgent? Call 6123-4567."
+    ),
+    'agent_busy': (
+        "⏳ We're handling a lot of reports right now. Your message is saved and "
+        "we'll get back to you here shortly. Urgent? Call 6123-4567."
+    ),
+    'unknown_command': (
+        "I didn't understand that. Use one of these commands:\n\n"
+        "📝 /complaint - Submit a complaint\n"
+        "🔍 /status &lt;ID&gt; - Check complaint status\n"
+        "📋 /mycomplaints - View your complaints\n"
+        "📸 /evidence &lt;task_id&gt; - Upload evidence\n"
+        "❓ /help - Show all commands"
+    ),
+}
+
+TEMPLATES: Dict[str, MessageTemplate] = {name: MessageTemplate(source) for name, source in _CATALOGUE.items()}
+
+
+def render_message(name: str, **values) -> str:
+    return TEMPLATES[name].render(**values)
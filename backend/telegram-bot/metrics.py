@@ -0,0 +1,220 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms are labelled families updated inline; gauges are
+callbacks evaluated at scrape time, so they always read live state (session
+dicts, breaker state) instead of being kept in sync by hand. ``serve`` exposes
+the registry on ``/metrics`` from a daemon thread.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LAG_BUCKETS = (1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Fixed-bucket histogram (upper bounds in seconds, plus +Inf)."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None when empty or in +Inf)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        running = 0
+        rows = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            rows.append(('+Inf' if bound == float('inf') else f'{bound:g}', running))
+        return rows
+
+
+def _labels(values: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in values.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for key, value in labels:
+        escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class CounterFamily:
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Labels, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class HistogramFamily:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values: Dict[Labels, Histogram] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labels, histogram in sorted(self.values.items()):
+                lines.extend(render_histogram(self.name, labels, histogram))
+        return lines
+
+
+def render_histogram(name: str, labels: Labels, histogram: Histogram) -> List[str]:
+    lines = [
+        f'{name}_bucket{_format_labels(labels + (("le", bound),))} {count}'
+        for bound, count in histogram.cumulative()
+    ]
+    lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram.total)}')
+    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+    return lines
+
+
+class GaugeFamily:
+    """Gauge read at scrape time; ``collect`` returns ``[(labels, value), ...]``."""
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], List[Tuple[Dict[str, object], float]]]) -> None:
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for labels, value in self.collect():
+            if value is None:
+                continue
+            lines.append(f'{self.name}{_format_labels(_labels(labels))} {_format_value(value)}')
+        return lines
+
+
+class CollectedHistograms:
+    """Histograms owned elsewhere (e.g. the agent limiter), rendered at scrape time."""
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], List[Tuple[Dict[str, object], Histogram]]]) -> None:
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, histogram in self.collect():
+            lines.extend(render_histogram(self.name, _labels(labels), histogram))
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.families: List[object] = []
+
+    def counter(self, name: str, help_text: str) -> CounterFamily:
+        family = CounterFamily(name, help_text)
+        self.families.append(family)
+        return family
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> HistogramFamily:
+        family = HistogramFamily(name, help_text, buckets)
+        self.families.append(family)
+        return family
+
+    def gauge(self, name: str, help_text: str, collect) -> GaugeFamily:
+        family = GaugeFamily(name, help_text, collect)
+        self.families.append(family)
+        return family
+
+    def collected_histogram(self, name: str, help_text: str, collect) -> CollectedHistograms:
+        family = CollectedHistograms(name, help_text, collect)
+        self.families.append(family)
+        return family
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in self.families:
+            try:
+                lines.extend(family.render())
+            except Exception as exc:
+                lines.append(f'# error collecting {family.name}: {exc}')
+        return '\n'.join(lines) + '\n'
+
+
+def serve(registry: Registry, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
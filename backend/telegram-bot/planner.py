@@ -0,0 +1,136 @@
+"""Capacity-constrained run-sheet planner.
+
+Assigns pending tasks to (team, AM/PM window) slots for one date with a greedy
+priority-first heuristic: tasks are taken in severity/priority order and each
+goes to the open slot that best matches its zone, balancing load between
+teams. Every slot respects the team's ``max_tasks_per_window`` minus what is
+already scheduled, so the result can be written without re-checking capacity.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+WINDOWS = ('AM', 'PM')
+
+ZONE_HOME_BONUS = 3.0     # team's primary zone matches the task zone
+ZONE_SHARED_BONUS = 2.0   # slot already covers the task zone (fewer trips)
+URGENT_AM_BONUS = 0.5     # severe tasks prefer the earlier window
+LOAD_PENALTY = 1.0        # scaled by the slot's fill ratio
+
+
+def _number(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def task_zone(task: dict) -> str:
+    cluster = task.get('cluster') or {}
+    return (cluster.get('zone_id') if isinstance(cluster, dict) else None) or 'unknown'
+
+
+def task_rank(task: dict) -> Tuple[float, float, str]:
+    cluster = task.get('cluster') or {}
+    if not isinstance(cluster, dict):
+        cluster = {}
+    # Highest severity, then priority first; oldest first among equals.
+    return (
+        -_number(cluster.get('severity_score')),
+        -_number(cluster.get('priority_score')),
+        task.get('created_at') or '',
+    )
+
+
+class Slot:
+    __slots__ = ('team', 'window', 'capacity', 'existing', 'run_sheet_id', 'task_ids', 'zones')
+
+    def __init__(self, team: dict, window: str, capacity: int, existing: int, run_sheet_id: Optional[str]) -> None:
+        self.team = team
+        self.window = window
+        self.capacity = capacity
+        self.existing = existing
+        self.run_sheet_id = run_sheet_id
+        self.task_ids: List[str] = []
+        self.zones: Dict[str, int] = {}
+
+    @property
+    def remaining(self) -> int:
+        return self.capacity - self.existing - len(self.task_ids)
+
+    def score(self, zone: str, severity: float) -> float:
+        value = 0.0
+        if self.team.get('primary_zone') == zone:
+            value += ZONE_HOME_BONUS
+        if zone in self.zones:
+            value += ZONE_SHARED_BONUS
+        if severity >= 4 and self.window == 'AM':
+            value += URGENT_AM_BONUS
+        value -= LOAD_PENALTY * (self.existing + len(self.task_ids)) / max(self.capacity, 1)
+        return value
+
+
+def build_slots(teams: List[dict], existing_sheets: List[dict], windows=WINDOWS) -> List[Slot]:
+    """Create one slot per active team and window.
+
+    ``existing_sheets`` are run_sheets already on the date; a slot with a
+    non-draft sheet is closed, a draft sheet is topped up to capacity.
+    """
+    by_slot: Dict[Tuple[str, str], dict] = {
+        (sheet.get('team_id'), sheet.get('time_window')): sheet for sheet in existing_sheets
+    }
+    slots: List[Slot] = []
+    for team in teams:
+        capacity = int(_number(team.get('max_tasks_per_window')))
+        if capacity <= 0:
+            continue
+        for window in windows:
+            sheet = by_slot.get((team.get('id'), window))
+            if sheet is None:
+                slots.append(Slot(team, window, capacity, 0, None))
+                continue
+            if (sheet.get('status') or '').lower() != 'draft':
+                continue
+            existing = len(sheet.get('run_sheet_tasks') or [])
+            if existing < capacity:
+                slots.append(Slot(team, window, capacity, existing, sheet.get('id')))
+    return slots
+
+
+def plan_tasks(tasks: List[dict], slots: List[Slot]) -> dict:
+    """Greedily assign tasks to slots. Returns ``{'sheets': [...], 'unassigned': [...]}``."""
+    open_slots = [slot for slot in slots if slot.remaining > 0]
+    unassigned: List[str] = []
+
+    for task in sorted(tasks, key=task_rank):
+        task_id = task.get('id')
+        if not task_id:
+            continue
+        if not open_slots:
+            unassigned.append(task_id)
+            continue
+
+        zone = task_zone(task)
+        cluster = task.get('cluster') or {}
+        severity = _number(cluster.get('severity_score')) if isinstance(cluster, dict) else 0.0
+        best = max(open_slots, key=lambda slot: slot.score(zone, severity))
+        best.task_ids.append(task_id)
+        best.zones[zone] = best.zones.get(zone, 0) + 1
+        if best.remaining <= 0:
+            open_slots.remove(best)
+
+    sheets = []
+    for slot in slots:
+        if not slot.task_ids:
+            continue
+        used = slot.existing + len(slot.task_ids)
+        sheets.append({
+            'team_id': slot.team.get('id'),
+            'team_name': slot.team.get('name'),
+            'time_window': slot.window,
+            'run_sheet_id': slot.run_sheet_id,
+            'existing_tasks': slot.existing,
+            'task_ids': list(slot.task_ids),
+            'zones_covered': sorted(slot.zones, key=lambda z: -slot.zones[z]),
+            'capacity_used_percent': round(used * 100 / slot.capacity),
+        })
+    return {'sheets': sheets, 'unassigned': unassigned}
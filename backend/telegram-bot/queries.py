@@ -0,0 +1,144 @@
+"""PostgREST query composition.
+
+Projections are registered once by name and may embed other projections, so a
+multi-hop lookup (run_sheet_tasks -> tasks -> clusters) is expressed as a
+single select with embedded resources and costs one round trip. Each code
+path names the projection it renders instead of hand-writing column lists.
+"""
+
+import urllib.parse
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+# A projection is a list of columns and embeds. An embed is
+# (alias, table, projection_name) or (alias, table + hint, projection_name),
+# e.g. ('task', 'tasks!inner', 'task.summary').
+Field = Union[str, Tuple[str, str, str]]
+
+PROJECTIONS: Dict[str, List[Field]] = {
+    'cluster.summary': ['id', 'description', 'location_label', 'zone_id', 'category'],
+    'cluster.route': ['id', 'category', 'description', 'location_label', 'zone_id', 'centroid_lat', 'centroid_lng'],
+    'cluster.planning': [
+        'zone_id', 'category', 'severity_score', 'priority_score', 'location_label', 'centroid_lat', 'centroid_lng',
+    ],
+    'cluster.zone': ['zone_id'],
+    'cluster.resolution': ['zone_id', ('tasks', 'tasks', 'task.team')],
+    'task.team': ['assigned_team'],
+    'task.summary': ['id', 'task_type', ('cluster', 'clusters', 'cluster.summary')],
+    'task.ref': ['id', 'cluster_id', 'task_type', 'status', ('cluster', 'clusters', 'cluster.summary')],
+    'task.route': ['id', 'task_type', ('cluster', 'clusters', 'cluster.route')],
+    'task.planning': [
+        'id', 'cluster_id', 'task_type', 'status', 'planned_date', 'time_window', 'created_at',
+        ('cluster', 'clusters', 'cluster.planning'),
+    ],
+    'run_sheet_task.summary': [('task', 'tasks', 'task.summary')],
+    'run_sheet_task.route': ['id', 'task_id', 'sequence', ('task', 'tasks', 'task.route')],
+    'run_sheet_task.ref': ['sequence', ('task', 'tasks', 'task.ref')],
+    'run_sheet_task.link': ['run_sheet_id'],
+    'run_sheet_task.count': ['id'],
+    'run_sheet.dispatch': [
+        'id', 'date', 'time_window', 'zones_covered', 'capacity_used_percent', 'dispatched_at', 'task', 'notes',
+        ('teams', 'teams', 'team.name'),
+    ],
+    'run_sheet.tasks': ['id', ('run_sheet_tasks', 'run_sheet_tasks', 'run_sheet_task.ref')],
+    'run_sheet.planning': ['id', 'team_id', 'time_window', 'status', ('run_sheet_tasks', 'run_sheet_tasks', 'run_sheet_task.count')],
+    'team.name': ['name'],
+    'team.planning': ['id', 'name', 'primary_zone', 'max_tasks_per_window'],
+    'evidence.notification': [
+        'id', 'task_id', 'before_image_url', 'after_image_url', 'submitted_at', 'notes', 'submitted_by',
+        ('task', 'tasks', 'task.summary'),
+    ],
+    'evidence.by_run_sheet': [
+        'id', 'task_id', 'before_image_url', 'after_image_url', 'submitted_at',
+        ('task', 'tasks!inner', 'task.run_sheet_link'),
+    ],
+    'evidence.history': ['submitted_at', ('task', 'tasks', 'task.duration_history')],
+    'task.run_sheet_link': [('run_sheet_tasks', 'run_sheet_tasks!inner', 'run_sheet_task.link')],
+    'task.duration_history': [
+        ('cluster', 'clusters', 'cluster.category'),
+        ('run_sheet_tasks', 'run_sheet_tasks', 'run_sheet_task.link'),
+    ],
+    'cluster.category': ['category'],
+    'complaint.rollup': ['category_pred', 'severity_pred', 'status', ('cluster', 'clusters', 'cluster.zone')],
+    'failed_message.ref': ['id'],
+    'failed_message.replay': [
+        'id', 'telegram_user_id', 'telegram_chat_id', 'telegram_username', 'message_text', 'history', 'attempts',
+        'correlation_id', 'created_at',
+    ],
+    'complaint.dedupe': [
+        'id', 'text', 'location_label', 'category_pred', 'severity_pred', 'urgency_pred', 'status', 'cluster_id',
+        'telegram_user_id', 'created_at',
+    ],
+    'complaint.resolved_ref': ['id', 'resolved_at'],
+    'complaint.resolution': [
+        'id', 'text', 'category_pred', 'location_label', 'status', 'telegram_user_id', 'created_at', 'resolved_at',
+        ('cluster', 'clusters', 'cluster.resolution'),
+    ],
+}
+
+
+def render(name: str) -> str:
+    """Render a registered projection to a PostgREST ``select`` value."""
+    parts = []
+    for field in PROJECTIONS[name]:
+        if isinstance(field, str):
+            parts.append(field)
+        else:
+            alias, table, nested = field
+            prefix = f'{alias}:' if alias != table.split('!')[0] else ''
+            parts.append(f'{prefix}{table}({render(nested)})')
+    return ','.join(parts)
+
+
+def in_list(values: Iterable[str]) -> str:
+    return '(' + ','.join(urllib.parse.quote(str(value), safe='') for value in values) + ')'
+
+
+class Query:
+    """Builder for a single PostgREST GET against ``/rest/v1/<table>``."""
+
+    def __init__(self, table: str, projection: str) -> None:
+        self.table = table
+        self.projection = projection
+        self.filters: List[Tuple[str, str]] = []
+        self.ordering: Optional[str] = None
+        self.row_limit: Optional[int] = None
+        self.row_offset: Optional[int] = None
+
+    def where(self, column: str, op: str, value) -> 'Query':
+        self.filters.append((column, f'{op}.{urllib.parse.quote(str(value), safe=",()")}'))
+        return self
+
+    def eq(self, column: str, value) -> 'Query':
+        return self.where(column, 'eq', value)
+
+    def in_(self, column: str, values: Iterable[str]) -> 'Query':
+        self.filters.append((column, f'in.{in_list(values)}'))
+        return self
+
+    def or_(self, *conditions: str) -> 'Query':
+        """Add an ``or=(...)`` filter; conditions are PostgREST ``column.op.value`` terms."""
+        self.filters.append(('or', '(' + ','.join(conditions) + ')'))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> 'Query':
+        self.ordering = f"{column}.{'desc' if desc else 'asc'}"
+        return self
+
+    def limit(self, count: int) -> 'Query':
+        self.row_limit = count
+        return self
+
+    def offset(self, count: int) -> 'Query':
+        self.row_offset = count
+        return self
+
+    def url(self, base_url: str) -> str:
+        params = [f'select={render(self.projection)}']
+        params.extend(f'{column}={value}' for column, value in self.filters)
+        if self.ordering:
+            params.append(f'order={self.ordering}')
+        if self.row_limit is not None:
+            params.append(f'limit={self.row_limit}')
+        if self.row_offset:
+            params.append(f'offset={self.row_offset}')
+        return f"{base_url}/rest/v1/{self.table}?" + '&'.join(params)
@@ -0,0 +1,82 @@
+"""Replay of queued ``failed_messages``.
+
+Rows are claimed in batches under a lease (a conditional PATCH, so two
+replicas never claim the same row) and processed on a bounded thread pool;
+each row is completed or released with a retry delay as soon as it is done. The batch size follows the
+upstream's circuit breaker: nothing is claimed while it is open, a single row
+probes it while half-open, and after recovery the batch grows from one row,
+doubling per clean batch, so a backlog does not hit a recovering upstream all
+at once.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from resilience import CLOSED, HALF_OPEN, CircuitBreaker
+
+
+class ReplayWorker:
+    def __init__(
+        self,
+        claim: Callable[[int], List[dict]],
+        process: Callable[[dict], None],
+        complete: Callable[[dict, Optional[Exception]], None],
+        batch_size: int = 10,
+        concurrency: int = 2,
+        breaker: Optional[CircuitBreaker] = None,
+        on_error: Optional[Callable[[dict, Exception], None]] = None,
+    ) -> None:
+        self.claim = claim
+        self.process = process
+        self.complete = complete
+        self.batch_size = max(1, batch_size)
+        self.breaker = breaker
+        self.on_error = on_error
+        self.pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='replay')
+        self.window = 1
+        self.counts = {'replayed': 0, 'failed': 0}
+
+    def allowance(self) -> int:
+        """How many rows may be claimed now, given the breaker state."""
+        state = self.breaker.status()['state'] if self.breaker else CLOSED
+        if state == HALF_OPEN:
+            self.window = 1
+            return 1
+        if state != CLOSED:
+            self.window = 1
+            return 0
+        return min(self.window, self.batch_size)
+
+    def _run(self, row: dict) -> Optional[Exception]:
+        error: Optional[Exception] = None
+        try:
+            self.process(row)
+        except Exception as exc:
+            if self.on_error:
+                self.on_error(row, exc)
+            error = exc
+        # Complete each row as soon as it is done, so one failing PATCH cannot leave
+        # the rest of the batch leased (and replayed again once the lease expires).
+        try:
+            self.complete(row, error)
+        except Exception as exc:
+            if self.on_error:
+                self.on_error(row, exc)
+        return error
+
+    def run_once(self) -> List[dict]:
+        """Claim and replay one batch; returns the rows that were claimed."""
+        allowance = self.allowance()
+        if allowance <= 0:
+            return []
+        rows = self.claim(allowance)
+        if not rows:
+            return []
+        outcomes = list(self.pool.map(self._run, rows))
+        for error in outcomes:
+            self.counts['failed' if error else 'replayed'] += 1
+        if any(outcomes):
+            self.window = 1
+        elif len(rows) >= allowance:
+            self.window = min(self.window * 2, self.batch_size)
+        return rows
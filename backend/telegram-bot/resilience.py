@@ -0,0 +1,188 @@
+"""Per-upstream circuit breakers, retries and latency budgets.
+
+Every outbound call goes through the ``Upstream`` it targets (Telegram,
+Supabase, Watson Orchestrate, ...). Each upstream has a circuit breaker: after
+``failure_threshold`` consecutive failures it opens and calls fail fast with
+``CircuitOpenError`` for ``reset_timeout`` seconds, then a single half-open
+probe decides whether to close it again. Idempotent calls are retried with
+capped, fully jittered exponential backoff, but never past the call type's
+latency budget, so a degraded dependency costs each caller at most that budget.
+"""
+
+import random
+import socket
+import threading
+import time
+import urllib.error
+from typing import Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, upstream: str, retry_in: float) -> None:
+        super().__init__(f'{upstream} circuit open; retry in {retry_in:.0f}s')
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+def is_upstream_failure(exc: Exception) -> bool:
+    """Whether an error says the upstream is unhealthy (as opposed to a bad request)."""
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code >= 500 or exc.code == 429
+    return isinstance(exc, (urllib.error.URLError, socket.timeout, TimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        on_change: Optional[Callable[[str, str, str], None]] = None,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+        self.counts = {'success': 0, 'failure': 0, 'rejected': 0, 'opened': 0}
+
+    def _transition(self, state: str) -> None:
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.counts['opened'] += 1
+        if self.on_change and previous != state:
+            self.on_change(self.name, previous, state)
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self.lock:
+            if self.state == OPEN and self.retry_in() <= 0:
+                self._transition(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self.probing):
+                self.counts['rejected'] += 1
+                raise CircuitOpenError(self.name, self.retry_in())
+            if self.state == HALF_OPEN:
+                self.probing = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.counts['success'] += 1
+            self.failures = 0
+            self.probing = False
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.counts['failure'] += 1
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'retry_in': round(self.retry_in(), 1) if self.state == OPEN else 0.0,
+                **self.counts,
+            }
+
+
+class RetryPolicy:
+    def __init__(self, attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4.0) -> None:
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        """Full-jitter backoff before retry number ``attempt`` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class Upstream:
+    def __init__(
+        self,
+        name: str,
+        budgets: Dict[str, float],
+        breaker: CircuitBreaker,
+        retry: Optional[RetryPolicy] = None,
+    ) -> None:
+        self.name = name
+        self.budgets = budgets
+        self.breaker = breaker
+        self.retry = retry or RetryPolicy()
+
+    def budget(self, kind: str) -> float:
+        return self.budgets.get(kind) or self.budgets['default']
+
+    def call(self, kind: str, fn: Callable[[float], T], idempotent: bool = False) -> T:
+        """Run ``fn(timeout)`` within the budget for ``kind``.
+
+        Idempotent calls are retried on upstream failures while budget remains.
+        Client errors (4xx other than 429) pass through without tripping the breaker.
+        """
+        deadline = time.monotonic() + self.budget(kind)
+        attempts = self.retry.attempts if idempotent else 1
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            remaining = deadline - time.monotonic()
+            try:
+                result = fn(max(remaining, 0.1))
+            except Exception as exc:
+                if not is_upstream_failure(exc):
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                pause = self.retry.delay(attempt)
+                if attempt >= attempts or time.monotonic() + pause >= deadline:
+                    raise
+                time.sleep(pause)
+                continue
+            self.breaker.record_success()
+            return result
+
+
+class UpstreamRegistry:
+    """Routes URLs to upstreams by prefix; unmatched URLs use ``fallback``."""
+
+    def __init__(self, fallback: Upstream) -> None:
+        self.fallback = fallback
+        self.routes: List[tuple] = []
+
+    def add(self, prefix: str, upstream: Upstream) -> Upstream:
+        if prefix:
+            self.routes.append((prefix, upstream))
+            self.routes.sort(key=lambda route: -len(route[0]))
+        return upstream
+
+    def for_url(self, url: str) -> Upstream:
+        for prefix, upstream in self.routes:
+            if url.startswith(prefix):
+                return upstream
+        return self.fallback
+
+    def status(self) -> List[dict]:
+        seen = {}
+        for _, upstream in self.routes:
+            seen.setdefault(upstream.name, upstream)
+        seen.setdefault(self.fallback.name, self.fallback)
+        return [upstream.breaker.status() for upstream in seen.values()]
@@ -0,0 +1,143 @@
+"""Daily complaint rollups (date x zone x category).
+
+The bot recomputes whole days from the raw ``complaints`` rows and upserts the
+aggregate rows, so replaying a day (feed restart, backfill) always converges to
+the same values.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+RESOLVED_STATUSES = {'VERIFIED', 'CLOSED'}
+# Zone of complaints not (yet) in a cluster; free-text location labels are not zones.
+UNASSIGNED_ZONE = 'unassigned'
+
+BucketKey = Tuple[str, str, str]
+
+
+def local_day(created_at: str, utc_offset_hours: int) -> Optional[str]:
+    if not created_at:
+        return None
+    try:
+        ts = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return (ts.astimezone(timezone.utc) + timedelta(hours=utc_offset_hours)).date().isoformat()
+
+
+def day_bounds(day: str, utc_offset_hours: int) -> Tuple[str, str]:
+    """Return the UTC ISO range [start, end) covering a local calendar day."""
+    start = datetime.fromisoformat(day).replace(tzinfo=timezone.utc) - timedelta(hours=utc_offset_hours)
+    end = start + timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+
+def iter_days(start: str, end: str) -> Iterable[str]:
+    current = date.fromisoformat(start)
+    last = date.fromisoformat(end)
+    while current <= last:
+        yield current.isoformat()
+        current += timedelta(days=1)
+
+
+def complaint_zone(row: dict) -> str:
+    cluster = row.get('cluster') or {}
+    if isinstance(cluster, dict) and cluster.get('zone_id'):
+        return str(cluster['zone_id'])
+    return UNASSIGNED_ZONE
+
+
+def zeroed_bucket(key: BucketKey) -> dict:
+    return {
+        'day': key[0],
+        'zone_id': key[1],
+        'category': key[2],
+        'complaint_count': 0,
+        'open_count': 0,
+        'resolved_count': 0,
+        'severity_count': 0,
+        'severity_sum': 0,
+        'severity_max': None,
+    }
+
+
+def aggregate_day(day: str, rows: List[dict]) -> Dict[BucketKey, dict]:
+    buckets: Dict[BucketKey, dict] = {}
+    for row in rows:
+        key = (day, complaint_zone(row), row.get('category_pred') or 'uncategorised')
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = zeroed_bucket(key)
+            buckets[key] = bucket
+
+        bucket['complaint_count'] += 1
+        if (row.get('status') or '').strip().upper() in RESOLVED_STATUSES:
+            bucket['resolved_count'] += 1
+        else:
+            bucket['open_count'] += 1
+
+        severity = row.get('severity_pred')
+        if isinstance(severity, (int, float)):
+            bucket['severity_count'] += 1
+            bucket['severity_sum'] += severity
+            if bucket['severity_max'] is None or severity > bucket['severity_max']:
+                bucket['severity_max'] = severity
+    return buckets
+
+
+class DailyRollups:
+    """Tracks which days are dirty and rebuilds them on flush.
+
+    ``fetch_day(day)`` returns the raw complaint rows for a local day,
+    ``fetch_existing(day)`` the rollup keys already stored for it, and
+    ``upsert(rows)`` writes rollup rows idempotently.
+    """
+
+    def __init__(
+        self,
+        fetch_day: Callable[[str], List[dict]],
+        fetch_existing: Callable[[str], Set[BucketKey]],
+        upsert: Callable[[List[dict]], None],
+        utc_offset_hours: int = 8,
+    ) -> None:
+        self.fetch_day = fetch_day
+        self.fetch_existing = fetch_existing
+        self.upsert = upsert
+        self.utc_offset_hours = utc_offset_hours
+        self.dirty_days: Set[str] = set()
+
+    def mark_row(self, row: dict) -> None:
+        day = local_day(row.get('created_at') or '', self.utc_offset_hours)
+        if day:
+            self.dirty_days.add(day)
+
+    def mark_day(self, day: str) -> None:
+        self.dirty_days.add(day)
+
+    def rebuild_day(self, day: str) -> int:
+        buckets = aggregate_day(day, self.fetch_day(day))
+        rows = list(buckets.values())
+        # Keys that no longer have complaints (e.g. re-categorised) are zeroed, not left stale.
+        for key in self.fetch_existing(day) - set(buckets):
+            rows.append(zeroed_bucket(key))
+        if rows:
+            self.upsert(rows)
+        return len(rows)
+
+    def flush(self) -> int:
+        written = 0
+        for day in sorted(self.dirty_days):
+            written += self.rebuild_day(day)
+            self.dirty_days.discard(day)
+        return written
+
+    def backfill(self, start: str, end: str, on_day: Optional[Callable[[str, int], None]] = None) -> int:
+        written = 0
+        for day in iter_days(start, end):
+            count = self.rebuild_day(day)
+            written += count
+            if on_day:
+                on_day(day, count)
+        return written
@@ -0,0 +1,171 @@
+"""Stop sequencing for run sheets.
+
+Builds a haversine distance matrix (NumPy when available), seeds an open path
+with nearest-neighbour and improves it with 2-opt until a time budget runs
+out. Stops without coordinates keep their original relative order and are
+appended after the routed stops.
+"""
+
+import math
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_DURATION_MINUTES = 30.0
+MIN_DURATION_MINUTES = 10.0
+MAX_DURATION_MINUTES = 120.0
+
+Point = Tuple[float, float]
+
+
+def haversine_matrix(points: Sequence[Point]):
+    """Pairwise great-circle distances in km; a NumPy array or a list of lists."""
+    if np is not None:
+        coords = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+        lat = coords[:, 0][:, None]
+        lng = coords[:, 1][:, None]
+        dlat = lat - lat.T
+        dlng = lng - lng.T
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin(dlng / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    radians = [(math.radians(lat), math.radians(lng)) for lat, lng in points]
+    matrix = []
+    for lat1, lng1 in radians:
+        row = []
+        for lat2, lng2 in radians:
+            a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+            row.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(max(a, 0.0), 1.0))))
+        matrix.append(row)
+    return matrix
+
+
+def _dist(matrix, i: int, j: int) -> float:
+    return float(matrix[i][j])
+
+
+def nearest_neighbour(matrix, start: int = 0) -> List[int]:
+    size = len(matrix)
+    if size == 0:
+        return []
+    order = [start]
+    remaining = set(range(size)) - {start}
+    current = start
+    while remaining:
+        current = min(remaining, key=lambda j: _dist(matrix, current, j))
+        order.append(current)
+        remaining.discard(current)
+    return order
+
+
+def path_length(matrix, order: Sequence[int]) -> float:
+    return sum(_dist(matrix, order[i], order[i + 1]) for i in range(len(order) - 1))
+
+
+def two_opt(matrix, order: List[int], time_budget: float = 0.2) -> List[int]:
+    """Open-path 2-opt keeping the first stop fixed; stops when no move improves
+    the path or the time budget (seconds) is spent."""
+    order = list(order)
+    size = len(order)
+    if size < 4:
+        return order
+    deadline = time.monotonic() + time_budget
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(1, size - 1):
+            a, b = order[i - 1], order[i]
+            for j in range(i + 1, size):
+                c = order[j]
+                d = order[j + 1] if j + 1 < size else None
+                before = _dist(matrix, a, b) + (_dist(matrix, c, d) if d is not None else 0.0)
+                after = _dist(matrix, a, c) + (_dist(matrix, b, d) if d is not None else 0.0)
+                if after < before - 1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+                    b = order[i]
+            if time.monotonic() >= deadline:
+                break
+    return order
+
+
+def sequence_points(points: Sequence[Optional[Point]], time_budget: float = 0.2) -> List[int]:
+    """Return an index ordering that visits located points on a short path
+    (starting from the first located point) followed by unlocated ones."""
+    located = [i for i, point in enumerate(points) if point is not None]
+    unlocated = [i for i, point in enumerate(points) if point is None]
+    if len(located) <= 2:
+        return located + unlocated
+    matrix = haversine_matrix([points[i] for i in located])
+    order = two_opt(matrix, nearest_neighbour(matrix, 0), time_budget)
+    return [located[i] for i in order] + unlocated
+
+
+def leg_distances(points: Sequence[Optional[Point]], order: Sequence[int]) -> List[float]:
+    """Distance (km) travelled to reach each stop in ``order``; 0 for the first
+    stop and for legs with an unlocated endpoint."""
+    legs = [0.0]
+    for prev, current in zip(order, order[1:]):
+        a, b = points[prev], points[current]
+        if a is None or b is None:
+            legs.append(0.0)
+            continue
+        legs.append(float(haversine_matrix([a, b])[0][1]))
+    return legs
+
+
+def schedule(
+    order: Sequence[int],
+    legs: Sequence[float],
+    durations: Sequence[float],
+    start: datetime,
+    speed_kmh: float,
+) -> List[datetime]:
+    """Arrival time at each stop given travel legs (km) and on-site minutes."""
+    etas = []
+    clock = start.timestamp()
+    for position, index in enumerate(order):
+        clock += legs[position] / max(speed_kmh, 1.0) * 3600
+        etas.append(datetime.fromtimestamp(clock, tz=start.tzinfo))
+        clock += durations[index] * 60
+    return etas
+
+
+def category_durations(rows: List[dict]) -> Dict[str, float]:
+    """Average on-site minutes per category from historical evidence.
+
+    Each row is ``{'run_sheet_id', 'category', 'submitted_at'}``. Within a run
+    sheet, the gap between consecutive evidence submissions is attributed to
+    the later stop's category; gaps are clipped to a plausible range so
+    breaks and batch uploads do not skew the average.
+    """
+    by_sheet: Dict[str, List[Tuple[float, str]]] = {}
+    for row in rows:
+        sheet_id = row.get('run_sheet_id')
+        submitted = row.get('submitted_at')
+        if not sheet_id or not submitted:
+            continue
+        try:
+            ts = datetime.fromisoformat(submitted.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            continue
+        by_sheet.setdefault(sheet_id, []).append((ts, row.get('category') or 'issue'))
+
+    totals: Dict[str, List[float]] = {}
+    for entries in by_sheet.values():
+        entries.sort()
+        for (prev_ts, _), (ts, category) in zip(entries, entries[1:]):
+            minutes = (ts - prev_ts) / 60
+            if minutes <= 0:
+                continue
+            minutes = min(max(minutes, MIN_DURATION_MINUTES), MAX_DURATION_MINUTES)
+            bucket = totals.setdefault(category, [0.0, 0.0])
+            bucket[0] += minutes
+            bucket[1] += 1
+    return {category: total / count for category, (total, count) in totals.items() if count}
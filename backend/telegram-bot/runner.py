@@ -0,0 +1,197 @@
+"""Prefork runner: one ingress process and N worker processes.
+
+``python runner.py`` runs the bot across several cores. The parent process
+long-polls Telegram, runs everything that must happen once (leader election,
+notification feeds, replay, metrics) and hands each update to a worker
+process through a queue chosen by ``chat_id``, so updates of one chat are
+handled in order by the same worker while different chats run in parallel.
+
+The parent also supervises the workers: a worker that dies is restarted
+(with a growing delay if it keeps dying) on a fresh queue, since a killed
+reader can leave the old one locked; the update it was handling and any still
+queued for it are lost. On SIGTERM or Ctrl-C the parent stops polling,
+confirms the updates already queued with Telegram, lets the workers finish
+their queues for up to ``RUNNER_DRAIN_SECONDS`` and then exits.
+
+Conversation state must be visible to every process: use a shared
+``SESSION_STORE_URL`` (sqlite or redis), otherwise replayed conversations and
+evidence sessions started from another chat are not seen by the worker that
+handles the next message. Each worker polls the open complaints for its own
+near-duplicate index. Update counters and latencies are recorded per worker
+and are not part of the parent's metrics endpoint.
+"""
+
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import app
+
+RUNNER_WORKERS = int(os.environ.get('RUNNER_WORKERS', '0')) or os.cpu_count() or 1
+RUNNER_QUEUE_SIZE = int(os.environ.get('RUNNER_QUEUE_SIZE', '1000'))
+RUNNER_DRAIN_SECONDS = float(os.environ.get('RUNNER_DRAIN_SECONDS', '30'))
+RESTART_MAX_DELAY = 30.0
+
+# Workers are started fresh rather than forked from the parent, which has threads and sockets open.
+context = multiprocessing.get_context('spawn')
+
+
+def partition(update: dict, workers: int) -> int:
+    message = update.get('message') or update.get('edited_message') or {}
+    chat_id = (message.get('chat') or {}).get('id')
+    try:
+        return abs(int(chat_id)) % workers
+    except (TypeError, ValueError):
+        return 0
+
+
+def work(index: int, updates) -> None:
+    """Worker loop: handle updates from one queue until the None sentinel arrives."""
+    # Shutdown is driven by the parent, which drains the queues first.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    parent = os.getppid()
+    # Each worker matches near-duplicates against an index of its own.
+    app.start_worker_services()
+    try:
+        while True:
+            try:
+                update = updates.get(timeout=1)
+            except queue.Empty:
+                if os.getppid() != parent:
+                    app.log(f'Worker {index}: parent exited, stopping')
+                    return
+                continue
+            if update is None:
+                return
+            try:
+                app.handle_update(update)
+            except Exception as exc:
+                app.log(f"Worker {index}: error handling update {update.get('update_id')}: {exc}")
+    finally:
+        # Child processes skip atexit handlers: send queued writes here.
+        app.writes.flush()
+
+
+class Supervisor:
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self.queues = [context.Queue(queue_size) for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+        self.failures = [0] * workers
+        self.restart_at = [0.0] * workers
+        self.stopping = threading.Event()
+        self.restarts = app.metrics.counter('bot_runner_worker_restarts_total', 'Worker processes restarted after exiting.')
+        app.metrics.gauge('bot_runner_queue_depth', 'Updates waiting in each worker queue.', self.queue_depths)
+
+    def queue_depths(self) -> list:
+        depths = []
+        for index, updates in enumerate(self.queues):
+            try:
+                depths.append(({'worker': index}, updates.qsize()))
+            except NotImplementedError:
+                # macOS has no sem_getvalue.
+                pass
+        return depths
+
+    def spawn(self, index: int) -> None:
+        process = context.Process(target=work, args=(index, self.queues[index]), name=f'bot-worker-{index}', daemon=True)
+        process.start()
+        self.processes[index] = process
+        self.restart_at[index] = time.monotonic()
+
+    def dispatch(self, update: dict) -> None:
+        index = partition(update, len(self.queues))
+        while True:
+            try:
+                # Re-read the queue each time: it is replaced when its worker restarts.
+                self.queues[index].put(update, timeout=1)
+                return
+            except queue.Full:
+                if self.stopping.is_set() and not self.processes[index].is_alive():
+                    app.log(f"Dropping update {update.get('update_id')}: worker {index} is gone")
+                    return
+
+    def check(self) -> None:
+        """Restart workers that exited, backing off for ones that keep dying."""
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is None or process.is_alive() or self.stopping.is_set():
+                continue
+            if now - self.restart_at[index] > RESTART_MAX_DELAY:
+                self.failures[index] = 0
+            delay = min(RESTART_MAX_DELAY, 2 ** self.failures[index] - 1)
+            if now - self.restart_at[index] < delay:
+                continue
+            stranded = self.queues[index]
+            self.queues[index] = context.Queue(self.queue_size)
+            try:
+                lost = stranded.qsize()
+            except NotImplementedError:
+                lost = '?'
+            stranded.cancel_join_thread()
+            stranded.close()
+            app.log(f'Worker {index} exited with code {process.exitcode}; restarting ({lost} queued updates lost)')
+            self.failures[index] += 1
+            self.restarts.inc(worker=index)
+            self.spawn(index)
+
+    def drain(self) -> None:
+        deadline = time.monotonic() + RUNNER_DRAIN_SECONDS
+        for updates in self.queues:
+            try:
+                updates.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                app.log(f'Worker {index} did not drain in {RUNNER_DRAIN_SECONDS:.0f}s; terminating')
+                process.terminate()
+                process.join(5)
+
+    def run(self) -> None:
+        for index in range(len(self.queues)):
+            self.spawn(index)
+        app.start_services()
+
+        def stop(signum, frame) -> None:
+            self.stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        ingress = threading.Thread(
+            target=app.poll_updates, args=(self.dispatch, lambda: not self.stopping.is_set()), name='ingress', daemon=True,
+        )
+        ingress.start()
+        app.log(f'Runner started with {len(self.queues)} workers')
+        while not self.stopping.wait(1.0):
+            self.check()
+            if not ingress.is_alive():
+                app.log('Ingress stopped unexpectedly; shutting down')
+                self.stopping.set()
+
+        app.log('Stopping: finishing the current poll and draining worker queues...')
+        ingress.join(app.POLL_TIMEOUT + 10)
+        self.drain()
+
+
+def main() -> None:
+    app.check_config()
+    if app.SESSION_STORE_URL.startswith('memory'):
+        app.log('Warning: SESSION_STORE_URL is per-process; use sqlite:// or redis:// to share sessions between workers')
+    Supervisor(RUNNER_WORKERS, RUNNER_QUEUE_SIZE).run()
+    # Exiting runs the atexit handlers, including the lease handover.
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Adaptive polling for the notification feeds.
+
+Each feed is polled on its own interval. While polls keep returning new rows
+the interval halves towards ``min_interval``; idle polls back it off
+exponentially to ``max_interval``. Every wait is jittered so replicas started
+together drift apart instead of hitting PostgREST in lockstep.
+
+A feed's poll callable returns the source timestamps (epoch seconds) of the
+rows it handled, or ``None`` when it could not tell. The gap between a row's
+timestamp and the moment it was handled is reported as notification lag.
+
+A feed may be gated by a ``when`` predicate (e.g. "this replica is the
+leader"); while it returns False the feed is skipped and rechecked at its
+minimum interval. ``wake`` makes feeds due at once, e.g. when a push source
+reports that it may have missed rows.
+"""
+
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+PollFn = Callable[[], Optional[List[float]]]
+
+BACKOFF_FACTOR = 2.0
+LAG_SMOOTHING = 0.2
+
+
+class Feed:
+    __slots__ = (
+        'name', 'poll', 'min_interval', 'max_interval', 'interval', 'next_run',
+        'runs', 'events', 'errors', 'last_run', 'last_lag', 'avg_lag', 'when',
+    )
+
+    def __init__(
+        self, name: str, poll: PollFn, min_interval: float, max_interval: float, initial: float,
+        when: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.name = name
+        self.poll = poll
+        self.when = when
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.interval = min(max(initial, self.min_interval), self.max_interval)
+        self.next_run = 0.0
+        self.runs = 0
+        self.events = 0
+        self.errors = 0
+        self.last_run: Optional[float] = None
+        self.last_lag: Optional[float] = None
+        self.avg_lag: Optional[float] = None
+
+    def record(self, timestamps: Optional[List[float]], now: float) -> None:
+        self.runs += 1
+        self.last_run = now
+        if timestamps:
+            self.events += len(timestamps)
+            lag = max(0.0, now - min(timestamps))
+            self.last_lag = lag
+            self.avg_lag = lag if self.avg_lag is None else self.avg_lag + LAG_SMOOTHING * (lag - self.avg_lag)
+            self.interval = max(self.min_interval, self.interval / BACKOFF_FACTOR)
+        else:
+            self.interval = min(self.max_interval, self.interval * BACKOFF_FACTOR)
+
+    def status(self) -> dict:
+        return {
+            'name': self.name,
+            'interval': round(self.interval, 1),
+            'runs': self.runs,
+            'events': self.events,
+            'errors': self.errors,
+            'last_run': self.last_run,
+            'last_lag': None if self.last_lag is None else round(self.last_lag, 1),
+            'avg_lag': None if self.avg_lag is None else round(self.avg_lag, 1),
+            'active': self.when is None or bool(self.when()),
+        }
+
+
+class FeedScheduler:
+    def __init__(
+        self,
+        jitter: float = 0.1,
+        on_error: Optional[Callable[[str, Exception], None]] = None,
+        on_run: Optional[Callable[[str, float, Optional[List[float]], bool], None]] = None,
+    ) -> None:
+        """``on_run(name, seconds, timestamps, failed)`` is called after every poll."""
+        self.jitter = jitter
+        self.on_error = on_error
+        self.on_run = on_run
+        self.feeds: Dict[str, Feed] = {}
+        self.stopped = threading.Event()
+        self.woken = threading.Event()
+
+    def add(
+        self, name: str, poll: PollFn, min_interval: float, max_interval: float, initial: Optional[float] = None,
+        when: Optional[Callable[[], bool]] = None,
+    ) -> Feed:
+        """Register a feed. ``min_interval == max_interval`` gives a fixed schedule."""
+        feed = Feed(name, poll, min_interval, max_interval, min_interval if initial is None else initial, when)
+        self.feeds[name] = feed
+        return feed
+
+    def _delay(self, interval: float) -> float:
+        if self.jitter <= 0:
+            return interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run_due(self, now: Optional[float] = None) -> float:
+        """Poll every feed that is due; returns seconds until the next one is."""
+        now = time.time() if now is None else now
+        for feed in self.feeds.values():
+            if feed.next_run > now:
+                continue
+            if feed.when is not None and not feed.when():
+                feed.next_run = now + feed.min_interval
+                continue
+            started = time.perf_counter()
+            failed = False
+            try:
+                timestamps = feed.poll()
+            except Exception as exc:
+                feed.errors += 1
+                timestamps = None
+                failed = True
+                if self.on_error:
+                    self.on_error(feed.name, exc)
+            if self.on_run:
+                self.on_run(feed.name, time.perf_counter() - started, timestamps, failed)
+            finished = time.time()
+            feed.record(timestamps, finished)
+            feed.next_run = finished + self._delay(feed.interval)
+        if not self.feeds:
+            return 1.0
+        return max(0.0, min(feed.next_run for feed in self.feeds.values()) - time.time())
+
+    def wake(self, *names: str) -> None:
+        """Make the named feeds (all, if none are named) due now."""
+        for name in names or list(self.feeds):
+            if name in self.feeds:
+                self.feeds[name].next_run = 0.0
+        self.woken.set()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            self.woken.wait(self.run_due())
+            self.woken.clear()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name='feed-scheduler', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.woken.set()
+
+    def status(self) -> List[dict]:
+        return [feed.status() for feed in self.feeds.values()]
@@ -0,0 +1,355 @@
+"""Conversation state shared between bot processes.
+
+Evidence sessions, complaint mode and agent history are small JSON documents
+stored under ``(namespace, key)`` with a time-to-live, so abandoned
+conversations expire on their own and any worker or replica can pick up the
+next message of a conversation. Backends, chosen by ``open_store(url)``:
+
+- ``memory://``: a dict in this process (the default; nothing is shared).
+- ``sqlite:///sessions.db`` (relative) or ``sqlite:////var/lib/bot/sessions.db``
+  (absolute): a WAL-mode SQLite file shared by the processes of one host.
+- ``redis://[:password@]host:port/db``: any server speaking the Redis
+  protocol, through a minimal built-in client (no extra dependency).
+
+``replace`` is a compare-and-set on the stored document, which is what makes
+``transition`` safe: of two messages racing to move a session out of a
+state, exactly one wins.
+"""
+
+import json
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+
+def dump(value: object) -> str:
+    # Sorted keys make equal documents serialise identically, which compare-and-set relies on.
+    return json.dumps(value, separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+
+
+class SessionStore(ABC):
+    """Interface shared by the backends; values are JSON-serialisable."""
+
+    @abstractmethod
+    def get(self, namespace: str, key: object) -> Optional[object]:
+        ...
+
+    @abstractmethod
+    def put(self, namespace: str, key: object, value: object, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    def pop(self, namespace: str, key: object) -> Optional[object]:
+        ...
+
+    @abstractmethod
+    def replace(self, namespace: str, key: object, expected: Optional[object], value: Optional[object], ttl: float) -> bool:
+        """Atomically swap ``expected`` (None: absent) for ``value`` (None: delete)."""
+
+    @abstractmethod
+    def count(self, namespace: str) -> int:
+        ...
+
+
+def transition(store: SessionStore, namespace: str, key: object, from_state: str, changes: dict, ttl: float) -> Optional[dict]:
+    """Move a session out of ``from_state`` by merging ``changes``; returns the new
+    session, or None if it is gone or another message moved it first."""
+    current = store.get(namespace, key)
+    if not isinstance(current, dict) or current.get('state') != from_state:
+        return None
+    updated = {**current, **changes}
+    return updated if store.replace(namespace, key, current, updated, ttl) else None
+
+
+class MemoryStore(SessionStore):
+    PURGE_EVERY = 256
+
+    def __init__(self) -> None:
+        self.data: Dict[Tuple[str, str], Tuple[float, str]] = {}
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def _live(self, item: Optional[Tuple[float, str]], now: float) -> Optional[str]:
+        if item is None or item[0] <= now:
+            return None
+        return item[1]
+
+    def _purge(self, now: float) -> None:
+        self.writes += 1
+        if self.writes % self.PURGE_EVERY == 0:
+            for slot in [slot for slot, (expires, _) in self.data.items() if expires <= now]:
+                del self.data[slot]
+
+    def get(self, namespace: str, key: object) -> Optional[object]:
+        with self.lock:
+            blob = self._live(self.data.get((namespace, str(key))), time.time())
+        return None if blob is None else json.loads(blob)
+
+    def put(self, namespace: str, key: object, value: object, ttl: float) -> None:
+        now = time.time()
+        with self.lock:
+            self.data[(namespace, str(key))] = (now + ttl, dump(value))
+            self._purge(now)
+
+    def pop(self, namespace: str, key: object) -> Optional[object]:
+        with self.lock:
+            blob = self._live(self.data.pop((namespace, str(key)), None), time.time())
+        return None if blob is None else json.loads(blob)
+
+    def replace(self, namespace: str, key: object, expected: Optional[object], value: Optional[object], ttl: float) -> bool:
+        slot = (namespace, str(key))
+        now = time.time()
+        with self.lock:
+            current = self._live(self.data.get(slot), now)
+            if current != (None if expected is None else dump(expected)):
+                return False
+            if value is None:
+                self.data.pop(slot, None)
+            else:
+                self.data[slot] = (now + ttl, dump(value))
+                self._purge(now)
+            return True
+
+    def count(self, namespace: str) -> int:
+        now = time.time()
+        with self.lock:
+            return sum(1 for (ns, _), (expires, _) in self.data.items() if ns == namespace and expires > now)
+
+
+class SqliteStore(SessionStore):
+    PURGE_EVERY = 256
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+        conn = self._conn()
+        conn.execute('pragma journal_mode=wal')
+        conn.execute(
+            'create table if not exists sessions ('
+            ' namespace text not null, key text not null, value text not null, expires_at real not null,'
+            ' primary key (namespace, key)) without rowid'
+        )
+        conn.execute('create index if not exists sessions_expiry on sessions (expires_at)')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Autocommit; multi-statement changes take the write lock with BEGIN IMMEDIATE.
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('pragma synchronous=normal')
+            self.local.conn = conn
+        return conn
+
+    def _read(self, conn: sqlite3.Connection, namespace: str, key: str) -> Optional[str]:
+        row = conn.execute(
+            'select value from sessions where namespace = ? and key = ? and expires_at > ?',
+            (namespace, key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _purge(self, conn: sqlite3.Connection) -> None:
+        self.writes += 1
+        if self.writes % self.PURGE_EVERY == 0:
+            conn.execute('delete from sessions where expires_at <= ?', (time.time(),))
+
+    def get(self, namespace: str, key: object) -> Optional[object]:
+        blob = self._read(self._conn(), namespace, str(key))
+        return None if blob is None else json.loads(blob)
+
+    def put(self, namespace: str, key: object, value: object, ttl: float) -> None:
+        conn = self._conn()
+        conn.execute(
+            'insert or replace into sessions (namespace, key, value, expires_at) values (?, ?, ?, ?)',
+            (namespace, str(key), dump(value), time.time() + ttl),
+        )
+        self._purge(conn)
+
+    def pop(self, namespace: str, key: object) -> Optional[object]:
+        conn = self._conn()
+        conn.execute('begin immediate')
+        try:
+            blob = self._read(conn, namespace, str(key))
+            conn.execute('delete from sessions where namespace = ? and key = ?', (namespace, str(key)))
+            conn.execute('commit')
+        except Exception:
+            conn.execute('rollback')
+            raise
+        return None if blob is None else json.loads(blob)
+
+    def replace(self, namespace: str, key: object, expected: Optional[object], value: Optional[object], ttl: float) -> bool:
+        conn = self._conn()
+        conn.execute('begin immediate')
+        try:
+            if self._read(conn, namespace, str(key)) != (None if expected is None else dump(expected)):
+                conn.execute('rollback')
+                return False
+            if value is None:
+                conn.execute('delete from sessions where namespace = ? and key = ?', (namespace, str(key)))
+            else:
+                conn.execute(
+                    'insert or replace into sessions (namespace, key, value, expires_at) values (?, ?, ?, ?)',
+                    (namespace, str(key), dump(value), time.time() + ttl),
+                )
+            conn.execute('commit')
+        except Exception:
+            conn.execute('rollback')
+            raise
+        return True
+
+    def count(self, namespace: str) -> int:
+        return self._conn().execute(
+            'select count(*) from sessions where namespace = ? and expires_at > ?', (namespace, time.time()),
+        ).fetchone()[0]
+
+
+class RespError(RuntimeError):
+    pass
+
+
+class RespConnection:
+    """One connection speaking RESP2, the Redis wire protocol."""
+
+    def __init__(self, host: str, port: int, password: Optional[str], db: int, timeout: float) -> None:
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile('rb')
+        if password:
+            self.command('AUTH', password)
+        if db:
+            self.command('SELECT', db)
+
+    def command(self, *args: object) -> object:
+        parts = [f'*{len(args)}\r\n'.encode('ascii')]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self.sock.sendall(b''.join(parts))
+        return self._reply()
+
+    def _reply(self) -> object:
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RespError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self.reader.read(size + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            size = int(rest)
+            return None if size < 0 else [self._reply() for _ in range(size)]
+        raise RespError(f'Unexpected reply: {line!r}')
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisStore(SessionStore):
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, password: Optional[str] = None, db: int = 0,
+                 prefix: str = 'bot:', timeout: float = 5.0) -> None:
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.prefix = prefix
+        self.timeout = timeout
+        self.idle: List[RespConnection] = []
+        self.lock = threading.Lock()
+        self._with_connection(lambda conn: conn.command('PING'))
+
+    def _with_connection(self, fn):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = RespConnection(self.host, self.port, self.password, self.db, self.timeout)
+        try:
+            result = fn(conn)
+        except Exception:
+            # Also on error replies: the connection may be left inside WATCH or MULTI.
+            conn.close()
+            raise
+        with self.lock:
+            self.idle.append(conn)
+        return result
+
+    def _key(self, namespace: str, key: object) -> str:
+        return f'{self.prefix}{namespace}:{key}'
+
+    def get(self, namespace: str, key: object) -> Optional[object]:
+        blob = self._with_connection(lambda conn: conn.command('GET', self._key(namespace, key)))
+        return None if blob is None else json.loads(blob)
+
+    def put(self, namespace: str, key: object, value: object, ttl: float) -> None:
+        self._with_connection(
+            lambda conn: conn.command('SET', self._key(namespace, key), dump(value), 'PX', max(1, int(ttl * 1000))),
+        )
+
+    def pop(self, namespace: str, key: object) -> Optional[object]:
+        def run(conn: RespConnection) -> Optional[str]:
+            conn.command('MULTI')
+            conn.command('GET', self._key(namespace, key))
+            conn.command('DEL', self._key(namespace, key))
+            return conn.command('EXEC')[0]
+
+        blob = self._with_connection(run)
+        return None if blob is None else json.loads(blob)
+
+    def replace(self, namespace: str, key: object, expected: Optional[object], value: Optional[object], ttl: float) -> bool:
+        name = self._key(namespace, key)
+
+        def run(conn: RespConnection) -> bool:
+            # Optimistic: EXEC returns nil if the key changed after WATCH.
+            conn.command('WATCH', name)
+            if conn.command('GET', name) != (None if expected is None else dump(expected)):
+                conn.command('UNWATCH')
+                return False
+            conn.command('MULTI')
+            if value is None:
+                conn.command('DEL', name)
+            else:
+                conn.command('SET', name, dump(value), 'PX', max(1, int(ttl * 1000)))
+            return conn.command('EXEC') is not None
+
+        return self._with_connection(run)
+
+    def count(self, namespace: str) -> int:
+        def run(conn: RespConnection) -> int:
+            cursor, total = '0', 0
+            while True:
+                cursor, keys = conn.command('SCAN', cursor, 'MATCH', f'{self._key(namespace, "")}*', 'COUNT', 500)
+                total += len(keys)
+                if cursor == '0':
+                    return total
+
+        return self._with_connection(run)
+
+
+def open_store(url: str) -> SessionStore:
+    parsed = urllib.parse.urlparse(url or 'memory://')
+    if parsed.scheme in ('', 'memory'):
+        return MemoryStore()
+    if parsed.scheme == 'sqlite':
+        return SqliteStore(parsed.netloc + parsed.path[1:])
+    if parsed.scheme == 'redis':
+        return RedisStore(
+            host=parsed.hostname or '127.0.0.1',
+            port=parsed.port or 6379,
+            password=urllib.parse.unquote(parsed.password) if parsed.password else None,
+            db=int(parsed.path.strip('/') or 0),
+        )
+    raise ValueError(f'Unsupported session store: {url}')
@@ -0,0 +1,199 @@
+"""Mergeable quantile sketches for resolution-time percentiles.
+
+A merging t-digest: values are buffered, then folded into centroids whose size
+is bounded by the k1 scale function, so tails keep small centroids and p99 stays
+accurate. Digests serialise to a compact dict and merge without loss of the
+size bound, which is what lets per-day sketches be combined for any range.
+Day sketches themselves are rebuilt from that day's source rows, like the
+daily rollups, so they stay exact under replays.
+"""
+
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+DEFAULT_COMPRESSION = 100
+
+
+class TDigest:
+    def __init__(self, compression: int = DEFAULT_COMPRESSION) -> None:
+        self.compression = compression
+        self.centroids: List[Tuple[float, float]] = []
+        self.buffer: List[Tuple[float, float]] = []
+        self.count = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        self.buffer.append((float(value), float(weight)))
+        self.count += weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.buffer) > self.compression * 5:
+            self.compress()
+
+    def merge(self, other: 'TDigest') -> None:
+        if not other.count:
+            return
+        self.buffer.extend(other.centroids)
+        self.buffer.extend(other.buffer)
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.compress()
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def compress(self) -> None:
+        if not self.buffer:
+            return
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        total = sum(w for _, w in points)
+        merged: List[Tuple[float, float]] = []
+        mean, weight = points[0]
+        seen = 0.0
+        k_lower = self._k(0.0)
+        for next_mean, next_weight in points[1:]:
+            q_upper = (seen + weight + next_weight) / total
+            if self._k(min(q_upper, 1.0)) - k_lower <= 1.0:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                merged.append((mean, weight))
+                seen += weight
+                k_lower = self._k(min(seen / total, 1.0))
+                mean, weight = next_mean, next_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        self.compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        q = min(max(q, 0.0), 1.0)
+        target = q * self.count
+        cumulative = 0.0
+        for index, (mean, weight) in enumerate(self.centroids):
+            center = cumulative + weight / 2
+            if target < center:
+                if index == 0:
+                    low_mean, low_center = self.min, 0.0
+                else:
+                    prev_mean, prev_weight = self.centroids[index - 1]
+                    low_mean, low_center = prev_mean, cumulative - prev_weight / 2
+                return _interpolate(target, low_center, low_mean, center, mean)
+            cumulative += weight
+        last_mean, last_weight = self.centroids[-1]
+        return _interpolate(target, self.count - last_weight / 2, last_mean, self.count, self.max)
+
+    def to_dict(self) -> dict:
+        self.compress()
+        return {
+            'compression': self.compression,
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'centroids': [[round(m, 3), w] for m, w in self.centroids],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'TDigest':
+        digest = cls(int((data or {}).get('compression') or DEFAULT_COMPRESSION))
+        if not data:
+            return digest
+        digest.centroids = [(float(m), float(w)) for m, w in data.get('centroids') or []]
+        digest.count = float(data.get('count') or sum(w for _, w in digest.centroids))
+        digest.min = data.get('min')
+        digest.max = data.get('max')
+        return digest
+
+
+def _interpolate(x: float, x0: float, y0: float, x1: float, y1: float) -> float:
+    if x1 <= x0:
+        return y1
+    return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+
+
+def merge_digests(digests: Iterable[TDigest], compression: int = DEFAULT_COMPRESSION) -> TDigest:
+    combined = TDigest(compression)
+    for digest in digests:
+        combined.merge(digest)
+    return combined
+
+
+SketchKey = Tuple[str, str, str]  # (day, dimension, key)
+Sample = Tuple[Dict[str, str], float]  # ({dimension: key}, value)
+
+
+class SketchWindow:
+    """Tracks which days are dirty and rebuilds their sketches on flush.
+
+    ``fetch_day(day)`` returns every sample of a day as ``({dimension: key}, value)``,
+    ``fetch_existing(day)`` the sketch keys already stored for it, and ``save(rows)``
+    upserts rows of ``{day, dimension, key, sketch, sample_count}``. Sketches are
+    built from the whole day each time, never merged into stored ones, so
+    reprocessing a row (feed restart, lookback) cannot count it twice.
+    """
+
+    def __init__(
+        self,
+        fetch_day: Callable[[str], List[Sample]],
+        fetch_existing: Callable[[str], Set[SketchKey]],
+        save: Callable[[List[dict]], None],
+        compression: int = DEFAULT_COMPRESSION,
+    ) -> None:
+        self.fetch_day = fetch_day
+        self.fetch_existing = fetch_existing
+        self.save = save
+        self.compression = compression
+        self.dirty_days: Set[str] = set()
+
+    def mark_day(self, day: str) -> None:
+        self.dirty_days.add(day)
+
+    def build_day(self, day: str) -> List[dict]:
+        digests: Dict[SketchKey, TDigest] = {}
+        for dimensions, value in self.fetch_day(day):
+            for dimension, key in dimensions.items():
+                if key:
+                    digests.setdefault((day, dimension, key), TDigest(self.compression)).add(value)
+        # Keys left without samples (e.g. a complaint re-opened) are emptied, not left stale.
+        for sketch_key in self.fetch_existing(day) - set(digests):
+            digests[sketch_key] = TDigest(self.compression)
+        return [
+            {'day': day, 'dimension': dimension, 'key': key, 'sketch': digest.to_dict(), 'sample_count': int(digest.count)}
+            for (day, dimension, key), digest in digests.items()
+        ]
+
+    def flush(self) -> int:
+        """Rebuild and save the dirty days; a day stays dirty until its save succeeds."""
+        written = 0
+        for day in sorted(self.dirty_days):
+            rows = self.build_day(day)
+            if rows:
+                self.save(rows)
+            self.dirty_days.discard(day)
+            written += len(rows)
+        return written
+
+
+def percentiles(rows: Iterable[dict], quantiles: Iterable[float] = (0.5, 0.9, 0.99)) -> Dict[str, dict]:
+    """Merge stored sketch rows by key and return ``{key: {'count', 'p50', ...}}``."""
+    by_key: Dict[str, TDigest] = {}
+    for row in rows:
+        key = row.get('key')
+        if not key:
+            continue
+        digest = by_key.setdefault(key, TDigest())
+        digest.merge(TDigest.from_dict(row.get('sketch')))
+
+    result: Dict[str, dict] = {}
+    for key, digest in by_key.items():
+        entry = {'count': int(digest.count)}
+        for q in quantiles:
+            entry[f'p{int(round(q * 100))}'] = digest.quantile(q)
+        result[key] = entry
+    return result
@@ -0,0 +1,39 @@
+import os
+import sys
+import types
+
+import pytest
+
+# The bot's modules live next to this directory and are imported as top-level modules.
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BOT_DIR)
+sys.path.insert(0, os.path.join(BOT_DIR, 'bench'))
+
+
+@pytest.fixture(scope='session')
+def bot():
+    """``app`` imported against the bench's stand-in Telegram, Supabase and Watson servers.
+    The servers are shared by every test, so tests use their own ids."""
+    from harness import BOT_TOKEN, DISPATCHER_ID, MEDIA_ID
+    from stubs import FakePostgrest, FakeTelegram, FakeWatson
+
+    telegram = FakeTelegram().start()
+    postgrest = FakePostgrest().start()
+    watson = FakeWatson(postgrest).start()
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+        'TELEGRAM_API_URL': telegram.url,
+        'SUPABASE_URL': postgrest.url,
+        'SUPABASE_SERVICE_ROLE_KEY': 'test-service-role',
+        'WXO_HOST_URL': watson.url,
+        'DISPATCH_TELEGRAM_USER_ID': str(DISPATCHER_ID),
+        'DISPATCH_MEDIA_TELEGRAM_USER_ID': str(MEDIA_ID),
+        'SESSION_STORE_URL': 'memory://',
+        'METRICS_PORT': '0',
+        'GOOGLE_MAPS_API_KEY': '',
+    })
+    import app
+
+    yield types.SimpleNamespace(app=app, telegram=telegram, postgrest=postgrest, watson=watson)
+    for stub in (telegram, postgrest, watson):
+        stub.stop()
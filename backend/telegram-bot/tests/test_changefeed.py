@@ -0,0 +1,163 @@
+import json
+import sys
+import types
+
+import pytest
+
+from changefeed import ChangeFeed
+
+
+class Notify:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class FakeConnection:
+    """Answers each ``notifies`` call with the next scripted batch, then stops the feed."""
+
+    def __init__(self, feed, batches):
+        self.feed = feed
+        self.batches = [[Notify(payload) for payload in batch] for batch in batches]
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        self.executed.append(query)
+
+    def notifies(self, timeout, stop_after):
+        if not self.batches:
+            self.feed.stop()
+            return []
+        return self.batches.pop(0)
+
+
+@pytest.fixture
+def fake_psycopg(monkeypatch):
+    psycopg = types.ModuleType('psycopg')
+    psycopg.sql = types.SimpleNamespace(
+        SQL=lambda text: types.SimpleNamespace(format=lambda *args: text.format(*args)),
+        Identifier=lambda name: f'"{name}"',
+    )
+    monkeypatch.setitem(sys.modules, 'psycopg', psycopg)
+    monkeypatch.setitem(sys.modules, 'psycopg.sql', psycopg.sql)
+    return psycopg
+
+
+def event(table, row_id):
+    return json.dumps({'table': table, 'op': 'UPDATE', 'id': row_id})
+
+
+def make_feed(on_changes, **kwargs):
+    gaps = []
+    errors = []
+    feed = ChangeFeed('postgresql://test', on_changes, on_gap=lambda: gaps.append(1), on_error=errors.append, **kwargs)
+    return feed, gaps, errors
+
+
+def connect(feed):
+    """What a successful LISTEN does to the feed's state."""
+    feed.connected = True
+    feed.generation += 1
+
+
+def test_listen_delivers_grouped_and_deduplicated_changes(fake_psycopg):
+    delivered = []
+    feed, gaps, errors = make_feed(delivered.append)
+    conn = FakeConnection(feed, [
+        [event('evidence', 1)],
+        [event('evidence', 2), event('evidence', 1), event('run_sheets', 'r9'), 'not json', json.dumps({'op': 'x'})],
+    ])
+    fake_psycopg.connect = lambda dsn, autocommit: conn
+
+    feed._listen()
+
+    assert conn.executed == ['listen "bot_changes"']
+    assert delivered == [{'evidence': ['1', '2'], 'run_sheets': ['r9']}]
+    assert (feed.events, feed.batches) == (6, 1)
+    assert feed.connected and feed.generation == 1
+    assert gaps == [1] and errors == []
+
+
+def test_garbage_payloads_are_dropped(fake_psycopg):
+    delivered = []
+    feed, gaps, errors = make_feed(delivered.append)
+    feed._deliver(['', '[]', json.dumps({'table': 'evidence'})])
+    assert delivered == []
+    assert feed.batches == 1 and feed.generation == 0 and gaps == []
+
+
+def test_failed_batch_makes_reconcilers_due(fake_psycopg):
+    def on_changes(changes):
+        raise RuntimeError('apply failed')
+
+    feed, gaps, errors = make_feed(on_changes)
+    connect(feed)
+    poll = feed.reconciler('evidence', lambda: [], lambda: 'watermark')
+    poll()
+    assert not feed.reconcile_due('evidence')
+
+    feed._deliver([event('evidence', 1)])
+
+    assert [str(exc) for exc in errors] == ['apply failed']
+    assert feed.generation == 2 and gaps == [1]
+    assert feed.reconcile_due('evidence')
+
+
+def test_reconcile_counts_only_when_a_poll_finds_nothing_new(fake_psycopg):
+    feed, gaps, errors = make_feed(lambda changes: None)
+    watermark = {'value': 0}
+    handled = {'rows': [1.0]}
+
+    def poll():
+        return handled['rows']
+
+    run = feed.reconciler('dispatch', poll, lambda: watermark['value'])
+
+    # Due while the feed is disconnected, whatever the polls found.
+    handled['rows'] = []
+    run()
+    assert feed.reconcile_due('dispatch')
+
+    connect(feed)
+    handled['rows'] = [1.0]
+    run()
+    assert feed.reconcile_due('dispatch')
+
+    # Nothing handled, but the watermark moved: still catching up.
+    handled['rows'] = []
+    watermark['value'] = 1
+
+    def advancing_poll():
+        watermark['value'] += 1
+        return []
+
+    feed.reconciler('dispatch', advancing_poll, lambda: watermark['value'])()
+    assert feed.reconcile_due('dispatch')
+
+    run()
+    assert not feed.reconcile_due('dispatch')
+    assert feed.reconcile_due('evidence')
+
+    # A new generation (reconnect, failed batch, promotion) needs a fresh reconcile.
+    feed.invalidate()
+    assert feed.reconcile_due('dispatch') and gaps == [1]
+    run()
+    assert not feed.reconcile_due('dispatch')
+
+
+def test_reconcile_expires_after_interval(fake_psycopg):
+    feed, gaps, errors = make_feed(lambda changes: None, reconcile_interval=0.0)
+    connect(feed)
+    feed.reconciler('dispatch', lambda: None, lambda: 0)()
+    assert feed.reconcile_due('dispatch')
+
+
+def test_needs_psycopg(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'psycopg', None)
+    with pytest.raises(RuntimeError, match='psycopg'):
+        ChangeFeed('postgresql://test', lambda changes: None)
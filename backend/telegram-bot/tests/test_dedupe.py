@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+
+from dedupe import NearDuplicateIndex, area_tokens, normalise
+
+
+def complaint(complaint_id, text, location='Block 512 Ang Mo Kio'):
+    return {'id': complaint_id, 'text': text, 'location_label': location, 'status': 'RECEIVED'}
+
+
+def test_normalise_expands_abbreviations():
+    assert normalise('Rubbish at Blk 512, opp the MSCP!') == 'rubbish block 512 opposite carpark'
+    assert area_tokens('Blk 512 Ang Mo Kio Ave 3, S560512') == {'blk:512', 'postal:560512'}
+
+
+def test_match_needs_the_same_area():
+    index = NearDuplicateIndex(threshold=0.5)
+    index.add(complaint('c1', 'Rubbish bin overflowing next to the lift lobby'))
+    found = index.match('rubbish bin overflowing next to lift lobby at blk 512 ang mo kio')
+    assert found and found[0]['id'] == 'c1'
+    assert index.match('rubbish bin overflowing next to lift lobby at blk 513 ang mo kio') is None
+    # No block or postal code: never matched, however similar the wording.
+    assert index.match('rubbish bin overflowing next to the lift lobby') is None
+
+
+def test_remove_and_prune():
+    index = NearDuplicateIndex(threshold=0.5)
+    index.add(complaint('c1', 'Rubbish bin overflowing next to the lift lobby'))
+    index.add(complaint('c2', 'Dead rat near the void deck benches'))
+    index.remove('c1')
+    assert index.match('rubbish bin overflowing next to lift lobby blk 512 ang mo kio') is None
+    assert index.prune(lambda row: row['id'] != 'c2') == 1
+    assert len(index) == 0 and index.buckets == {}
+
+
+def test_poll_drops_complaints_resolved_elsewhere(bot):
+    app = bot.app
+    text = 'Cockroaches swarming around the rubbish chute at block 871 Tampines'
+    row = bot.postgrest.insert('complaints', {
+        'text': text, 'location_label': 'Blk 871 Tampines St 84', 'category_pred': 'pest', 'status': 'RECEIVED',
+        'telegram_user_id': '800001',
+    })
+    app.poll_complaint_index()
+    found = app.complaint_index.match('cockroaches swarming around rubbish chute blk 871 tampines')
+    assert found and found[0]['id'] == row['id']
+
+    # Resolved by another process: this one never runs notify_resolutions.
+    row.update({'status': 'CLOSED', 'resolved_at': datetime.now(timezone.utc).isoformat()})
+    app.poll_complaint_index()
+    assert app.complaint_index.match('cockroaches swarming around rubbish chute blk 871 tampines') is None
@@ -0,0 +1,108 @@
+import threading
+import time
+
+from digest import DigestCoalescer, pack_messages
+
+
+class FlakySend:
+    """Records sent texts; the calls numbered in ``fail_on`` (1-based) raise."""
+
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.calls = 0
+        self.sent = []
+
+    def __call__(self, chat_id, text):
+        self.calls += 1
+        if self.calls in self.fail_on:
+            raise RuntimeError('send failed')
+        self.sent.append((chat_id, text))
+
+
+def delivered(send, messages):
+    return [message for message in messages if any(message in text for _, text in send.sent)]
+
+
+def test_pack_messages_respects_limit():
+    groups = pack_messages(['a' * 40, 'b' * 40, 'c' * 40], '|', limit=90)
+    assert groups == [['a' * 40, 'b' * 40], ['c' * 40]]
+
+
+def test_single_message_is_sent_as_is():
+    send = FlakySend()
+    digest = DigestCoalescer(send, header=lambda count: f'{count} runs\n')
+    digest.add(1, 'only')
+    assert digest.flush() == 1
+    assert send.sent == [(1, 'only')]
+
+
+def test_failed_second_chunk_is_requeued_with_the_rest():
+    send = FlakySend(fail_on={2})
+    digest = DigestCoalescer(send, separator='|', limit=90)
+    messages = [f'{index}' * 40 for index in range(6)]
+    for message in messages:
+        digest.add(7, message)
+
+    # Three chunks of two: the first is delivered, the second fails.
+    assert digest.flush() == 1
+    assert delivered(send, messages) == messages[:2]
+    assert digest.pending_count() == 4
+
+    assert digest.flush() == 2
+    assert delivered(send, messages) == messages
+    assert digest.pending_count() == 0
+
+
+def test_gives_up_after_max_attempts():
+    send = FlakySend(fail_on={1, 2, 3})
+    digest = DigestCoalescer(send)
+    digest.add(1, 'x')
+    for _ in range(3):
+        digest.flush()
+    assert digest.pending_count() == 0
+    assert send.sent == []
+
+
+def test_max_hold_waits_for_more_messages():
+    send = FlakySend()
+    digest = DigestCoalescer(send, max_hold=10)
+    digest.add(1, 'a', now=100)
+    assert digest.flush(now=105) == 0
+    digest.add(1, 'b', now=106)
+    assert digest.flush(now=110) == 1
+    assert 'a' in send.sent[0][1] and 'b' in send.sent[0][1]
+
+
+def test_concurrent_add_and_flush_deliver_every_message_once():
+    sent = []
+
+    def send(chat_id, text):
+        # Slow enough for the flushing threads to overlap.
+        time.sleep(0.001)
+        sent.append(text)
+
+    digest = DigestCoalescer(send, separator='|')
+    messages = [f'm{index}' for index in range(400)]
+    errors = []
+
+    def produce(offset):
+        for message in messages[offset::4]:
+            digest.add(int(message[1:]) % 20, message)
+
+    def consume():
+        try:
+            for _ in range(20):
+                digest.flush()
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=produce, args=(offset,)) for offset in range(4)]
+    threads += [threading.Thread(target=consume) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    digest.flush(force=True)
+
+    assert errors == []
+    assert sorted(part for text in sent for part in text.split('|')) == sorted(messages)
@@ -0,0 +1,93 @@
+import urllib.parse
+
+import pytest
+
+from replay import ReplayWorker
+
+
+def test_each_row_is_completed_even_when_another_completion_fails():
+    rows = [{'id': index} for index in range(4)]
+    completed = []
+
+    def complete(row, error):
+        if row['id'] == 1:
+            raise RuntimeError('PATCH failed')
+        completed.append((row['id'], error))
+
+    def process(row):
+        if row['id'] == 2:
+            raise ValueError('agent failed')
+
+    errors = []
+    worker = ReplayWorker(
+        claim=lambda count: rows[:count],
+        process=process,
+        complete=complete,
+        batch_size=4,
+        on_error=lambda row, exc: errors.append((row['id'], type(exc).__name__)),
+    )
+    worker.window = 4
+    assert worker.run_once() == rows
+
+    assert sorted(row_id for row_id, _ in completed) == [0, 2, 3]
+    assert isinstance(dict(completed)[2], ValueError)
+    assert sorted(errors) == [(1, 'RuntimeError'), (2, 'ValueError')]
+    assert worker.counts == {'replayed': 3, 'failed': 1}
+    # A failed row shrinks the next batch back to one.
+    assert worker.window == 1
+
+
+def queue_row(bot, correlation_id, user_id):
+    return bot.postgrest.insert('failed_messages', {
+        'telegram_user_id': str(user_id),
+        'telegram_chat_id': str(user_id),
+        'telegram_username': 'resident',
+        'message_text': 'Bin overflowing at block 5',
+        'history': [{'role': 'user', 'text': 'Bin overflowing at block 5'}],
+        'correlation_id': correlation_id,
+        'status': 'pending',
+        'attempts': 0,
+        'lease_expires_at': None,
+    })
+
+
+@pytest.fixture
+def projected(bot, monkeypatch):
+    """Trim rows the stub returns to the columns the request selected, as PostgREST does."""
+    request = bot.app.http_request
+
+    def http_request(url, *args, **kwargs):
+        result = request(url, *args, **kwargs)
+        select = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get('select')
+        if select and isinstance(result, list):
+            columns = [column for column in select[0].split(',') if '(' not in column]
+            result = [{column: row.get(column) for column in columns} for row in result]
+        return result
+
+    monkeypatch.setattr(bot.app, 'http_request', http_request)
+    return bot
+
+
+def test_claimed_rows_carry_their_correlation_id(projected):
+    bot = projected
+    queued = queue_row(bot, 'c0ffee01', 700001)
+    claimed = [row for row in bot.app.claim_failed_messages(50) if row['id'] == queued['id']]
+    assert [row.get('correlation_id') for row in claimed] == ['c0ffee01']
+
+
+def test_replay_of_an_already_filed_complaint_is_not_resent(projected):
+    bot = projected
+    queued = queue_row(bot, 'c0ffee02', 700002)
+    complaint = bot.postgrest.insert('complaints', {
+        'correlation_id': 'c0ffee02', 'telegram_user_id': None, 'status': 'RECEIVED', 'text': 'Bin overflowing',
+    })
+    row = next(row for row in bot.app.claim_failed_messages(50) if row['id'] == queued['id'])
+    agent_calls = bot.watson.requests.get('completions', 0)
+
+    bot.app.replay_failed_message(row)
+
+    assert bot.watson.requests.get('completions', 0) == agent_calls
+    linked = next(found for found in bot.postgrest.rows('complaints') if found['id'] == complaint['id'])
+    assert linked['telegram_user_id'] == '700002'
+    assert len([found for found in bot.postgrest.rows('complaints') if found.get('correlation_id') == 'c0ffee02']) == 1
+    assert bot.telegram.sent_by_chat.get(700002)
@@ -0,0 +1,41 @@
+from rollups import UNASSIGNED_ZONE, DailyRollups, aggregate_day, complaint_zone
+
+
+def test_unclustered_complaints_share_one_zone():
+    assert complaint_zone({'cluster': {'zone_id': 'AMK-3'}, 'location_label': 'Blk 512'}) == 'AMK-3'
+    assert complaint_zone({'cluster': None, 'location_label': 'Blk 512'}) == UNASSIGNED_ZONE
+    assert complaint_zone({'location_label': 'block 512 AMK'}) == UNASSIGNED_ZONE
+
+
+def test_aggregate_day():
+    rows = [
+        {'cluster': {'zone_id': 'AMK-3'}, 'category_pred': 'litter', 'status': 'NEW', 'severity_pred': 2},
+        {'cluster': {'zone_id': 'AMK-3'}, 'category_pred': 'litter', 'status': 'CLOSED', 'severity_pred': 4},
+        {'location_label': 'Blk 512', 'category_pred': 'litter', 'status': 'NEW'},
+        {'location_label': 'block 512', 'category_pred': None, 'status': 'VERIFIED '},
+    ]
+    buckets = aggregate_day('2026-10-18', rows)
+    assert set(buckets) == {
+        ('2026-10-18', 'AMK-3', 'litter'),
+        ('2026-10-18', UNASSIGNED_ZONE, 'litter'),
+        ('2026-10-18', UNASSIGNED_ZONE, 'uncategorised'),
+    }
+    zone = buckets[('2026-10-18', 'AMK-3', 'litter')]
+    assert (zone['complaint_count'], zone['open_count'], zone['resolved_count']) == (2, 1, 1)
+    assert (zone['severity_count'], zone['severity_sum'], zone['severity_max']) == (2, 6, 4)
+    assert buckets[('2026-10-18', UNASSIGNED_ZONE, 'uncategorised')]['resolved_count'] == 1
+
+
+def test_rebuild_zeroes_keys_left_without_complaints():
+    upserted = []
+    rollups = DailyRollups(
+        fetch_day=lambda day: [{'category_pred': 'litter', 'status': 'NEW'}],
+        # Stored before unclustered complaints were bucketed together.
+        fetch_existing=lambda day: {(day, 'Blk 512', 'litter')},
+        upsert=upserted.extend,
+    )
+    rollups.mark_day('2026-10-18')
+    assert rollups.flush() == 2
+    counts = {(row['zone_id'], row['category']): row['complaint_count'] for row in upserted}
+    assert counts == {(UNASSIGNED_ZONE, 'litter'): 1, ('Blk 512', 'litter'): 0}
+    assert rollups.dirty_days == set()
@@ -0,0 +1,53 @@
+import pytest
+
+
+@pytest.fixture
+def runner(bot):
+    # Importing runner imports app, which reads its configuration once: only after ``bot`` set it.
+    import runner
+
+    return runner
+
+
+def text_update(update_id, chat_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'username': 'resident'},
+            'text': text,
+        },
+    }
+
+
+def test_partition_keeps_a_chat_on_one_worker(runner):
+    assert runner.partition(text_update(1, -1005, 'hi'), 4) == runner.partition(text_update(2, -1005, 'again'), 4) == 1
+    assert runner.partition({'update_id': 3}, 4) == 0
+
+
+def test_worker_matches_complaints_indexed_in_its_own_process(bot, runner):
+    original = bot.postgrest.insert('complaints', {
+        'text': 'Water leaking from the ceiling of the lift lobby at block 233 Bishan',
+        'location_label': 'Blk 233 Bishan St 22', 'category_pred': 'leak', 'status': 'RECEIVED',
+        'telegram_user_id': '810001',
+    })
+    agent_calls = bot.watson.requests.get('completions', 0)
+
+    updates = runner.context.Queue()
+    for update in (
+        text_update(1, 810002, '/complaint'),
+        text_update(2, 810002, 'water leaking from ceiling of lift lobby blk 233 bishan'),
+        None,
+    ):
+        updates.put(update)
+    worker = runner.context.Process(target=runner.work, args=(0, updates), daemon=True)
+    worker.start()
+    worker.join(60)
+    assert worker.exitcode == 0
+
+    # Linked by the worker without asking the agent.
+    assert bot.watson.requests.get('completions', 0) == agent_calls
+    linked = [row for row in bot.postgrest.rows('complaints') if row.get('telegram_user_id') == '810002']
+    assert len(linked) == 1 and linked[0]['id'] != original['id']
+    assert any(linked[0]['id'][:8] in sent.get('text', '') for sent in bot.telegram.sent_by_chat.get(810002, []))
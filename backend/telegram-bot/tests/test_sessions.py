@@ -0,0 +1,162 @@
+import os
+import socket
+import threading
+import time
+import urllib.parse
+import uuid
+
+import pytest
+
+from sessions import MemoryStore, RedisStore, RespError, SessionStore, SqliteStore, open_store, transition
+
+REDIS_TEST_URL = os.environ.get('REDIS_TEST_URL', 'redis://127.0.0.1:6379/15')
+
+
+def redis_store():
+    parsed = urllib.parse.urlparse(REDIS_TEST_URL)
+    try:
+        # A prefix per store keeps runs apart in a shared database.
+        return RedisStore(
+            host=parsed.hostname or '127.0.0.1', port=parsed.port or 6379, db=int(parsed.path.strip('/') or 0),
+            prefix=f'test:{uuid.uuid4().hex}:', timeout=1.0,
+        )
+    except OSError:
+        pytest.skip(f'no Redis server at {REDIS_TEST_URL}')
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore()
+    if request.param == 'sqlite':
+        return SqliteStore(str(tmp_path / 'sessions.db'))
+    return redis_store()
+
+
+def test_put_get_pop(store):
+    assert store.get('evidence', 1) is None
+    store.put('evidence', 1, {'state': 'waiting_before_photo', 'task_id': 't'}, ttl=60)
+    assert store.get('evidence', 1) == {'state': 'waiting_before_photo', 'task_id': 't'}
+    assert store.count('evidence') == 1
+    assert store.count('complaint') == 0
+    assert store.pop('evidence', 1) == {'state': 'waiting_before_photo', 'task_id': 't'}
+    assert store.pop('evidence', 1) is None
+
+
+def test_entries_expire(store):
+    store.put('history', 5, [{'role': 'user', 'text': 'hi'}], ttl=0.2)
+    assert store.get('history', 5) is not None
+    time.sleep(0.3)
+    assert store.get('history', 5) is None
+    assert store.count('history') == 0
+
+
+def test_replace_is_compare_and_set(store):
+    assert store.replace('complaint', 9, None, {'n': 1}, ttl=60)
+    # Expected "absent" fails once the key exists.
+    assert not store.replace('complaint', 9, None, {'n': 2}, ttl=60)
+    assert not store.replace('complaint', 9, {'n': 0}, {'n': 2}, ttl=60)
+    assert store.replace('complaint', 9, {'n': 1}, {'n': 2}, ttl=60)
+    assert store.get('complaint', 9) == {'n': 2}
+    # A None value deletes.
+    assert store.replace('complaint', 9, {'n': 2}, None, ttl=60)
+    assert store.get('complaint', 9) is None
+
+
+def test_transition_moves_out_of_a_state_once(store):
+    store.put('evidence', 3, {'state': 'waiting_after_photo', 'task_id': 't'}, ttl=60)
+    moved = transition(store, 'evidence', 3, 'waiting_after_photo', {'state': 'submitting'}, ttl=60)
+    assert moved == {'state': 'submitting', 'task_id': 't'}
+    assert transition(store, 'evidence', 3, 'waiting_after_photo', {'state': 'submitting'}, ttl=60) is None
+
+
+def test_concurrent_transitions_have_one_winner(store):
+    store.put('evidence', 4, {'state': 'waiting_after_photo'}, ttl=60)
+    results = []
+    barrier = threading.Barrier(8)
+
+    def attempt(index):
+        barrier.wait()
+        results.append(transition(store, 'evidence', 4, 'waiting_after_photo', {'state': 'submitting', 'by': index}, ttl=60))
+
+    threads = [threading.Thread(target=attempt, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    winners = [result for result in results if result is not None]
+    assert len(winners) == 1
+    assert store.get('evidence', 4) == winners[0]
+
+
+def test_sqlite_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    first, second = SqliteStore(path), SqliteStore(path)
+    first.put('complaint', 1, {'started_at': 1}, ttl=60)
+    assert second.get('complaint', 1) == {'started_at': 1}
+
+
+def test_open_store_urls(tmp_path):
+    assert isinstance(open_store('memory://'), MemoryStore)
+    assert isinstance(open_store(''), MemoryStore)
+    assert isinstance(open_store(f'sqlite:///{tmp_path}/s.db'), SqliteStore)
+    with pytest.raises(ValueError):
+        open_store('mongodb://localhost')
+
+
+class ScriptedRedis:
+    """A socket server answering each command with the next canned RESP reply."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.commands = []
+        self.closed = threading.Event()
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        conn, _ = self.server.accept()
+        reader = conn.makefile('rb')
+        while True:
+            header = reader.readline()
+            if not header:
+                self.closed.set()
+                return
+            args = []
+            for _ in range(int(header[1:])):
+                size = int(reader.readline()[1:])
+                args.append(reader.read(size + 2)[:-2].decode())
+            self.commands.append(args)
+            conn.sendall(self.replies.pop(0))
+
+
+def test_redis_error_reply_closes_the_connection():
+    server = ScriptedRedis([b'+PONG\r\n', b'+OK\r\n', b'-ERR wrong kind of value\r\n'])
+    store = RedisStore(port=server.port, timeout=1.0)
+    with pytest.raises(RespError, match='wrong kind'):
+        store.replace('evidence', 1, None, {'state': 'x'}, ttl=60)
+    assert server.commands[1][0] == 'WATCH'
+    # The connection is dropped rather than pooled while still watching a key.
+    assert store.idle == []
+    assert server.closed.wait(1.0)
+
+
+def test_incomplete_store_fails_on_construction():
+    class NoCount(SessionStore):
+        def get(self, namespace, key):
+            return None
+
+        def put(self, namespace, key, value, ttl):
+            pass
+
+        def pop(self, namespace, key):
+            return None
+
+        def replace(self, namespace, key, expected, value, ttl):
+            return False
+
+    with pytest.raises(TypeError, match='count'):
+        NoCount()
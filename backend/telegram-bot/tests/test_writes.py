@@ -0,0 +1,60 @@
+import io
+import socket
+import urllib.error
+
+import pytest
+
+from writes import WriteBatcher
+
+
+class FakeRequest:
+    """Records PostgREST calls; ``fail(body)`` returns an exception to raise for a request body, or None."""
+
+    def __init__(self, fail):
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, url, method='GET', headers=None, body=None):
+        self.calls.append((method, url, body))
+        exc = self.fail(body)
+        if exc:
+            raise exc
+        return []
+
+
+def http_error(code):
+    return urllib.error.HTTPError('http://db/rest/v1/evidence', code, 'error', {}, io.BytesIO(b'{}'))
+
+
+def queue_three(batcher):
+    return [batcher.insert('evidence', {'task_id': name}) for name in ('a', 'bad', 'c')]
+
+
+def test_rejected_batch_is_retried_row_by_row():
+    def fail(body):
+        if any(row['task_id'] == 'bad' for row in body):
+            return http_error(400)
+        return None
+
+    request = FakeRequest(fail)
+    batcher = WriteBatcher('http://db', 'key', request, max_delay=1)
+    futures = queue_three(batcher)
+    batcher.flush()
+
+    assert len(request.calls) == 4
+    assert futures[0].result() is None and futures[2].result() is None
+    with pytest.raises(urllib.error.HTTPError):
+        futures[1].result()
+
+
+@pytest.mark.parametrize('exc', [socket.timeout('timed out'), ConnectionResetError(), http_error(503), http_error(429)])
+def test_ambiguous_failure_is_not_resent(exc):
+    request = FakeRequest(lambda body: exc)
+    batcher = WriteBatcher('http://db', 'key', request, max_delay=1)
+    futures = queue_three(batcher)
+    batcher.flush()
+
+    # The bulk POST may have been committed, so its rows are not sent again.
+    assert len(request.calls) == 1
+    for future in futures:
+        assert future.exception() is exc
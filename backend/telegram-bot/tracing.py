@@ -0,0 +1,237 @@
+"""Lightweight request tracing.
+
+A root span is opened per Telegram update and child spans for pipeline stages
+and outbound calls nest under it through a ``ContextVar``. Spans of a trace
+are buffered until the root ends, then the whole trace is kept or dropped:
+traces are kept at ``sample_rate``, and always when the root took at least
+``slow_threshold`` seconds, so slow interactions are never sampled away.
+Outside a root span every helper here is a cheap no-op.
+
+Kept traces go to a JSON-lines file and/or an OTLP/HTTP JSON endpoint
+(``/v1/traces`` on a collector or any stand-in accepting the same payload).
+"""
+
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: Dict[str, object]) -> None:
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = dict(attributes)
+        self.error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': round(((self.end or self.start) - self.start) * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Trace:
+    __slots__ = ('trace_id', 'spans', 'lock')
+
+    def __init__(self) -> None:
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+
+    def finish(self, span: Span) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+class JsonlExporter:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans: List[dict]) -> None:
+        lines = ''.join(json.dumps(span, default=str) + '\n' for span in spans)
+        with self.lock, open(self.path, 'a', encoding='utf-8') as handle:
+            handle.write(lines)
+
+
+def _otlp_value(value: object) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(spans: List[dict], service_name: str) -> dict:
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+            'scopeSpans': [{
+                'scope': {'name': 'telegram-bot'},
+                'spans': [
+                    {
+                        'traceId': span['trace_id'],
+                        'spanId': span['span_id'],
+                        **({'parentSpanId': span['parent_id']} if span['parent_id'] else {}),
+                        'name': span['name'],
+                        'kind': 1,
+                        'startTimeUnixNano': str(int(span['start'] * 1e9)),
+                        'endTimeUnixNano': str(int((span['end'] or span['start']) * 1e9)),
+                        'attributes': [
+                            {'key': key, 'value': _otlp_value(value)} for key, value in span['attributes'].items()
+                        ],
+                        'status': {'code': 2, 'message': span['error']} if span['error'] else {'code': 1},
+                    }
+                    for span in spans
+                ],
+            }],
+        }],
+    }
+
+
+class OtlpExporter:
+    """Posts traces to an OTLP/HTTP JSON endpoint from a background thread.
+
+    Uses urllib directly so exporting never produces spans or metrics of its own;
+    traces are dropped when the queue is full or the collector is unreachable."""
+
+    def __init__(self, endpoint: str, service_name: str = 'telegram-bot', timeout: float = 5.0, max_queue: int = 1000) -> None:
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self.queue: 'queue.Queue[List[dict]]' = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        threading.Thread(target=self._run, name='trace-export', daemon=True).start()
+
+    def export(self, spans: List[dict]) -> None:
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            batch = self.queue.get()
+            while len(batch) < 512:
+                try:
+                    batch.extend(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            body = json.dumps(to_otlp(batch, self.service_name)).encode('utf-8')
+            req = urllib.request.Request(self.endpoint, data=body, method='POST')
+            req.add_header('Content-Type', 'application/json')
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                    resp.read()
+            except Exception:
+                self.dropped += 1
+
+
+class Tracer:
+    def __init__(self, exporters: List[object], sample_rate: float = 0.0, slow_threshold: Optional[float] = None) -> None:
+        self.exporters = exporters
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters) and (self.sample_rate > 0 or self.slow_threshold is not None)
+
+    @contextmanager
+    def root(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Start a new trace. Yields None (and records nothing) when tracing is off."""
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace()
+        span = Span(trace, name, None, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.error = f'{type(exc).__name__}: {exc}'
+            raise
+        finally:
+            _current.reset(token)
+            span.end = time.time()
+            trace.finish(span)
+            self._complete(trace, span)
+
+    def _complete(self, trace: Trace, root: Span) -> None:
+        slow = self.slow_threshold is not None and (root.end - root.start) >= self.slow_threshold
+        if not slow and random.random() >= self.sample_rate:
+            return
+        root.attributes['sampled_by'] = 'latency' if slow else 'rate'
+        with trace.lock:
+            spans = [span.to_dict() for span in sorted(trace.spans, key=lambda span: span.start)]
+        for exporter in self.exporters:
+            try:
+                exporter.export(spans)
+            except Exception:
+                pass
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Child span of the current span; a no-op outside a trace."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.error = f'{type(exc).__name__}: {exc}'
+        raise
+    finally:
+        _current.reset(token)
+        child.end = time.time()
+        parent.trace.finish(child)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def traced(name: str) -> Callable:
+    """Decorator running the function inside a child span named ``name``."""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,201 @@
+"""Write-behind batching of PostgREST writes.
+
+Row-at-a-time inserts and updates are queued per table and sent together
+once ``max_rows`` are waiting or the oldest has waited ``max_delay`` seconds:
+
+- consecutive inserts into a table with the same columns (and the same
+  ``on_conflict`` target) become one POST with an array body, as a bulk
+  upsert when ``on_conflict`` is given;
+- consecutive updates of a table with identical bodies become one PATCH
+  with an ``in.(...)`` filter; updates with different bodies go out one by
+  one.
+
+Writes to a table are sent in the order they were queued, so two writes to
+the same row are never reordered. Every write returns a
+``concurrent.futures.Future``: callers that need the outcome wait on it,
+others attach a callback to log failures. A bulk request the server
+rejected with a 4xx is retried row by row, so one bad row only fails its own
+future. Any other failure (a timeout, a dropped connection, a 5xx) fails
+every future in the batch: the request may already have been committed, and
+sending the rows again could apply them twice.
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+
+# 4xx statuses that do not mean the rows themselves were rejected.
+_RETRYABLE_STATUSES = {408, 429}
+
+
+def _rejected(exc: Exception) -> bool:
+    """Whether ``exc`` is a definite rejection: the server refused the request without applying it."""
+    return (
+        isinstance(exc, urllib.error.HTTPError)
+        and 400 <= exc.code < 500
+        and exc.code not in _RETRYABLE_STATUSES
+    )
+
+
+class _Write:
+    __slots__ = ('kind', 'body', 'on_conflict', 'returning', 'column', 'key', 'future')
+
+    def __init__(self, kind: str, body: dict, on_conflict: Optional[str] = None, returning: bool = False,
+                 column: str = 'id', key: Optional[str] = None) -> None:
+        self.kind = kind
+        self.body = body
+        self.on_conflict = on_conflict
+        self.returning = returning
+        self.column = column
+        self.key = key
+        self.future: Future = Future()
+
+    def group(self) -> tuple:
+        if self.kind == 'insert':
+            return ('insert', self.on_conflict, self.returning, tuple(sorted(self.body)))
+        return ('update', self.column, json.dumps(self.body, sort_keys=True, default=str))
+
+
+class WriteBatcher:
+    def __init__(self, base_url: str, api_key: str, request: Callable[..., object],
+                 max_rows: int = 50, max_delay: float = 0.025) -> None:
+        """``request(url, method=..., headers=..., body=...)`` performs one HTTP call and returns parsed JSON.
+        With ``max_delay`` <= 0 every write is sent immediately by the calling thread."""
+        self.base_url = base_url
+        self.api_key = api_key
+        self.request = request
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay
+        self.pending: Dict[str, List[_Write]] = {}
+        self.oldest: Dict[str, float] = {}
+        self.lock = threading.Condition()
+        # Held while sending, so batches of a table cannot overtake each other.
+        self.send_lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.writes = 0
+        self.requests = 0
+
+    def insert(self, table: str, row: dict, on_conflict: Optional[str] = None, returning: bool = False) -> Future:
+        """Queue an insert (an upsert merging on ``on_conflict``); the future resolves to the
+        written row when ``returning``, else None."""
+        return self._queue(table, _Write('insert', row, on_conflict=on_conflict, returning=returning))
+
+    def update(self, table: str, key: str, body: dict, column: str = 'id') -> Future:
+        """Queue ``PATCH table?column=eq.key`` with ``body``."""
+        return self._queue(table, _Write('update', body, column=column, key=str(key)))
+
+    def queued(self) -> int:
+        with self.lock:
+            return sum(len(writes) for writes in self.pending.values())
+
+    def _queue(self, table: str, write: _Write) -> Future:
+        with self.lock:
+            self.writes += 1
+            self.pending.setdefault(table, []).append(write)
+            self.oldest.setdefault(table, time.monotonic())
+            full = len(self.pending[table]) >= self.max_rows
+            if self.max_delay > 0:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='write-batcher', daemon=True)
+                    self.thread.start()
+                if full:
+                    self.lock.notify()
+        if self.max_delay <= 0:
+            self.flush(table)
+        return write.future
+
+    def _due(self, now: float) -> List[str]:
+        return [
+            table for table, writes in self.pending.items()
+            if writes and (len(writes) >= self.max_rows or now - self.oldest[table] >= self.max_delay)
+        ]
+
+    def _run(self) -> None:
+        while True:
+            with self.lock:
+                while True:
+                    now = time.monotonic()
+                    due = self._due(now)
+                    if due:
+                        break
+                    waits = [self.oldest[table] + self.max_delay - now for table, writes in self.pending.items() if writes]
+                    self.lock.wait(min(waits) if waits else None)
+            for table in due:
+                self.flush(table)
+
+    def flush(self, table: Optional[str] = None) -> None:
+        """Send everything queued (for one table, or all) now."""
+        with self.send_lock:
+            with self.lock:
+                tables = [table] if table else list(self.pending)
+                batches = {name: self.pending.pop(name, []) for name in tables}
+                for name in tables:
+                    self.oldest.pop(name, None)
+            for name, writes in batches.items():
+                self._send_table(name, writes)
+
+    def _send_table(self, table: str, writes: List[_Write]) -> None:
+        start = 0
+        while start < len(writes):
+            group = writes[start].group()
+            end = start + 1
+            while end < len(writes) and end - start < self.max_rows and writes[end].group() == group:
+                end += 1
+            self._send_group(table, writes[start:end])
+            start = end
+
+    def _send_group(self, table: str, writes: List[_Write]) -> None:
+        try:
+            results = self._insert(table, writes) if writes[0].kind == 'insert' else self._update(table, writes)
+        except Exception as exc:
+            if len(writes) > 1 and _rejected(exc):
+                for write in writes:
+                    self._send_group(table, [write])
+            else:
+                for write in writes:
+                    write.future.set_exception(exc)
+            return
+        for write, result in zip(writes, results):
+            write.future.set_result(result)
+
+    def _headers(self, prefer: str) -> dict:
+        return {
+            'apikey': self.api_key,
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+            'Prefer': prefer,
+        }
+
+    def _insert(self, table: str, writes: List[_Write]) -> list:
+        first = writes[0]
+        url = f"{self.base_url}/rest/v1/{table}"
+        prefer = 'return=representation' if first.returning else 'return=minimal'
+        if first.on_conflict:
+            url += f"?on_conflict={first.on_conflict}"
+            prefer = f'resolution=merge-duplicates,{prefer}'
+        self.requests += 1
+        rows = self.request(url, method='POST', headers=self._headers(prefer), body=[write.body for write in writes])
+        if first.returning and isinstance(rows, list) and len(rows) == len(writes):
+            return rows
+        return [None] * len(writes)
+
+    def _update(self, table: str, writes: List[_Write]) -> list:
+        column = writes[0].column
+        keys = list(dict.fromkeys(write.key for write in writes))
+        if len(keys) == 1:
+            condition = f'eq.{urllib.parse.quote(keys[0])}'
+        else:
+            condition = f"in.({urllib.parse.quote(','.join(keys), safe=',')})"
+        self.requests += 1
+        self.request(
+            f"{self.base_url}/rest/v1/{table}?{column}={condition}",
+            method='PATCH',
+            headers=self._headers('return=minimal'),
+            body=writes[0].body,
+        )
+        return [None] * len(writes)
@@ -0,0 +1,43 @@
+-- Daily complaint rollups maintained by the Telegram bot worker.
+-- One row per (local day, zone, category); rows are rebuilt whole-day and upserted,
+-- so reprocessing a day is idempotent.
+
+create table if not exists public.complaint_daily_rollups (
+    day date not null,
+    zone_id text not null,
+    category text not null,
+    complaint_count integer not null default 0,
+    open_count integer not null default 0,
+    resolved_count integer not null default 0,
+    severity_count integer not null default 0,
+    severity_sum numeric not null default 0,
+    severity_max numeric,
+    updated_at timestamptz not null default now(),
+    primary key (day, zone_id, category)
+);
+
+create index if not exists complaint_daily_rollups_zone_day_idx
+    on public.complaint_daily_rollups (zone_id, day);
+
+create index if not exists complaints_created_at_idx
+    on public.complaints (created_at);
+
+create or replace function public.touch_complaint_daily_rollups()
+returns trigger as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists complaint_daily_rollups_touch on public.complaint_daily_rollups;
+create trigger complaint_daily_rollups_touch
+    before update on public.complaint_daily_rollups
+    for each row execute function public.touch_complaint_daily_rollups();
+
+alter table public.complaint_daily_rollups enable row level security;
+
+drop policy if exists "complaint_daily_rollups read" on public.complaint_daily_rollups;
+create policy "complaint_daily_rollups read"
+    on public.complaint_daily_rollups for select
+    using (true);
@@ -0,0 +1,47 @@
+-- Resolution-time quantile sketches (merging t-digest), one per local day and
+-- (dimension, key) where dimension is zone, category or team. Percentiles for any
+-- date range are computed by merging the day sketches client-side.
+
+alter table public.complaints
+    add column if not exists resolved_at timestamptz;
+
+create or replace function public.set_complaint_resolved_at()
+returns trigger as $$
+begin
+    if new.status in ('VERIFIED', 'CLOSED') and new.resolved_at is null then
+        new.resolved_at = now();
+    elsif new.status not in ('VERIFIED', 'CLOSED') then
+        new.resolved_at = null;
+    end if;
+    return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists complaints_set_resolved_at on public.complaints;
+create trigger complaints_set_resolved_at
+    before insert or update of status on public.complaints
+    for each row execute function public.set_complaint_resolved_at();
+
+create index if not exists complaints_resolved_at_idx
+    on public.complaints (resolved_at)
+    where resolved_at is not null;
+
+create table if not exists public.resolution_sketches (
+    day date not null,
+    dimension text not null check (dimension in ('zone', 'category', 'team')),
+    key text not null,
+    sketch jsonb not null,
+    sample_count integer not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (day, dimension, key)
+);
+
+create index if not exists resolution_sketches_dimension_day_idx
+    on public.resolution_sketches (dimension, day);
+
+alter table public.resolution_sketches enable row level security;
+
+drop policy if exists "resolution_sketches read" on public.resolution_sketches;
+create policy "resolution_sketches read"
+    on public.resolution_sketches for select
+    using (true);
@@ -0,0 +1,25 @@
+-- Replay queue for complaint messages the bot could not process. Rows are claimed
+-- by setting lease_owner/lease_expires_at with a conditional update; a lease that
+-- has expired (or a retry delay that has passed) makes a pending row claimable again.
+
+create table if not exists public.failed_messages (
+    id uuid primary key default gen_random_uuid(),
+    telegram_user_id text,
+    telegram_chat_id text,
+    message_text text,
+    error_message text,
+    status text not null default 'pending',
+    created_at timestamptz not null default now()
+);
+
+alter table public.failed_messages
+    add column if not exists telegram_username text,
+    add column if not exists history jsonb,
+    add column if not exists attempts integer not null default 0,
+    add column if not exists lease_owner text,
+    add column if not exists lease_expires_at timestamptz,
+    add column if not exists processed_at timestamptz;
+
+create index if not exists failed_messages_pending_idx
+    on public.failed_messages (created_at)
+    where status = 'pending';
@@ -0,0 +1,17 @@
+-- Leases for work that must run on a single bot replica (notification feeds).
+-- A replica takes a lease with a conditional update (expired, or already its
+-- own) and renews it while alive; state carries the leader's feed watermarks
+-- so the next leader resumes where the previous one stopped.
+
+create table if not exists public.bot_leases (
+    name text primary key,
+    owner text not null,
+    expires_at timestamptz not null,
+    acquired_at timestamptz not null default now(),
+    state jsonb not null default '{}'::jsonb,
+    updated_at timestamptz not null default now()
+);
+
+-- Only the bot (service role, which bypasses RLS) may read or take leases;
+-- there are deliberately no policies for the anon or authenticated roles.
+alter table public.bot_leases enable row level security;
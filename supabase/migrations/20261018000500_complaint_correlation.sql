@@ -0,0 +1,15 @@
+-- Correlation id of the bot conversation that produced a complaint. The bot
+-- passes a token per complaint session to the agent, which stores it through
+-- submit_complaint; the bot then links the Telegram user with one conditional
+-- update on (correlation_id, telegram_user_id is null).
+
+alter table public.complaints
+    add column if not exists correlation_id text;
+
+create unique index if not exists complaints_correlation_id_idx
+    on public.complaints (correlation_id)
+    where correlation_id is not null;
+
+-- Replayed conversations keep their token.
+alter table public.failed_messages
+    add column if not exists correlation_id text;
@@ -0,0 +1,49 @@
+-- Push notifications of the row changes the Telegram bot notifies about, so it
+-- can LISTEN on 'bot_changes' instead of polling PostgREST. Only the table,
+-- operation and id are sent (NOTIFY payloads are limited to 8000 bytes); the
+-- bot fetches the rows itself. Notifications are delivered on commit and only
+-- to sessions listening at that moment, so the bot still reconciles by polling
+-- after reconnecting.
+
+create or replace function public.notify_bot_change()
+returns trigger as $$
+begin
+    perform pg_notify(
+        'bot_changes',
+        json_build_object('table', tg_table_name, 'op', lower(tg_op), 'id', new.id)::text
+    );
+    return null;
+end;
+$$ language plpgsql;
+
+-- Run sheets: whenever one becomes dispatched.
+drop trigger if exists run_sheets_notify_insert on public.run_sheets;
+create trigger run_sheets_notify_insert
+    after insert on public.run_sheets
+    for each row when (new.status = 'dispatched')
+    execute function public.notify_bot_change();
+
+drop trigger if exists run_sheets_notify_update on public.run_sheets;
+create trigger run_sheets_notify_update
+    after update of status on public.run_sheets
+    for each row when (new.status = 'dispatched' and old.status is distinct from new.status)
+    execute function public.notify_bot_change();
+
+-- Evidence: every insert and update; the bot decides what is verified.
+drop trigger if exists evidence_notify on public.evidence;
+create trigger evidence_notify
+    after insert or update on public.evidence
+    for each row execute function public.notify_bot_change();
+
+-- Complaints: transitions into VERIFIED or CLOSED.
+drop trigger if exists complaints_notify_insert on public.complaints;
+create trigger complaints_notify_insert
+    after insert on public.complaints
+    for each row when (new.status in ('VERIFIED', 'CLOSED'))
+    execute function public.notify_bot_change();
+
+drop trigger if exists complaints_notify_update on public.complaints;
+create trigger complaints_notify_update
+    after update of status on public.complaints
+    for each row when (new.status in ('VERIFIED', 'CLOSED') and old.status is distinct from new.status)
+    execute function public.notify_bot_change();